@@ -0,0 +1,199 @@
+""" dataset_editorの各サブコマンドの性能を計測する。
+合成データセットを作成して各サブコマンドを別プロセスで実行し、
+実行時間, 1ファイルあたりのシステムコール数, ピークRSSをJSONで出力する。
+
+usage:
+    python -m benchmarks run --sizes 1000 10000 --out results.json
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks startup --budget_ms 100
+"""
+from __future__ import annotations
+from argparse import ArgumentParser, RawTextHelpFormatter
+import json
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks import startup
+from benchmarks.cases import CASES, Inputs
+
+
+ROOT_DIR = Path(__file__).absolute().parent.parent
+PROBE = Path(__file__).absolute().parent.joinpath("probe.py")
+
+
+def add_arguments(parser: ArgumentParser) -> ArgumentParser:
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                            help="num files of synthetic datasets. default is 1000 10000")
+    run_parser.add_argument("--cases", type=str, nargs="+", choices=list(CASES.keys()), default=list(CASES.keys()),
+                            help="subcommands to run. default is all")
+    run_parser.add_argument("--file_size", type=int, default=64, help="bytes per synthetic file. default is 64")
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs per case. the fastest is reported")
+    run_parser.add_argument("--workdir", type=str, default=None,
+                            help="dir for synthetic data. reused between runs. default is a temp dir")
+    run_parser.add_argument("--strace", action="store_true",
+                            help="count all syscalls with 'strace -f -c' (extra run per case)")
+    run_parser.add_argument("--out", type=str, default=None, help="result json. default is stdout")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result json")
+    compare_parser.add_argument("base", type=str)
+    compare_parser.add_argument("target", type=str)
+
+    startup_parser = subparsers.add_parser("startup", help="check CLI startup time. exit 1 on regression")
+    startup_parser.add_argument("--budget_ms", type=float, default=startup.DEFAULT_BUDGET_MS,
+                                help=f"allowed overhead over 'python -c pass'. default is {startup.DEFAULT_BUDGET_MS}")
+    startup_parser.add_argument("--repeat", type=int, default=10)
+    return parser
+
+
+def main(*args, **kwargs):
+    if kwargs["command"] == "run":
+        run(**kwargs)
+    elif kwargs["command"] == "compare":
+        compare(Path(kwargs["base"]), Path(kwargs["target"]))
+    elif kwargs["command"] == "startup":
+        if not startup.check(kwargs["budget_ms"], kwargs["repeat"]):
+            sys.exit(1)
+
+
+def run(*args, **kwargs):
+    workdir = Path(kwargs["workdir"]) if kwargs["workdir"] is not None else Path(tempfile.mkdtemp(prefix="dataset_editor_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    use_strace = kwargs["strace"]
+    if use_strace and shutil.which("strace") is None:
+        print("[Warning] strace is not found. syscalls are not counted", file=sys.stderr)
+        use_strace = False
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for num_files in kwargs["sizes"]:
+            inputs = Inputs(workdir.joinpath(f"inputs_{num_files}"), num_files, kwargs["file_size"])
+            for name in kwargs["cases"]:
+                result = run_case(name, inputs, workdir, num_files, kwargs["repeat"], use_strace)
+                print(f"{name:>15} {num_files:>8} files: {result['wall_s']:8.3f} s, "
+                      f"{result['peak_rss_kb'] or 0:>8} KB, ok={result['ok']}", file=sys.stderr)
+                results.append(result)
+    finally:
+        if kwargs["workdir"] is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": read_version(),
+        "git": read_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if kwargs["out"] is None:
+        print(text)
+    else:
+        Path(kwargs["out"]).write_text(text)
+
+
+def run_case(name: str, inputs: Inputs, workdir: Path, num_files: int, repeat: int, use_strace: bool) -> Dict[str, Any]:
+    best: Optional[Dict[str, Any]] = None
+    for i in range(repeat):
+        run_dir = workdir.joinpath(f"run_{name}_{num_files}_{i}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        run_dir.mkdir()
+        argv = CASES[name](inputs, run_dir, num_files)
+        probe_json = run_dir.joinpath(".probe.json")
+
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, str(PROBE), str(probe_json)] + argv,
+            cwd=run_dir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        wall_s = time.perf_counter() - start
+
+        probe = json.loads(probe_json.read_text()) if probe_json.exists() else {}
+        result = {
+            "case": name,
+            "num_files": num_files,
+            "ok": completed.returncode == 0,
+            "wall_s": wall_s,
+            "files_per_s": num_files / wall_s if wall_s > 0 else None,
+            "peak_rss_kb": probe.get("peak_rss_kb"),
+            "user_s": probe.get("user_s"),
+            "sys_s": probe.get("sys_s"),
+            "io_syscalls": probe.get("io_syscalls"),
+            "syscalls": None,
+        }
+        if not result["ok"]:
+            result["error"] = completed.stderr.decode(errors="replace").strip().splitlines()[-1:]
+        if best is None or wall_s < best["wall_s"]:
+            best = result
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    if use_strace and best["ok"]:
+        best["syscalls"] = count_syscalls(name, inputs, workdir, num_files)
+    for key in ["io_syscalls", "syscalls"]:
+        best[f"{key}_per_file"] = best[key] / num_files if best[key] is not None else None
+    return best
+
+
+def count_syscalls(name: str, inputs: Inputs, workdir: Path, num_files: int) -> Optional[int]:
+    run_dir = workdir.joinpath(f"strace_{name}_{num_files}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    run_dir.mkdir()
+    argv = CASES[name](inputs, run_dir, num_files)
+    summary = run_dir.joinpath(".strace.txt")
+    subprocess.run(
+        ["strace", "-f", "-c", "-o", str(summary), sys.executable, str(ROOT_DIR.joinpath("dataset_editor"))] + argv,
+        cwd=run_dir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    num_calls = None
+    for line in summary.read_text().splitlines():
+        words = line.split()
+        if len(words) >= 4 and words[-1] == "total":
+            num_calls = int(words[3])
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return num_calls
+
+
+def compare(base_path: Path, target_path: Path):
+    base = json.loads(base_path.read_text())
+    target = json.loads(target_path.read_text())
+    key2base = {(r["case"], r["num_files"]): r for r in base["results"]}
+    print(f"{base.get('version')} ({base.get('git')}) -> {target.get('version')} ({target.get('git')})")
+    print(f"{'case':>15} {'files':>8} | {'wall_s':>17} | {'peak_rss_kb':>17}")
+    for r in target["results"]:
+        b = key2base.get((r["case"], r["num_files"]))
+        if b is None:
+            continue
+        print(f"{r['case']:>15} {r['num_files']:>8} | "
+              f"{_ratio(b['wall_s'], r['wall_s'])} | {_ratio(b['peak_rss_kb'], r['peak_rss_kb'])}")
+
+
+def _ratio(base: Optional[float], target: Optional[float]) -> str:
+    if not base or target is None:
+        return f"{'-':>17}"
+    return f"{target:>10.3f} x{target / base:5.2f}"
+
+
+def read_version() -> Optional[str]:
+    for line in ROOT_DIR.joinpath("pyproject.toml").read_text().splitlines():
+        if line.startswith("version"):
+            return line.split("=")[1].strip().strip('"')
+    return None
+
+
+def read_git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser = add_arguments(parser)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,141 @@
+""" サブコマンドごとのベンチマークケース.
+各ケースは (inputs, run_dir, num_files) を受け取り、dataset_editorに渡す引数を返す.
+inputs はファイル数ごとに一度だけ作成して使い回す入力データ, run_dir は実行ごとの空ディレクトリ.
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmarks import generate
+
+
+class Inputs:
+    """ ファイル数ごとの入力データ. 初めて参照された時に作成する
+    """
+    def __init__(self, root: Path, num_files: int, file_size: int):
+        self.root: Path = root
+        self.num_files: int = num_files
+        self.file_size: int = file_size
+
+
+    def _get(self, name: str, make: Callable[[Path], Path]) -> Path:
+        path = self.root.joinpath(name)
+        done = self.root.joinpath(f".{name}.done")
+        if not done.exists():
+            make(path)
+            done.touch()
+        return path
+
+
+    @property
+    def frames(self) -> Path:
+        # xmlを含めて num_files になるように画像は半分
+        return self._get("frames", lambda p: generate.make_frames(p, self.num_files // 2, self.file_size))
+
+
+    @property
+    def frames_subset(self) -> Path:
+        return self._get("frames_subset", lambda p: generate.make_subset(self.frames, p))
+
+
+    @property
+    def numbered(self) -> Path:
+        self._get("numbered", lambda p: generate.make_numbered(p, self.num_files, self.file_size))
+        return self.root.joinpath("numbered/numberings")
+
+
+    @property
+    def datasets(self) -> Path:
+        self._get("annotations", lambda p: generate.make_datasets(p, self.num_files))
+        return self.root.joinpath("annotations/datasets")
+
+
+    @property
+    def nested(self) -> Path:
+        return self._get("nested", lambda p: generate.make_nested(p, self.num_files))
+
+
+def _link(src: Path, run_dir: Path) -> Path:
+    """ 入力の隣に出力を作るコマンド用に、run_dir内へ入力のsymlinkを置く
+    """
+    dst = run_dir.joinpath(src.name)
+    os.symlink(src, dst)
+    return dst
+
+
+def numbering(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["numbering", str(inputs.frames), str(run_dir.joinpath("out"))]
+
+
+def separate_train(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["separate_train", str(inputs.frames), str(run_dir), "--seed", "0"]
+
+
+def mkdir(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["mkdir", str(inputs.numbered), "-o", str(run_dir)]
+
+
+def ext_latest(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["ext_latest", str(inputs.datasets), str(run_dir)]
+
+
+def diff_copy(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["diff_copy", str(inputs.frames), str(inputs.frames_subset), "d1", str(run_dir)]
+
+
+def intersection(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["intersection", str(inputs.frames), str(inputs.frames_subset),
+            "--dst_dir", str(run_dir.joinpath("out"))]
+
+
+def reduce(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["reduce", str(_link(inputs.frames, run_dir))]
+
+
+def delete(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["delete", str(_link(inputs.numbered, run_dir)), str(n // 4), str(n // 2)]
+
+
+def choice(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["choice", str(_link(inputs.frames, run_dir)), str(max(1, n // 10))]
+
+
+def repair(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    imgs_dir = _link(inputs.numbered, run_dir)
+    return ["repair", str(imgs_dir), str(inputs.numbered.parent.joinpath("numbering2org.json"))]
+
+
+def move_into(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    tgt_dir = generate.make_numbered(run_dir.joinpath("tgt"), n, file_size=0)
+    return ["move_into", str(tgt_dir), "moved"]
+
+
+def break_nest(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["break_nest", str(_link(inputs.nested, run_dir)), "-n", "3"]
+
+
+def for_rsync(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["for_rsync", str(generate.make_for_rsync(run_dir.joinpath("src"), n))]
+
+
+def index(inputs: Inputs, run_dir: Path, n: int) -> List[str]:
+    return ["index", str(inputs.frames), "--catalog", str(run_dir.joinpath("catalog.sqlite3"))]
+
+
+CASES: Dict[str, Callable[[Inputs, Path, int], List[str]]] = {
+    "numbering": numbering,
+    "separate_train": separate_train,
+    "mkdir": mkdir,
+    "ext_latest": ext_latest,
+    "diff_copy": diff_copy,
+    "intersection": intersection,
+    "reduce": reduce,
+    "delete": delete,
+    "choice": choice,
+    "repair": repair,
+    "move_into": move_into,
+    "break_nest": break_nest,
+    "for_rsync": for_rsync,
+    "index": index,
+}
@@ -0,0 +1,116 @@
+""" ベンチマーク用の合成データセットを作成する
+"""
+from __future__ import annotations
+import datetime
+import os
+from pathlib import Path
+import random
+
+
+FRAMES_PER_GROUP = 250
+
+
+def _write(path: Path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _payload(rng: random.Random, file_size: int) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(file_size)) if file_size > 0 else b""
+
+
+def make_frames(root: Path, num_files: int, file_size: int = 64, with_xml: bool = True, seed: int = 0) -> Path:
+    """ '[prefix]_yyyymmdd_hhmmss_NNNNN.jpg' と同名の '.xml' を作る.
+    FRAMES_PER_GROUP 枚ごとに撮影日時グループが変わり、グループの大きさには揺らぎをつける.
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    payload = _payload(rng, file_size)
+    start = datetime.datetime(2021, 12, 1, 9, 0, 0)
+    group = 0
+    num_in_group = 0
+    group_size = FRAMES_PER_GROUP
+    for i in range(num_files):
+        if num_in_group >= group_size:
+            group += 1
+            num_in_group = 0
+            group_size = rng.randint(FRAMES_PER_GROUP // 2, FRAMES_PER_GROUP * 3 // 2)
+        date_time = start + datetime.timedelta(minutes=7 * group)
+        stem = f"cam{group % 3}_{date_time:%Y%m%d_%H%M%S}_{num_in_group + 1:05}"
+        _write(root.joinpath(f"{stem}.jpg"), payload)
+        if with_xml:
+            _write(root.joinpath(f"{stem}.xml"), b"<annotation/>")
+        num_in_group += 1
+    return root
+
+
+def make_subset(src: Path, root: Path, ratio: float = 0.5, seed: int = 0) -> Path:
+    """ srcのファイルの一部をハードリンクしたディレクトリを作る (diff_copy, intersection用)
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    for entry in os.scandir(src):
+        if rng.random() < ratio:
+            os.link(entry.path, root.joinpath(entry.name))
+    return root
+
+
+def make_numbered(root: Path, num_files: int, file_size: int = 64, prefix: str = "") -> Path:
+    """ '00001.jpg' 形式のディレクトリと numbering2org.json を作る
+    """
+    rng = random.Random(0)
+    imgs_dir = root.joinpath("numberings")
+    imgs_dir.mkdir(parents=True, exist_ok=True)
+    payload = _payload(rng, file_size)
+    filename_prefix = "" if prefix == "" else f"{prefix}_"
+    with root.joinpath("numbering2org.json").open("w") as f:
+        sep = "{\n"
+        for i in range(1, num_files + 1):
+            name = f"{filename_prefix}{i:05}.jpg"
+            _write(imgs_dir.joinpath(name), payload)
+            f.write(f'{sep}  "{name}": "org_{i:07}.jpg"')
+            sep = ",\n"
+        f.write("\n}")
+    return imgs_dir
+
+
+def make_datasets(root: Path, num_files: int, per_dataset: int = 500) -> Path:
+    """ 'datasets/dataset_xxxxx_XXXXX/anns/all/*.xml' 形式のデータセット群を作る
+    """
+    datasets_dir = root.joinpath("datasets")
+    for start in range(0, num_files, per_dataset):
+        end = min(start + per_dataset, num_files)
+        name = f"{start + 1:05}_{start + per_dataset:05}"
+        all_dir = datasets_dir.joinpath(f"dataset_{name}/anns/all")
+        all_dir.mkdir(parents=True, exist_ok=True)
+        datasets_dir.joinpath(f"dataset_{name}/imgs_{name}").mkdir(exist_ok=True)
+        for i in range(start + 1, end + 1):
+            _write(all_dir.joinpath(f"{i:05}.xml"), b"<annotation/>")
+    return datasets_dir
+
+
+def make_nested(root: Path, num_files: int, depth: int = 3, fanout: int = 4) -> Path:
+    """ depth 階層, 各階層 fanout 個のディレクトリを持つツリーの末端にファイルを配置する
+    """
+    leaves = [root]
+    for _ in range(depth):
+        leaves = [d.joinpath(f"d{i}") for d in leaves for i in range(fanout)]
+    for d in leaves:
+        d.mkdir(parents=True, exist_ok=True)
+    for i in range(num_files):
+        _write(leaves[i % len(leaves)].joinpath(f"f_{i:07}.jpg"), b"")
+    return root
+
+
+def make_for_rsync(root: Path, num_files: int) -> Path:
+    """ for_rsync が抽出するキーワード(.sqlite3, train, ...)を含むアノテーション用データセット
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    _write(root.joinpath("annotation.sqlite3"), b"")
+    _write(root.joinpath("README.txt"), b"")
+    for kwd in ["train", "test", "val", "imgs", "tmp"]:
+        d = root.joinpath(f"{kwd}_data")
+        d.mkdir(exist_ok=True)
+        for i in range(num_files // 5):
+            _write(d.joinpath(f"{i:07}.xml"), b"")
+    return root
@@ -0,0 +1,51 @@
+""" dataset_editorを同一プロセスで実行し、終了時に資源使用量をJSONで書き出す.
+usage: python benchmarks/probe.py OUT_JSON SUBCOMMAND [ARGS ...]
+"""
+import json
+from pathlib import Path
+import resource
+import runpy
+import sys
+
+
+ROOT_DIR = Path(__file__).absolute().parent.parent
+
+
+def read_proc_io() -> dict:
+    """ /proc/self/io の syscr (read系) と syscw (write系) の呼び出し回数. Linux以外では空
+    """
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except OSError:
+        return {}
+
+
+def main():
+    out_json = sys.argv[1]
+    sys.argv = [str(ROOT_DIR.joinpath("dataset_editor"))] + sys.argv[2:]
+    returncode = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else 1
+    except BaseException as e:
+        print(f"[probe] {e!r}", file=sys.stderr)
+        returncode = 1
+    finally:
+        proc_io = read_proc_io()
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with open(out_json, "w") as f:
+            json.dump({
+                "returncode": returncode,
+                "peak_rss_kb": max(usage_self.ru_maxrss, usage_children.ru_maxrss),
+                "io_syscalls": proc_io.get("syscr", 0) + proc_io.get("syscw", 0) if proc_io else None,
+                "user_s": usage_self.ru_utime + usage_children.ru_utime,
+                "sys_s": usage_self.ru_stime + usage_children.ru_stime,
+            }, f)
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
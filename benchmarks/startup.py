@@ -0,0 +1,62 @@
+""" CLIの起動時間の計測と回帰チェック.
+バッチスクリプトから何千回も呼ばれるので、--helpや軽いサブコマンドで重いモジュールをimportしないことを確認する.
+"""
+from __future__ import annotations
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set
+
+
+ROOT_DIR = Path(__file__).absolute().parent.parent
+CLI = str(ROOT_DIR.joinpath("dataset_editor"))
+
+# 起動時間を計測するコマンド -> importしてはいけないモジュール
+COMMANDS: Dict[str, List[str]] = {
+    "--help": ["tqdm", "natsort", "numpy", "PIL", "xml.dom"],
+    "move_into --help": ["tqdm", "natsort", "numpy", "PIL", "xml.dom"],
+    "numbering --help": ["natsort", "numpy", "PIL", "xml.dom"],
+}
+DEFAULT_BUDGET_MS = 100.0
+
+
+def measure_ms(argv: List[str], repeat: int) -> float:
+    """ 起動から終了までの時間の中央値[ms]
+    """
+    times: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def imported_modules(args: List[str]) -> Set[str]:
+    completed = subprocess.run([sys.executable, "-X", "importtime", CLI] + args,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    names: Set[str] = set()
+    for line in completed.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            names.add(line.rsplit("|", 1)[1].strip())
+    return names
+
+
+def check(budget_ms: float = DEFAULT_BUDGET_MS, repeat: int = 10) -> bool:
+    """ Pythonインタプリタ自体の起動時間を除いたオーバーヘッドが budget_ms 以内で、
+    禁止モジュールをimportしていなければTrue
+    """
+    ok = True
+    base_ms = measure_ms([sys.executable, "-c", "pass"], repeat)
+    print(f"{'python -c pass':>20}: {base_ms:7.1f} ms")
+    for command, forbidden in COMMANDS.items():
+        args = command.split()
+        overhead_ms = measure_ms([sys.executable, CLI] + args, repeat) - base_ms
+        imported = imported_modules(args)
+        leaked = [name for name in forbidden if name in imported]
+        is_ok = overhead_ms <= budget_ms and len(leaked) == 0
+        print(f"{command:>20}: +{overhead_ms:6.1f} ms (budget {budget_ms:.0f} ms)"
+              f"{'' if len(leaked) == 0 else f', imports {leaked}'} -> {'ok' if is_ok else 'NG'}")
+        ok = ok and is_ok
+    return ok
@@ -1,4 +1,6 @@
-def __add_path():
+def add_path():
+    """ `python dataset_editor` で実行した時に `dataset_editor` パッケージをimportできるようにする
+    """
     import sys
     from pathlib import Path
 
@@ -7,6 +9,3 @@ def __add_path():
 
     if str(root_dir) not in sys.path:
         sys.path.insert(0, str(root_dir))
-
-
-__add_path()
\ No newline at end of file
@@ -5,34 +5,57 @@ DESCRIPTION= __doc__
 
 
 import os
-from argparse import ArgumentParser, _SubParsersAction, RawTextHelpFormatter
-import subprocess
+from argparse import ArgumentParser, _SubParsersAction, RawTextHelpFormatter, SUPPRESS
+import importlib
 from pathlib import Path
-
-import __add_path
+import sys
+from typing import Dict, List, Optional
 
 CURR_DIR = Path(os.path.curdir).absolute()
 FILE_DIR = Path(os.path.dirname(__file__)).absolute()
 PYTHON_PATH = FILE_DIR.joinpath("../.venv/bin/python")
 
-
-def add_arguments(parser: ArgumentParser):
+# サブコマンド名 -> モジュール名.
+# モジュールは実行するサブコマンドの分だけimportする(起動を速くするため)
+SUBCOMMANDS: Dict[str, str] = {
+    "numbering": "numbering_filename",
+    "repair": "repair_renamed_imgs",
+    "mkdir": "separate_dataset_and_mkdir",
+    "ext_latest": "extract_latest",
+    "separate_train": "separate_traindata",
+    "reduce": "reduce",
+    "choice": "choice_random",
+    "group": "group_histgram",
+    "diff_copy": "diff_copy",
+    "for_rsync": "mkdirs_for_rsync_dataset",
+    "move_into": "move_into",
+    "break_nest": "break_nest",
+    "delete": "delete",
+    "intersection": "intersection",
+    "index": "index_catalog",
+    "watch": "watch_numbering",
+}
+
+
+def add_arguments(parser: ArgumentParser, argv: Optional[List[str]] = None):
+    """ argvで指定されたサブコマンドのみモジュールをimportして引数を登録する.
+    サブコマンドが無い場合(--help等)はモジュールをimportせずに一覧だけ登録する.
+    argvがNoneの場合は全てのサブコマンドを登録する.
+    """
+    add_common_arguments(parser)
     subparsers = parser.add_subparsers()
 
-    add_numbering(subparsers)
-    add_repair(subparsers)
-    add_mkdir(subparsers)
-    add_extract_latest(subparsers)
-    add_separate_traindata(subparsers)
-    add_reduce(subparsers)
-    add_choice(subparsers)
-    add_group(subparsers)
-    add_diff_copy(subparsers)
-    add_for_rsync(subparsers)
-    add_move_into(subparsers)
-    break_nest(subparsers)
-    delete(subparsers)
-    add_intersection(subparsers)
+    if argv is None:
+        for name in SUBCOMMANDS.keys():
+            add_subcommand(subparsers, name)
+        return parser
+
+    name = find_subcommand(argv)
+    if name is not None:
+        add_subcommand(subparsers, name)
+    else:
+        for name, module_name in SUBCOMMANDS.items():
+            subparsers.add_parser(name, help=read_doc(module_name))
 
     return parser
 
@@ -43,217 +66,88 @@ def main(*args, **kwargs):
         handler(**kwargs)
     else:
         parser = ArgumentParser(description=DESCRIPTION, formatter_class=RawTextHelpFormatter)
-        add_arguments(parser)
+        add_arguments(parser, [])
         parser.print_help()
 
 
-def add_numbering(subparsers:_SubParsersAction):
-    from dataset_editor import numbering_filename
-    parser:ArgumentParser = subparsers.add_parser(
-        "numbering", help=numbering_filename.__doc__)
-    parser = numbering_filename.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        numbering_filename.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_repair(subparsers:_SubParsersAction):
-    from dataset_editor import repair_renamed_imgs
-    parser:ArgumentParser = subparsers.add_parser(
-        "repair",
-        help=repair_renamed_imgs.__doc__,
-        description=repair_renamed_imgs.__doc__
-    )
-    parser = repair_renamed_imgs.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        repair_renamed_imgs.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_mkdir(subparsers:_SubParsersAction):
-    from dataset_editor import separate_dataset_and_mkdir
-    parser:ArgumentParser = subparsers.add_parser(
-        "mkdir",
-        help=separate_dataset_and_mkdir.__doc__,
-        description=separate_dataset_and_mkdir.__doc__,
-    )
-    parser = separate_dataset_and_mkdir.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        separate_dataset_and_mkdir.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_extract_latest(subparsers:_SubParsersAction):
-    from dataset_editor import extract_latest
+def find_subcommand(argv: List[str]) -> Optional[str]:
+    """ 最初の位置引数をサブコマンド名とする. 共通オプションの値(--metrics-json reduce 等)は飛ばす
+    """
+    common = ArgumentParser(add_help=False)
+    add_common_arguments(common)
+    value_options = {option for action in common._actions if action.nargs != 0 for option in action.option_strings}
+
+    is_value = False
+    for arg in argv:
+        if is_value:
+            is_value = False
+            continue
+        if arg in value_options:
+            is_value = True
+            continue
+        if arg.startswith("-"):
+            continue
+        return arg if arg in SUBCOMMANDS else None
+    return None
+
+
+def read_doc(module_name: str) -> Optional[str]:
+    """ モジュールをimportせずに先頭のdocstringを読む(astで全体を解析するより速い)
+    """
+    path = FILE_DIR.joinpath(f"{module_name}.py")
+    with path.open("r", encoding="utf-8") as f:
+        text = f.read()
+    start = text.find('"""')
+    end = text.find('"""', start + 3)
+    if start < 0 or end < 0:
+        return None
+    return text[start + 3:end]
+
+
+def add_common_arguments(parser: ArgumentParser, default=None):
+    """ 全サブコマンド共通のオプション. サブコマンドにはdefault=SUPPRESSで登録する
+    """
+    parser.add_argument("--dry-run", "--dry_run", dest="dry_run", action="store_true",
+                        default=False if default is None else default,
+                        help="show the planned file operations and exit without changing anything")
+    parser.add_argument("--metrics-json", "--metrics_json", dest="metrics_json", type=str, metavar="PATH",
+                        default=default,
+                        help="write phase timings, throughput and per-file latency histogram as json")
+    parser.add_argument("--profile", type=str, choices=["cpu", "mem"], default=default,
+                        help="run the subcommand under cProfile (cpu) or tracemalloc (mem) and show the top entries")
+    parser.add_argument("--profile-out", "--profile_out", dest="profile_out", type=str, metavar="PATH",
+                        default=default,
+                        help="pstats or tracemalloc snapshot path. default is '[subcommand].pstats' or '[subcommand].tracemalloc'")
+    parser.add_argument("--trace-io", "--trace_io", dest="trace_io", action="store_true",
+                        default=False if default is None else default,
+                        help="count filesystem calls (stat, open, mkdir, symlink, ...) per phase. calls made by imports are not counted")
+
+
+def add_subcommand(subparsers:_SubParsersAction, name: str):
+    module = importlib.import_module(f"dataset_editor.{SUBCOMMANDS[name]}")
     parser:ArgumentParser = subparsers.add_parser(
-        "ext_latest",
-        help=extract_latest.__doc__,
-        description=extract_latest.__doc__,
+        name,
+        help=module.__doc__,
+        description=module.__doc__,
     )
-    parser = extract_latest.add_arguments(parser)
+    parser = module.add_arguments(parser)
+    # サブコマンドの後ろに書いた場合も受け付ける(前に書いた値を上書きしないようにSUPPRESS)
+    add_common_arguments(parser, default=SUPPRESS)
 
     def call(*args, **kwargs):
-        extract_latest.main(**kwargs)
+        from dataset_editor import metrics, profiling
+        profile = kwargs.get("profile")
+        profile_out = kwargs.get("profile_out") or (profiling.default_out_path(profile, name) if profile else None)
+        with metrics.command(name, kwargs.get("metrics_json")), profiling.trace_io(kwargs.get("trace_io", False)):
+            profiling.run(profile, lambda: module.main(**kwargs), profile_out)
 
     parser.set_defaults(handler=call)
 
 
-def add_separate_traindata(subparsers:_SubParsersAction):
-    from dataset_editor import separate_traindata
-    parser:ArgumentParser = subparsers.add_parser(
-        "separate_train",
-        help=separate_traindata.__doc__,
-        description=separate_traindata.__doc__,
-    )
-    parser = separate_traindata.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        separate_traindata.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_reduce(subparsers:_SubParsersAction):
-    from dataset_editor import reduce
-    parser:ArgumentParser = subparsers.add_parser(
-        "reduce",
-        help=reduce.__doc__,
-        description=reduce.__doc__,
-    )
-    reduce.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        reduce.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_choice(subparsers:_SubParsersAction):
-    from dataset_editor import choice_random
-    parser:ArgumentParser = subparsers.add_parser(
-        "choice",
-        help=choice_random.__doc__,
-        description=choice_random.__doc__
-    )
-    parser = choice_random.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        choice_random.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_group(subparsers:_SubParsersAction):
-    from dataset_editor import group_histgram
-    parser:ArgumentParser = subparsers.add_parser(
-        "group",
-        help=group_histgram.__doc__,
-        description=group_histgram.__doc__
-    )
-    parser = group_histgram.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        group_histgram.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_diff_copy(subparsers:_SubParsersAction):
-    from dataset_editor import diff_copy
-    parser:ArgumentParser = subparsers.add_parser(
-        "diff_copy",
-        help=diff_copy.__doc__,
-        description=diff_copy.__doc__
-    )
-    parser = diff_copy.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        diff_copy.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_for_rsync(subparsers:_SubParsersAction):
-    from dataset_editor import mkdirs_for_rsync_dataset
-    parser:ArgumentParser = subparsers.add_parser(
-        "for_rsync", 
-        help=mkdirs_for_rsync_dataset.__doc__,
-        description=mkdirs_for_rsync_dataset.__doc__
-    )
-    parser = mkdirs_for_rsync_dataset.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        mkdirs_for_rsync_dataset.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_move_into(subparsers:_SubParsersAction):
-    from dataset_editor import move_into
-    parser:ArgumentParser = subparsers.add_parser(
-        "move_into",
-        help=move_into.__doc__,
-        description=move_into.__doc__,
-    )
-    parser = move_into.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        move_into.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def break_nest(subparsers:_SubParsersAction):
-    from dataset_editor import break_nest
-    parser:ArgumentParser = subparsers.add_parser(
-        "break_nest",
-        help=break_nest.__doc__,
-        description=break_nest.__doc__,
-    )
-    parser = break_nest.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        break_nest.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def delete(subparsers:_SubParsersAction):
-    from dataset_editor import delete
-    parser:ArgumentParser = subparsers.add_parser(
-        "delete",
-        help=delete.__doc__,
-        description=delete.__doc__,
-    )
-    parser = delete.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        delete.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
-
-def add_intersection(subparsers:_SubParsersAction):
-    from dataset_editor import intersection
-    parser:ArgumentParser = subparsers.add_parser(
-        "intersection",
-        help=intersection.__doc__,
-        description=intersection.__doc__,
-    )
-    parser = intersection.add_arguments(parser)
-
-    def call(*args, **kwargs):
-        intersection.main(**kwargs)
-
-    parser.set_defaults(handler=call)
-
 if __name__ == "__main__":
+    from __add_path import add_path
+    add_path()
+
     parser = ArgumentParser(description=DESCRIPTION, formatter_class=RawTextHelpFormatter)
-    parser = add_arguments(parser)
+    parser = add_arguments(parser, sys.argv[1:])
     main(**vars(parser.parse_args()))
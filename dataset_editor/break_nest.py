@@ -1,9 +1,13 @@
 """ ネストされたディレクトリをルートディレクトリに統合する
 """
 from __future__ import annotations
+from collections import deque
+import os
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
-import shutil
+from typing import Deque, Iterable, Iterator, List, Tuple
+
+from dataset_editor import plan, transfer
 
 
 def add_arguments(parser: ArgumentParser):
@@ -14,6 +18,8 @@ def add_arguments(parser: ArgumentParser):
          + "Default is 'target_dir_break-nest'.\n"
          + "You can use existed dir. "
          + "If you use this option, Save format is 'save_dir/target_dir'!")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
 
     return parser
 
@@ -24,11 +30,12 @@ def main(*args, **kwargs):
     myargs = Args(**kwargs)
 
     print("対象パスを検索")
-    paths: list[Path] = find_paths_from_nest(myargs.target_dir, myargs.num_nest)
+    paths = find_paths_from_nest(myargs.target_dir, myargs.num_nest)
 
     print("以下ディレクトリに書き込みます")
     print(f"・{myargs.save_dir}")
-    write_paths(myargs.save_dir, paths)
+    # 走査しながらバッチごとにコピーする(全ファイルの操作を積まない)
+    plan.Executor.from_kwargs(kwargs).run_stream(plan_paths(myargs.save_dir, paths))
     print("Finish!")
     print("──────")
 
@@ -80,41 +87,71 @@ class Args:
         return save_dir
 
 
-def find_paths_from_nest(tgt_path: Path, num_nest:int=1) -> list[Path]:
-    files: list[Path] = []
-    dirs: list[Path] = []
-
-    dirs.append(tgt_path)
-    new_files: list[Path]
-    new_dirs: list[Path]
-    for ni in range(num_nest+1):
-        for dj in range(len(dirs)):
-            d: Path = dirs.pop(0)
-            new_files, new_dirs = find_file_and_dir(d)
-            files = files + new_files
-            dirs = dirs + new_dirs
-    return files + dirs
-
-
-def find_file_and_dir(path: Path) -> tuple[list[Path], list[Path]]:
-    files: list[Path] = []
-    dirs: list[Path] = []
-    for p2 in path.glob("*"):
-        if p2.is_file():
-            files.append(p2)
-        else:
-            dirs.append(p2)
-    return files, dirs
-
-
-def write_paths(save_dir: Path, paths: list[Path]):
-    save_dir.mkdir(exist_ok=True)
-    for p in paths:
-        if p.is_file():
-            shutil.copy(str(p), str(save_dir))
+def find_paths_from_nest(tgt_path: Path, num_nest:int=1) -> Iterator[Tuple[Path, bool]]:
+    """ tgt_pathからnum_nest段下までのファイルと、それより深いディレクトリを (path, is_dir) で順に返す.
+    幅優先で1ディレクトリにつき1回だけscandirし、ファイルは読みながら返す(一覧を作らない).
+    '.'から始まるエントリも対象(Path.glob("*")と同じ)
+    """
+    queue: Deque[Tuple[Path, int]] = deque([(tgt_path, 0)])
+    while len(queue) > 0:
+        d, depth = queue.popleft()
+        dirs: List[Path] = []
+        with os.scandir(d) as it:
+            for entry in it:
+                try:
+                    is_file = entry.is_file()
+                    is_dir = not is_file and entry.is_dir()
+                except OSError: # 壊れたリンク等
+                    continue
+                if is_file:
+                    yield d.joinpath(entry.name), False
+                elif is_dir:
+                    dirs.append(d.joinpath(entry.name))
+        for path in dirs:
+            if depth < num_nest:
+                queue.append((path, depth + 1))
+            else:
+                yield path, True
+
+
+def plan_paths(save_dir: Path, paths: Iterable[Tuple[Path, bool]]) -> Iterator[plan.Op]:
+    """ ファイルはsave_dir直下へ、ディレクトリは中身を展開してsave_dir/dir_name以下へコピーする操作を、走査しながら順に返す.
+    各ディレクトリのmkdirはその中へのcopyより先に返す
+    """
+    yield plan.Op("mkdir", save_dir)
+    save_root = os.fspath(save_dir)
+    for p, is_dir in paths:
+        if is_dir:
+            yield from plan_tree(p, save_dir.joinpath(p.name))
         else:
-            save_dir2 = Path(f"{save_dir}/{p.name}")
-            shutil.copytree(str(p), str(save_dir2))
+            yield plan.Op("copy", os.path.join(save_root, p.name), os.fspath(p)) # 大量に作るので文字列で持つ
+
+
+def plan_tree(src_dir: Path, dst_dir: Path) -> Iterator[plan.Op]:
+    """ shutil.copytreeと同じくsymlinkは辿って実体をコピーする.
+    祖先ディレクトリの(st_dev, st_ino)を持ち回り、祖先に戻るリンク(循環)は辿らない.
+    """
+    queue: Deque[Tuple[str, Path, Tuple[Tuple[int, int], ...]]] = deque([(str(src_dir), dst_dir, ())])
+    while len(queue) > 0:
+        src, dst, ancestors = queue.popleft()
+        st = os.stat(src)
+        key = (st.st_dev, st.st_ino)
+        if key in ancestors:
+            print(f"[Warning] skip symlink loop {src}")
+            continue
+        ancestors = ancestors + (key,)
+
+        yield plan.Op("mkdir", dst)
+        with os.scandir(src) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    queue.append((entry.path, dst.joinpath(entry.name), ancestors))
+                else:
+                    yield plan.Op("copy", os.path.join(dst, entry.name), entry.path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,434 @@
+""" データセットのファイル一覧のカタログ(SQLite)
+'index' サブコマンドがディレクトリごとにファイル名、サイズ、更新日時、ファイル名の解析結果(schema)と
+numbering2org.json のリネーム情報を保存する. 各サブコマンドは --catalog を指定するとディレクトリを走査せずにカタログに問い合わせる.
+
+ファイル名とパスはUTF-8でない名前もそのまま戻せるように os.fsencode したバイト列(BLOB)で保存する.
+
+カタログはディレクトリの更新日時(mtime)で差分更新する. 問い合わせる時も記録時とmtimeが異なるディレクトリは走査に戻る.
+ディレクトリのmtimeはファイルの追加、削除、名前変更で変わるが、既存ファイルの上書きでは変わらないので、
+記録されたファイルのサイズと更新日時は古い場合がある.
+"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import json
+import os
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from dataset_editor import metrics, schema
+from dataset_editor import scan as _scan
+
+
+DEFAULT_PATH = "dataset_catalog.sqlite3"
+VERSION = 3 # 2: 'yyyymmdd_hhmmss_NNNNN'(接頭辞なし)を有効な名前として解析する, 3: 名前とパスをBLOBで保存する
+NUMBERING_JSON_NAME = "numbering2org.json" # numbering_filename.JSON_NAME
+INSERT_BATCH_SIZE = 10000
+KEYS = ["name", "stem"]
+# os.fsencodeして保存する列
+BLOB_COLUMNS = {
+    "dirs": ["path"],
+    "files": ["name", "stem", "suffix", "prefix"],
+    "numbering": ["numbered", "org"],
+    "splits": ["name"],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    path BLOB NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    dir_id INTEGER NOT NULL REFERENCES dirs(id) ON DELETE CASCADE,
+    name BLOB NOT NULL,
+    stem BLOB NOT NULL,
+    suffix BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    reason TEXT,
+    date INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    frame INTEGER NOT NULL,
+    prefix BLOB NOT NULL,
+    grp TEXT,
+    PRIMARY KEY (dir_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_grp ON files (dir_id, grp);
+CREATE INDEX IF NOT EXISTS files_stem ON files (dir_id, stem);
+CREATE TABLE IF NOT EXISTS numbering (
+    dir_id INTEGER NOT NULL REFERENCES dirs(id) ON DELETE CASCADE,
+    numbered BLOB NOT NULL,
+    org BLOB NOT NULL,
+    PRIMARY KEY (dir_id, numbered)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS splits (
+    dir_id INTEGER NOT NULL REFERENCES dirs(id) ON DELETE CASCADE,
+    name BLOB NOT NULL,
+    split TEXT NOT NULL,
+    PRIMARY KEY (dir_id, name)
+) WITHOUT ROWID;
+"""
+
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("--catalog", type=str, default=None, metavar="PATH",
+                        help="read file lists from the catalog made by the 'index' subcommand instead of scanning. "
+                        "Dirs changed since indexing are scanned as usual.")
+
+
+class Catalog:
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._con = sqlite3.connect(str(self.path))
+        self._con.execute("PRAGMA foreign_keys = ON")
+        self._con.execute("PRAGMA journal_mode = WAL")
+        self._con.execute("PRAGMA synchronous = NORMAL")
+        version = self._con.execute("PRAGMA user_version").fetchone()[0]
+        assert version in (0, 1, 2, VERSION), f"unsupported catalog version {version}: {self.path}"
+        with self._con:
+            self._con.executescript(SCHEMA)
+            if version == 1: # ファイル名の解析結果が変わったので全ディレクトリを読み直させる
+                self._con.execute("DELETE FROM dirs")
+            if version in (1, 2): # TEXTの名前はUTF-8なので、BLOBにしてもos.fsencodeと同じバイト列
+                for table, columns in BLOB_COLUMNS.items():
+                    self._con.execute(f"UPDATE {table} SET " + ", ".join(f"{c} = CAST({c} AS BLOB)" for c in columns))
+            self._con.execute(f"PRAGMA user_version = {VERSION}")
+
+
+    def __enter__(self) -> Catalog:
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self._con.close()
+
+
+    def dir_id(self, path: Union[str, Path], fresh: bool = True) -> Optional[int]:
+        """ ディレクトリのid. 未登録か、freshでmtimeが記録時と異なる場合はNone
+        """
+        key = _key(path)
+        row = self._con.execute("SELECT id, mtime_ns FROM dirs WHERE path = ?", (os.fsencode(key),)).fetchone()
+        if row is None:
+            return None
+        dir_id, mtime_ns = row
+        if fresh:
+            try:
+                if os.stat(key).st_mtime_ns != mtime_ns:
+                    return None
+            except OSError:
+                return None
+        return dir_id
+
+
+    def refresh(self, path: Union[str, Path], recursive: bool = False) -> Tuple[int, int]:
+        """ pathのディレクトリ(recursiveならその下の全ディレクトリ)のうち、mtimeが変わったものだけ読み直す.
+        無くなったディレクトリは削除する.
+
+        Returns:
+            Tuple[int, int]: 読み直したディレクトリ数, 変更がなかったディレクトリ数
+        """
+        root = _key(path)
+        num_indexed, num_skipped = 0, 0
+        seen: List[str] = []
+        stack = [root]
+        while len(stack) > 0:
+            d = stack.pop()
+            seen.append(d)
+            st = os.stat(d)
+            row = self._con.execute("SELECT id, mtime_ns FROM dirs WHERE path = ?", (os.fsencode(d),)).fetchone()
+            if row is not None and row[1] == st.st_mtime_ns:
+                num_skipped += 1
+                if recursive:
+                    stack += self._subdirs(d)
+                continue
+            subdirs = self._index_dir(d, st.st_mtime_ns)
+            num_indexed += 1
+            if recursive:
+                stack += subdirs
+        self._prune(root, seen if recursive else [root], recursive)
+        return num_indexed, num_skipped
+
+
+    def _subdirs(self, d: str) -> List[str]:
+        # 変更のないディレクトリの子は走査せずにカタログから辿る
+        prefix = d.rstrip(os.sep) + os.sep
+        rows = self._con.execute("SELECT path FROM dirs WHERE path > ? AND path < ?", _children_range(prefix)).fetchall()
+        paths = [os.fsdecode(p) for p, in rows]
+        return [p for p in paths if os.sep not in p[len(prefix):]]
+
+
+    def _index_dir(self, d: str, mtime_ns: int) -> List[str]:
+        """ dの直下のファイルを読み直す. 子ディレクトリのパスを返す
+        """
+        names: List[str] = []
+        stats: List[os.stat_result] = []
+        subdirs: List[str] = []
+        with os.scandir(d) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        stats.append(entry.stat())
+                        names.append(entry.name)
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                except OSError: # 壊れたリンク等
+                    continue
+        parsed = schema.parse(names)
+
+        with self._con:
+            row = self._con.execute("SELECT id FROM dirs WHERE path = ?", (os.fsencode(d),)).fetchone()
+            if row is None:
+                dir_id = self._con.execute(
+                    "INSERT INTO dirs (path, mtime_ns, indexed_at) VALUES (?, ?, ?)",
+                    (os.fsencode(d), mtime_ns, time.time())).lastrowid
+            else:
+                dir_id = row[0]
+                self._con.execute("UPDATE dirs SET mtime_ns = ?, indexed_at = ? WHERE id = ?",
+                                  (mtime_ns, time.time(), dir_id))
+                self._con.execute("DELETE FROM files WHERE dir_id = ?", (dir_id,))
+                self._con.execute("DELETE FROM numbering WHERE dir_id = ?", (dir_id,))
+            for batch in _batches(_file_rows(dir_id, names, stats, parsed), INSERT_BATCH_SIZE):
+                self._con.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            if NUMBERING_JSON_NAME in names:
+                self._import_numbering(dir_id, os.path.join(d, NUMBERING_JSON_NAME))
+        return subdirs
+
+
+    def _import_numbering(self, dir_id: int, json_path: str):
+        try:
+            with open(json_path, "r") as f:
+                numbered2org: Dict[str, str] = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Warning] skip {json_path}: {e}")
+            return
+        self._con.executemany("INSERT OR REPLACE INTO numbering VALUES (?, ?, ?)",
+                              ((dir_id, os.fsencode(k), os.fsencode(v)) for k, v in numbered2org.items()))
+
+
+    def _prune(self, root: str, seen: List[str], recursive: bool):
+        seen_set = set(seen)
+        if recursive:
+            prefix = root.rstrip(os.sep) + os.sep
+            rows = self._con.execute(
+                "SELECT id, path FROM dirs WHERE path = ? OR (path > ? AND path < ?)",
+                (os.fsencode(root),) + _children_range(prefix)).fetchall()
+        else:
+            rows = self._con.execute("SELECT id, path FROM dirs WHERE path = ?", (os.fsencode(root),)).fetchall()
+        gone = [(dir_id,) for dir_id, p in rows if os.fsdecode(p) not in seen_set]
+        if len(gone) > 0:
+            with self._con:
+                self._con.executemany("DELETE FROM dirs WHERE id = ?", gone)
+
+
+    def names_by_suffix(self, dir_id: int) -> Iterator[Tuple[str, str]]:
+        """ (ファイル名, 接尾辞)
+        """
+        for name, suffix in self._con.execute("SELECT name, suffix FROM files WHERE dir_id = ?", (dir_id,)):
+            yield os.fsdecode(name), os.fsdecode(suffix)
+
+
+    def parsed(self, dir_id: int, names: Iterable[str]) -> schema.ParsedNames:
+        """ namesのファイル名の解析結果をnamesと同じ順で返す. namesは名前順(sorted)であること.
+        カタログ側も名前順に読み、突き合わせながら進むので行を辞書にしない.
+        UTF-8でない名前は文字列とバイト列で順序が異なる場合があるので、突き合わせられなければ1件ずつ引く
+        """
+        parsed = schema.ParsedNames()
+        columns = "name, reason, date, time, frame, prefix"
+        rows = self._con.execute(f"SELECT {columns} FROM files WHERE dir_id = ? ORDER BY name", (dir_id,))
+        row = next(rows, None)
+        for name in names:
+            key = os.fsencode(name)
+            while row is not None and row[0] < key:
+                row = next(rows, None)
+            found = row
+            if found is None or found[0] != key:
+                found = self._con.execute(
+                    f"SELECT {columns} FROM files WHERE dir_id = ? AND name = ?", (dir_id, key)).fetchone()
+                assert found is not None, f"not found '{name}' in catalog"
+            _, reason, date, time_, frame, prefix = found
+            parsed.append(name, reason, date, time_, frame, os.fsdecode(prefix))
+        return parsed
+
+
+    def common_names(self, dir_ids: Sequence[int], key: str = "name") -> List[str]:
+        """ 全ディレクトリに共通するキー(name か stem)を持つ、先頭ディレクトリのファイル名
+        """
+        assert key in KEYS, f"{key}"
+        sql = "SELECT f.name FROM files f WHERE f.dir_id = ?"
+        for _ in dir_ids[1:]:
+            sql += f" AND EXISTS (SELECT 1 FROM files g WHERE g.dir_id = ? AND g.{key} = f.{key})"
+        return [os.fsdecode(name) for name, in self._con.execute(sql, tuple(dir_ids))]
+
+
+    def numbering2org(self, dir_id: int) -> Dict[str, str]:
+        rows = self._con.execute("SELECT numbered, org FROM numbering WHERE dir_id = ?", (dir_id,))
+        return {os.fsdecode(numbered): os.fsdecode(org) for numbered, org in rows}
+
+
+    def save_splits(self, dir_id: int, split2names: Dict[str, Iterable[str]]):
+        """ 分割結果(ファイル名 -> trains/tests/vals)を置き換える
+        """
+        with self._con:
+            self._con.execute("DELETE FROM splits WHERE dir_id = ?", (dir_id,))
+            for split, names in split2names.items():
+                self._con.executemany("INSERT OR REPLACE INTO splits VALUES (?, ?, ?)",
+                                      ((dir_id, os.fsencode(name), split) for name in names))
+
+
+    def splits(self, dir_id: int) -> Dict[str, str]:
+        rows = self._con.execute("SELECT name, split FROM splits WHERE dir_id = ?", (dir_id,))
+        return {os.fsdecode(name): split for name, split in rows}
+
+
+def _key(path: Union[str, Path]) -> str:
+    return os.path.realpath(path)
+
+
+def _children_range(prefix: str) -> Tuple[bytes, bytes]:
+    """ prefix('/'で終わるパス)で始まるパスのBLOBの範囲 (下限, 上限). 上限は末尾の区切りの次のバイト
+    """
+    low = os.fsencode(prefix)
+    return low, low[:-1] + bytes([low[-1] + 1])
+
+
+def _file_rows(dir_id: int, names: List[str], stats: List[os.stat_result],
+               parsed: schema.ParsedNames) -> Iterator[tuple]:
+    for i, (name, st) in enumerate(zip(names, stats)):
+        stem, suffix = os.path.splitext(name)
+        reason = parsed.reason(i)
+        yield (dir_id, os.fsencode(name), os.fsencode(stem), os.fsencode(suffix), st.st_size, st.st_mtime_ns, reason,
+               parsed.dates[i], parsed.times[i], parsed.frames[i], os.fsencode(parsed.prefixes[parsed.prefix_ids[i]]),
+               parsed.date_time(i) if reason is None else None)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def open_catalog(catalog_path: Optional[str]) -> Optional[Catalog]:
+    """ catalog_pathがNoneか、ファイルが無ければNone
+    """
+    if catalog_path is None:
+        return None
+    if not os.path.exists(catalog_path):
+        print(f"[Warning] not found catalog {catalog_path}. scan dirs instead")
+        return None
+    return Catalog(catalog_path)
+
+
+def scan(path: Union[str, Path], catalog_path: Optional[str] = None, hidden: bool = True) -> _scan.ScanResult:
+    """ scan.scanと同じ結果をカタログから作る. カタログに無いか古いディレクトリは走査する.
+    カタログにはファイルしか記録しないので、カタログから作った結果のdirsは空
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        return _scan.scan(path, hidden=hidden)
+    with metrics.phase("scan"), cat:
+        dir_id = cat.dir_id(path)
+        if dir_id is None:
+            print(f"[Info] {path} is not indexed or changed since indexing. scan it")
+            return _scan._scan(path, hidden)
+        result = _scan.ScanResult(Path(path))
+        by_suffix = result.by_suffix
+        files = result.files
+        for name, suffix in cat.names_by_suffix(dir_id):
+            if not hidden and name.startswith("."):
+                continue
+            files.append(name)
+            if suffix not in by_suffix:
+                by_suffix[suffix] = []
+            by_suffix[suffix].append(name)
+        return result
+
+
+def iter_files(path: Union[str, Path], catalog_path: Optional[str] = None, hidden: bool = True,
+               suffixes: Optional[Iterable[str]] = None) -> Iterator[str]:
+    """ scan.iter_filesと同じ名前をカタログから返す. カタログに無いか古いディレクトリは走査する.
+    一覧を保持しないので、時間は呼び出し側でmetrics.phase("scan")に数える
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        yield from _scan.iter_files(path, hidden=hidden, suffixes=suffixes)
+        return
+    suffixes = None if suffixes is None else set(suffixes)
+    with cat:
+        dir_id = cat.dir_id(path)
+        if dir_id is None:
+            print(f"[Info] {path} is not indexed or changed since indexing. scan it")
+            yield from _scan.iter_files(path, hidden=hidden, suffixes=suffixes)
+            return
+        for name, suffix in cat.names_by_suffix(dir_id):
+            if not hidden and name.startswith("."):
+                continue
+            if suffixes is not None and suffix not in suffixes:
+                continue
+            yield name
+
+
+def parse(path: Union[str, Path], names: Iterable[str], catalog_path: Optional[str] = None) -> schema.ParsedNames:
+    """ schema.parse(names)と同じ結果をカタログから作る. namesはpath直下のファイル名で、名前順(sorted)であること
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        return schema.parse(names)
+    with metrics.phase("scan"), cat:
+        dir_id = cat.dir_id(path)
+        if dir_id is None:
+            return schema.parse(names)
+        return cat.parsed(dir_id, names)
+
+
+def common_names(paths: Sequence[Union[str, Path]], key: str, catalog_path: Optional[str] = None) -> Optional[List[str]]:
+    """ Catalog.common_names. いずれかのディレクトリがカタログに無いか古い場合はNone
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        return None
+    with metrics.phase("scan"), cat:
+        dir_ids = [cat.dir_id(p) for p in paths]
+        if any(dir_id is None for dir_id in dir_ids):
+            print("[Info] some dirs are not indexed or changed since indexing. scan them")
+            return None
+        return cat.common_names(dir_ids, key)
+
+
+def numbering2org(path: Union[str, Path], catalog_path: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """ pathに保存された numbering2org.json のリネーム情報. カタログに無い場合はNone
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        return None
+    with cat:
+        dir_id = cat.dir_id(path, fresh=False)
+        if dir_id is None:
+            return None
+        numbered2org = cat.numbering2org(dir_id)
+    return numbered2org if len(numbered2org) > 0 else None
+
+
+def save_splits(path: Union[str, Path], split2names: Dict[str, Iterable[str]], catalog_path: Optional[str] = None):
+    """ pathのファイルの分割結果を記録する. カタログに無いか古いディレクトリの場合は記録しない
+    """
+    cat = open_catalog(catalog_path)
+    if cat is None:
+        return
+    with cat:
+        dir_id = cat.dir_id(path)
+        if dir_id is None:
+            print(f"[Info] {path} is not indexed or changed since indexing. splits are not saved")
+            return
+        cat.save_splits(dir_id, split2names)
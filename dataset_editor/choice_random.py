@@ -4,11 +4,15 @@ from __future__ import annotations
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
 import random
-import shutil
+
+from dataset_editor import catalog, plan, transfer
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("dir", type=str, help="ファイルを含むディレクトリ")
     parser.add_argument("num", type=int, help="ランダム抽出数")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
+    catalog.add_arguments(parser)
 
     return parser
 
@@ -21,7 +25,7 @@ def main(*args, **kwargs):
     print(f"{num_choice} 個のデータを以下のディレクトリから抽出します")
     print(f"\t{data_dir}")
 
-    data_paths = [ p for p in data_dir.glob("*") if p.is_file() ]
+    data_paths = catalog.scan(data_dir, kwargs.get("catalog")).paths()
     assert len(data_paths) > 0
     assert len(data_paths) >= num_choice
 
@@ -31,9 +35,7 @@ def main(*args, **kwargs):
     print("抽出したデータを以下のディレクトリに保存します。")
     print(f"\t{out_dir}")
     assert not out_dir.exists()
-    out_dir.mkdir()
-    for path in data_paths:
-        shutil.copy(path, out_dir)
+    plan.Executor.from_kwargs(kwargs).run(plan.Plan().copy_into(data_paths, out_dir))
 
     print("終了しました。")
 
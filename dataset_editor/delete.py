@@ -3,7 +3,9 @@
 from __future__ import annotations
 from argparse import ArgumentParser
 from pathlib import Path
-import shutil
+from typing import Optional
+
+from dataset_editor import catalog, plan, schema, transfer
 
 
 EPILOG = """
@@ -17,6 +19,9 @@ def add_arguments(parser: ArgumentParser) -> ArgumentParser:
     parser.add_argument("dir", type=str, help="ファイルを含むディレクトリ")
     parser.add_argument("start", type=int, help="start number")
     parser.add_argument("end", type=int, help="end number")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
+    catalog.add_arguments(parser)
     return parser
 
 
@@ -28,48 +33,44 @@ def main(*args, **kwargs):
     end_num = int(kwargs['end'])
 
     ### get file paths
-    datum_paths: list[Path] = [p for p in data_dir.glob("*") if p.is_file()]
-    if len(datum_paths) == 0:
+    datum_names: list[str] = sorted(catalog.scan(data_dir, kwargs.get("catalog")).files)
+    if len(datum_names) == 0:
         print(f"Not Data in {data_dir}")
         return
+    datum_paths: list[Path] = [data_dir.joinpath(name) for name in datum_names]
+    parsed = catalog.parse(data_dir, datum_names, kwargs.get("catalog"))
 
     ### delete paths
     print(f"Pre Delete num file = {len(datum_paths)}")
-    datum_paths: list[Path] = delete(datum_paths, start_num, end_num)
+    datum_paths: list[Path] = delete(datum_paths, start_num, end_num, parsed)
     print(f"Post Delete num file = {len(datum_paths)}")
 
     ### save paths
     out_dir = Path(f"{data_dir}_deleted")
-    save_paths(datum_paths, out_dir)
+    save_paths(datum_paths, out_dir, plan.Executor.from_kwargs(kwargs))
 
     print("finish ! ! !")
 
 
-def delete(paths: list[Path], start_num: int, end_num: int):
-    dst_paths: list[Path] = []
-    stem2path: dict[str, Path] = {p.stem:p for p in paths}
-
-    for stem in stem2path.keys():
-        words = stem.split("_")
-        word = words[-1]
-        try:
-            num = int(word)
-        except:
-            dst_paths.append(stem2path[stem])
-        else:
-            if start_num <= num <= end_num:
-                continue
-            dst_paths.append(stem2path[stem])
-
-    dst_paths.sort()
+def delete(paths: list[Path], start_num: int, end_num: int, parsed: Optional[schema.ParsedNames] = None):
+    """ 名前が '_NNNNN' で終わり、その番号が start_num~end_num のものを除く. 番号の無いものは残す
+    parsedはpathsの解析結果(省略した場合はここで解析する). 残したpathsの順番は変えない
+    """
+    if parsed is None:
+        parsed = schema.parse(p.name for p in paths)
+    frames = parsed.frames
+    dst_paths: list[Path] = [
+        path for path, num in zip(paths, frames)
+        if num == schema.NO_FRAME or not (start_num <= num <= end_num)
+    ]
     return dst_paths
 
 
-def save_paths(paths: list[Path], out_dir: Path):
+def save_paths(paths: list[Path], out_dir: Path, executor: Optional[plan.Executor] = None):
     assert out_dir.parent.exists()
-    out_dir.mkdir(exist_ok=True)
-    for p in paths:
-        shutil.copy(str(p), str(out_dir))
+    if executor is None:
+        executor = plan.Executor()
+    executor.run(plan.Plan().copy_into(paths, out_dir))
 
 
 if __name__ == "__main__":
@@ -1,12 +1,17 @@
 """ ２つのディレクトリの差分を求めてコピーする
 """
 from __future__ import annotations
-from typing import List
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
 
-import tqdm
+from dataset_editor import plan, scan, transfer
+
+
+BLOCK_SIZE = 64 * 1024
 
 def add_arguments(parser:ArgumentParser) -> ArgumentParser:
     parser.add_argument("dir1", type=str, help="dir1")
@@ -14,6 +19,11 @@ def add_arguments(parser:ArgumentParser) -> ArgumentParser:
     parser.add_argument("mode", type=str, choices=["d1", "d2", "both"],
                         help="copy mode. d1 is dir1 only. d2 is dir2 only. both is both.")
     parser.add_argument("outdir", type=str, help="outdir")
+    parser.add_argument("--by", type=str, choices=["name", "content"], default="name",
+                        help="compare key. name is file name. content is file data (renamed duplicates are detected). default is name.")
+    parser.add_argument("--hash_workers", type=int, default=None,
+                        help="num processes for hashing in content mode. default is cpu count.")
+    transfer.add_arguments(parser)
     return parser
 
 
@@ -26,36 +36,112 @@ def main(*args, **kwargs):
     assert out_root_dir.exists(), f"Not Found dir {out_root_dir}"
 
     # find file paths
-    file_paths_dir1 = [p for p in dir1.glob("*") if p.is_file()]
-    file_paths_dir2 = [p for p in dir2.glob("*") if p.is_file()]
+    file_paths_dir1 = scan.scan(dir1).paths()
+    file_paths_dir2 = scan.scan(dir2).paths()
 
     # diff file paths dir1 and dir2
-    name2path_dir1 = {p.name:p for p in file_paths_dir1}
-    name2path_dir2 = {p.name:p for p in file_paths_dir2}
-    set_of_file_names_dir1 = set([name for name in name2path_dir1.keys()])
-    set_of_file_names_dir2 = set([name for name in name2path_dir2.keys()])
-    file_names_only_dir1 = list(set_of_file_names_dir1 - set_of_file_names_dir2)
-    file_names_only_dir2 = list(set_of_file_names_dir2 - set_of_file_names_dir1)
-    file_paths_only_dir1 = [name2path_dir1[name] for name in file_names_only_dir1]
-    file_paths_only_dir2 = [name2path_dir2[name] for name in file_names_only_dir2]
+    if kwargs['by'] == "content":
+        file_paths_only_dir1, file_paths_only_dir2 = diff_by_content(
+            file_paths_dir1, file_paths_dir2, kwargs['hash_workers'])
+    else:
+        file_paths_only_dir1, file_paths_only_dir2 = diff_by_name(file_paths_dir1, file_paths_dir2)
 
     # extract
     paths_list = []
     if kwargs['mode'] in ["d1", "both"]: paths_list.append(file_paths_only_dir1)
     if kwargs['mode'] in ["d2", "both"]: paths_list.append(file_paths_only_dir2)
+    executor = plan.Executor.from_kwargs(kwargs)
     for file_paths in paths_list:
-        extract_files(file_paths, out_root_dir)
+        extract_files(file_paths, out_root_dir, executor)
+
+
+def diff_by_name(paths1:List[Path], paths2:List[Path]) -> Tuple[List[Path], List[Path]]:
+    name2path_dir1 = {p.name:p for p in paths1}
+    name2path_dir2 = {p.name:p for p in paths2}
+    set_of_file_names_dir1 = set(name2path_dir1.keys())
+    set_of_file_names_dir2 = set(name2path_dir2.keys())
+    file_names_only_dir1 = list(set_of_file_names_dir1 - set_of_file_names_dir2)
+    file_names_only_dir2 = list(set_of_file_names_dir2 - set_of_file_names_dir1)
+    file_paths_only_dir1 = [name2path_dir1[name] for name in file_names_only_dir1]
+    file_paths_only_dir2 = [name2path_dir2[name] for name in file_names_only_dir2]
+    return file_paths_only_dir1, file_paths_only_dir2
+
+
+def diff_by_content(paths1:List[Path], paths2:List[Path], workers:Optional[int]=None) -> Tuple[List[Path], List[Path]]:
+    """ 内容が一致するファイルを持たないファイルを各ディレクトリから抽出する.
+    size -> 先頭/末尾ブロックのhash -> 全体のhash の順に絞り込み、
+    前段で相手側に同じキーが無いファイルは後段の読み込みを行わない.
+    """
+    # 1. size
+    keys1: Dict[Path, tuple] = {p:(os.stat(p).st_size,) for p in paths1}
+    keys2: Dict[Path, tuple] = {p:(os.stat(p).st_size,) for p in paths2}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 2. partial hash
+        # 3. full hash (先頭/末尾ブロックで全体を読んでいる小さいファイルは不要)
+        for hash_func, need in [
+                (partial_hash, lambda key: True),
+                (full_hash, lambda key: key[0] > 2 * BLOCK_SIZE)]:
+            targets1 = _tied(keys1, keys2, need)
+            targets2 = _tied(keys2, keys1, need)
+            targets = targets1 + targets2
+            if len(targets) == 0:
+                break
+            chunksize = max(1, len(targets) // (4 * workers))
+            for p, digest in zip(targets, executor.map(hash_func, targets, chunksize=chunksize)):
+                keys = keys1 if p in keys1 else keys2
+                keys[p] = keys[p] + (digest,)
+
+    set_of_keys1 = set(keys1.values())
+    set_of_keys2 = set(keys2.values())
+    file_paths_only_dir1 = [p for p, key in keys1.items() if key not in set_of_keys2]
+    file_paths_only_dir2 = [p for p, key in keys2.items() if key not in set_of_keys1]
+    return file_paths_only_dir1, file_paths_only_dir2
+
+
+def _tied(keys:Dict[Path, tuple], other_keys:Dict[Path, tuple], need) -> List[Path]:
+    """ 相手側に同じキーを持つファイルがあり、次段の比較が必要なファイル
+    """
+    set_of_other_keys = set(other_keys.values())
+    return [p for p, key in keys.items() if key in set_of_other_keys and need(key)]
+
+
+def partial_hash(path:Path) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(BLOCK_SIZE))
+        size = os.fstat(f.fileno()).st_size
+        if size > BLOCK_SIZE:
+            f.seek(max(BLOCK_SIZE, size - BLOCK_SIZE))
+            h.update(f.read(BLOCK_SIZE))
+    return h.digest()
+
+
+def full_hash(path:Path) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.digest()
 
 
-def extract_files(file_paths:List[Path], out_root_dir:Path):
+def extract_files(file_paths:List[Path], out_root_dir:Path, executor:Optional[plan.Executor]=None):
     if len(file_paths) == 0:
         return
-    for file_path in tqdm.tqdm(file_paths):
+    if executor is None:
+        executor = plan.Executor()
+    copy_plan = plan.Plan()
+    out_dirs = set()
+    for file_path in file_paths:
         dir_name = "_".join(file_path.parts[-3:-1])
         out_dir: Path = out_root_dir.joinpath(dir_name)
-        if not out_dir.exists(): out_dir.mkdir()
-        shutil.copy(str(file_path), str(out_dir))
-    print(f"extract {len(file_paths)} files to {out_dir}")
+        if out_dir not in out_dirs:
+            out_dirs.add(out_dir)
+            copy_plan.mkdir(out_dir)
+        copy_plan.copy(file_path, out_dir.joinpath(file_path.name))
+    executor.run(copy_plan)
+    print(f"extract {len(file_paths)} files to {', '.join(map(str, sorted(out_dirs)))}")
 
 
 if __name__ == "__main__":
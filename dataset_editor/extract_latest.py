@@ -7,69 +7,134 @@ EPILOG='''
 以下のようなディレクトリ構造を持つデータセット群を対象に最新のxmlファイルを一つのディレクトリにまとめる。
 [datasets/dataset_xxxxx_xxxxx/anns/all].
 コピー先はout_dirで指定されたディレクトリ上にannsというディレクトリを作成してソコにコピーを行う。
-同名のファイルは上書きされる。
+同名のファイルは更新日時が最も新しいものを採用する。
+コピー先に同じサイズ・更新日時のファイルが既にある場合はコピーしない(2回目以降は差分だけコピーされる)。
 '''
 import os
-import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
 import logging
-import glob
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from dataset_editor import metrics, plan, scan, transfer
 
 logging.basicConfig(level=logging.INFO)
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("datasets", type=str)
     parser.add_argument("out_dir", type=str)
+    transfer.add_arguments(parser)
 
     return parser
 
 
-def main(dict_args):
+class Ann(NamedTuple):
+    path: Path
+    mtime_ns: int
+    size: int
+
+
+def main(*args, **kwargs):
     # 対象datasetsディレクトリの存在確認
-    datasets_dir = Path(dict_args['datasets']).absolute()
+    datasets_dir = Path(kwargs['datasets']).absolute()
     if not datasets_dir.exists():
         logging.error(f"not found {datasets_dir}")
         sys.exit(0)
 
-    # セーブディレクトリの作成
-    out_dir = Path(dict_args['out_dir']).absolute()
+    # セーブディレクトリの確認
+    out_dir = Path(kwargs['out_dir']).absolute()
     if not out_dir.exists():
         logging.error(f"not found {out_dir}")
         sys.exit(0)
     save_dir = Path(f"{out_dir}/anns")
-    if not save_dir.exists():
-        save_dir.mkdir()
-        logging.info(f"mkdir {save_dir}")
 
     # 対象ディレクトリの下位にdatasetディレクトリを所持しているか確認
-    dataset_dirs = [Path(p) for p in glob.glob(f"{datasets_dir}/dataset_*", )]
+    scanned = scan.scan(datasets_dir, hidden=False)
+    dataset_dirs = scanned.paths([name for name in scanned.dirs if name.startswith("dataset_")])
     if len(dataset_dirs) == 0:
         logging.error(f"{datasets_dir} does not have dirs")
         sys.exit(0)
 
-    # アノテーションディレクトリ`all`からxmlをコピーを用いて抽出
-    for _dir in dataset_dirs:
-        try:
-            anns_dir = Path(glob.glob(f"{_dir}/ann*")[0]) # ann or anns
-        except:
-            logging.info(f"{_dir} not have anns dir")
-            continue
+    # アノテーションディレクトリ`all`のxmlを並列に探し、同名のファイルは最新のものを選ぶ
+    workers = kwargs.get('workers', transfer.DEFAULT_WORKERS)
+    with metrics.phase("scan"), ThreadPoolExecutor(max_workers=workers) as executor:
+        anns_list = list(executor.map(find_anns, dataset_dirs))
+    name2ann, num_found = select_latest(anns_list)
+    num_no_anns = sum(1 for anns in anns_list if anns is None)
+    logging.info(f"found {num_found} files in {len(dataset_dirs) - num_no_anns}/{len(dataset_dirs)} dataset dirs "
+                 f"({num_found - len(name2ann)} duplicated names)")
 
-        ann_dir = Path(f"{anns_dir}/all")
-        if not ann_dir.exists():
-            logging.info(f"{anns_dir} not have all dir")
+    # サイズと更新日時が一致するファイルは飛ばしてコピーする
+    copy_plan = plan.Plan().mkdir(save_dir)
+    saved = stat_files(save_dir) if save_dir.exists() else {}
+    num_skip = 0
+    for name, ann in name2ann.items():
+        if saved.get(name) == (ann.mtime_ns, ann.size):
+            num_skip += 1
             continue
+        copy_plan.copy(ann.path, save_dir.joinpath(name))
+    logging.info(f"copy {len(name2ann) - num_skip} files -> {save_dir} (skip {num_skip} up-to-date files)")
 
-        xml_paths = [ Path(p) for p in glob.glob(f"{ann_dir}/*")]
-        if len(xml_paths) == 0:
-            logging.info(f"{ann_dir} not have xml")
-            continue
+    # 更新日時を比較に使うのでcopy2でコピーする
+    plan.Executor.from_kwargs(kwargs, op=transfer.copy2, desc="copy").run(copy_plan)
+
+
+def find_anns(dataset_dir: Path) -> Optional[List[Tuple[str, Ann]]]:
+    """ dataset_dir/ann*/all 直下のファイルを返す. アノテーションディレクトリが無ければNone
+    """
+    scanned = scan.scan(dataset_dir, hidden=False)
+    anns_names = sorted(name for name in scanned.dirs if name.startswith("ann")) # ann or anns
+    if len(anns_names) == 0:
+        logging.debug(f"{dataset_dir} not have anns dir")
+        return None
 
-        for p in xml_paths:
-            shutil.copy(p, save_dir)
-            logging.info(f"copy {p} -> {save_dir}")
+    ann_dir = dataset_dir.joinpath(anns_names[0], "all")
+    if not ann_dir.is_dir():
+        logging.debug(f"{ann_dir.parent} not have all dir")
+        return None
+
+    anns: List[Tuple[str, Ann]] = []
+    for name, st in stat_files(ann_dir).items():
+        anns.append((name, Ann(ann_dir.joinpath(name), st[0], st[1])))
+    if len(anns) == 0:
+        logging.debug(f"{ann_dir} not have xml")
+    return anns
+
+
+def stat_files(path: Path) -> Dict[str, Tuple[int, int]]:
+    """ ファイル名 -> (更新日時[ns], サイズ)
+    """
+    name2stat: Dict[str, Tuple[int, int]] = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError: # 壊れたリンク等
+                continue
+            name2stat[entry.name] = (st.st_mtime_ns, st.st_size)
+    return name2stat
+
+
+def select_latest(anns_list: List[Optional[List[Tuple[str, Ann]]]]) -> Tuple[Dict[str, Ann], int]:
+    """ 同名のファイルは更新日時が最も新しいもの(同じならパスが後のもの)を選ぶ. 見つかったファイル数も返す
+    """
+    name2ann: Dict[str, Ann] = {}
+    num_found = 0
+    for anns in anns_list:
+        if anns is None:
+            continue
+        num_found += len(anns)
+        for name, ann in anns:
+            other = name2ann.get(name)
+            if other is None or (ann.mtime_ns, str(ann.path)) > (other.mtime_ns, str(other.path)):
+                name2ann[name] = ann
+    return name2ann, num_found
 
 
 if __name__ == "__main__":
@@ -4,10 +4,11 @@ from __future__ import annotations
 import os
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
-import shutil
 import subprocess
 import time
 
+from dataset_editor import plan, scan, schema
+
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("dir", type=str, help="画像群のディレクトリ")
@@ -19,23 +20,41 @@ def main(*args, **kwargs):
     src_dir = Path(kwargs["dir"]).absolute()
     assert src_dir.exists()
 
-    data_paths = [ p for p in src_dir.glob("*") if p.is_file() ]
+    data_paths = scan.scan(src_dir).paths()
     assert len(data_paths) > 0
 
     name2paths = grouping_histgram(data_paths)
+    move_plan = plan_moves(name2paths)
+    executor = plan.Executor.from_kwargs(kwargs)
+    if executor.dry_run:
+        executor.run(move_plan)
+        return
+
     show_name2paths2(name2paths)
 
     is_exe = ask_exe()
     if is_exe:
         print("分割を実行します。")
-        move_files(name2paths)
+        print("分割情報に沿って分割を実行します。")
+        executor.run(move_plan)
     print("\n正常に終了します。")
 
 
 def grouping_histgram(data_paths):
+    """ ファイル名の先頭2単語('_'区切り)ごとにまとめる.
+    '*_yyyymmdd_hhmmss_NNNNN' の名前は解析済みの接頭辞と日付から、それ以外は名前を分割して求める
+    """
+    parsed = schema.parse(path.name for path in data_paths)
+    prefix_words = [prefix.split("_") if prefix != "" else [] for prefix in parsed.prefixes]
     name2paths = {}
-    for path in data_paths:
-        name = "_".join(path.stem.split("_")[:2])
+    for i, path in enumerate(data_paths):
+        if parsed.valid[i]:
+            words = prefix_words[parsed.prefix_ids[i]]
+            if len(words) < 2:
+                words = words + [f"{parsed.dates[i]:08d}", f"{parsed.times[i]:06d}"]
+        else:
+            words = path.stem.split("_")
+        name = "_".join(words[:2])
         if name not in name2paths.keys():
             name2paths[name] = []
         name2paths[name].append(path)
@@ -71,14 +90,14 @@ def show_name2paths2(name2paths):
     subprocess.run(["less", log_dir])
 
 
-def move_files(name2paths):
-    print("分割情報に沿って分割を実行します。")
+def plan_moves(name2paths) -> plan.Plan:
+    move_plan = plan.Plan()
     for name, paths in name2paths.items():
         hist_dir = paths[0].parent.joinpath(name)
-        if not hist_dir.exists():
-            hist_dir.mkdir()
+        move_plan.mkdir(hist_dir)
         for path in paths:
-            shutil.move(str(path), hist_dir)
+            move_plan.move(path, hist_dir.joinpath(path.name))
+    return move_plan
 
 
 def ask_exe():
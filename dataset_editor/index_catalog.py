@@ -0,0 +1,48 @@
+""" データセットのディレクトリをカタログ(SQLite)に記録する. 前回から変更されたディレクトリだけ読み直す
+"""
+from __future__ import annotations
+from argparse import ArgumentParser, RawTextHelpFormatter
+from pathlib import Path
+
+from dataset_editor import catalog, metrics
+
+
+EPILOG = f"""
+ディレクトリごとにファイル名、サイズ、更新日時、ファイル名('*_yyyymmdd_hhmmss_NNNNN')の解析結果、
+{catalog.NUMBERING_JSON_NAME} のリネーム情報を記録する。
+ディレクトリの更新日時が前回と同じ場合は読み直さない。
+separate_train, choice, reduce, delete, intersection, repair は --catalog を指定するとカタログを使う。
+カタログ自体は対象ディレクトリの外に置くこと(カタログの書き込みでディレクトリの更新日時が変わるため)。
+"""
+
+
+def add_arguments(parser: ArgumentParser):
+    parser.epilog = EPILOG
+    parser.formatter_class = RawTextHelpFormatter
+    parser.add_argument("dirs", type=str, nargs="+", help="dataset dirs")
+    parser.add_argument("-r", "--recursive", action="store_true", help="index sub dirs too")
+    parser.add_argument("--catalog", type=str, default=catalog.DEFAULT_PATH, metavar="PATH",
+                        help=f"catalog path. default is '{catalog.DEFAULT_PATH}'")
+    return parser
+
+
+def main(*args, **kwargs):
+    dirs = [Path(d) for d in kwargs["dirs"]]
+    for d in dirs:
+        assert d.is_dir(), f"Not Found {d}"
+
+    if kwargs.get("dry_run", False):
+        print(f"[dry-run] index {len(dirs)} dirs into {kwargs['catalog']}")
+        return
+
+    with catalog.Catalog(kwargs["catalog"]) as cat, metrics.phase("scan"):
+        for d in dirs:
+            num_indexed, num_skipped = cat.refresh(d, kwargs["recursive"])
+            print(f"{d}: indexed {num_indexed} dirs, unchanged {num_skipped} dirs")
+    print(f"catalog: {kwargs['catalog']}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser = add_arguments(parser)
+    main(**vars(parser.parse_args()))
@@ -1,33 +1,44 @@
-""" ２つのディレクトリに存在する同名ファイルを抽出する
+""" 複数のディレクトリに共通して存在するファイルを抽出する
 """
 from __future__ import annotations
+import os
 from pathlib import Path
 from argparse import ArgumentParser
-import shutil
+from typing import Optional
+
+from dataset_editor import catalog, plan, scan, transfer
+
+
+KEYS = ["name", "stem"]
 
 
 def add_arguments(parser: ArgumentParser) -> ArgumentParser:
-    parser.add_argument("dir1", type=str, help="dir")
-    parser.add_argument("dir2", type=str, help="dir")
-    parser.add_argument("--dst_dir", type=str, help="dst dir. Default 'intersection_dir1-and-dir2'")
+    parser.add_argument("dirs", type=str, nargs="+", help="dirs (2 or more)")
+    parser.add_argument("--key", type=str, choices=KEYS, default="name",
+                        help="match key. 'stem' matches e.g. 'a.jpg' and 'a.xml'. default is 'name'. "
+                        "Files are copied from the first dir.")
+    parser.add_argument("--dst_dir", type=str, help="dst dir. Default 'intersection-dir1-and-dir2[-and-dir3...]'")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
+    catalog.add_arguments(parser)
     return parser
 
 
 def main(*args, **kwargs):
     ### 引数確認
-    dir1 = Path(kwargs['dir1'])
-    assert dir1.exists()
-    dir2 = Path(kwargs['dir2'])
-    assert dir2.exists()
+    dirs = [Path(d) for d in kwargs['dirs']]
+    assert len(dirs) >= 2, "intersection needs 2 or more dirs"
+    for d in dirs:
+        assert d.exists(), f"{d}"
     dst_dir: Path
     if kwargs['dst_dir'] is None:
-        dst_dir = Path(f"intersection-{dir1.stem}-and-{dir2.stem}")
+        dst_dir = Path("intersection-" + "-and-".join(d.stem for d in dirs))
     else:
         dst_dir = Path(kwargs['dst_dir'])
     assert dst_dir.parent.exists(), f"{dst_dir}"
 
     ### make process instance
-    process = Process(dir1, dir2, dst_dir)
+    process = Process(dirs, dst_dir, plan.Executor.from_kwargs(kwargs), kwargs['key'], kwargs.get('catalog'))
 
     ### main process run
     process.run()
@@ -36,63 +47,80 @@ def main(*args, **kwargs):
 class Process:
     def __init__(
             self,
-            dir1: Path,
-            dir2: Path,
+            dirs: list[Path],
             dst_dir: Path,
+            executor: plan.Executor = None,
+            key: str = "name",
+            catalog_path: Optional[str] = None,
     ):
-        self._dir1: Path = dir1
-        self._dir2: Path = dir2
+        assert key in KEYS, f"{key}"
+        self._dirs: list[Path] = dirs
         self._dst_dir: Path = dst_dir
+        self._executor: plan.Executor = executor if executor is not None else plan.Executor()
+        self._key: str = key
+        self._catalog_path: Optional[str] = catalog_path
 
 
     def run(self):
-        ### Found file paths
-        file_paths_list: list[list[Path]] = []
-        for dir in [self._dir1, self._dir2]:
-            file_paths: list[Path] = self._find_files(dir)
-            if len(file_paths) == 0:
-                raise ValueError(f"Not Found files in '{dir}'")
-
-            file_paths_list.append(file_paths)
-
-        ### get insersection
-        file_paths = self._intersection(file_paths_list[0], file_paths_list[1])
-        if len(file_paths) == 0:
+        ### カタログがあればカタログで積を取る
+        names = catalog.common_names(self._dirs, self._key, self._catalog_path)
+        if names is None:
+            names = self._scan_intersection()
+        if len(names) == 0:
             raise Exception(f"Not Intersection FileName")
+        file_paths = [self._dirs[0].joinpath(name) for name in names]
 
         ### write
-        self._dst_dir.mkdir()
-        for path in file_paths:
-            shutil.copy(path, self._dst_dir)
+        assert not self._dst_dir.exists(), f"{self._dst_dir}"
+        self._executor.run(plan.Plan().copy_into(file_paths, self._dst_dir))
 
         ### show result
         print("Results:")
         print("Src:")
-        print(f"\t {self._dir1}")
-        print(f"\t {self._dir2}")
+        for dir in self._dirs:
+            print(f"\t {dir}")
         print("Dst:")
         print(f"\t {self._dst_dir}")
         print(f"Num Intersections:{len(file_paths)}")
 
 
-    def _find_files(self, dir: Path) -> list[Path]:
-        file_paths: list[Path] = []
-        for file_path in dir.glob(f"*"):
-            if file_path.is_file():
-                file_paths.append(file_path)
-        return file_paths
+    def _scan_intersection(self) -> list[str]:
+        ### Found file names
+        names_list: list[list[str]] = []
+        for dir in self._dirs:
+            names: list[str] = self._find_files(dir)
+            if len(names) == 0:
+                raise ValueError(f"Not Found files in '{dir}'")
+
+            names_list.append(names)
+
+        ### get insersection
+        return self._intersection(names_list)
 
 
-    def _intersection(self, paths1: list[Path], paths2: list[Path]) -> list[Path]:
-        """ 重複したファイル名を持つPathを抽出
-        """
-        dst_paths: list[Path] = []
-        names2: list[str] = [p.name for p in paths2]
-        for p in paths1:
-            if p.name in names2:
-                dst_paths.append(p)
+    def _find_files(self, dir: Path) -> list[str]:
+        return scan.scan(dir).files
 
-        return dst_paths
+
+    def _to_key(self, name: str) -> str:
+        if self._key == "stem":
+            return os.path.splitext(name)[0]
+        return name
+
+
+    def _intersection(self, names_list: list[list[str]]) -> list[str]:
+        """ 全ディレクトリに共通するキーを持つ、先頭ディレクトリのファイル名を抽出
+        キーの集合(hash set)同士の積を小さい順に取るので O(全ファイル数)
+        """
+        to_key = self._to_key
+        other_keys = sorted((set(map(to_key, names)) for names in names_list[1:]), key=len)
+        common_keys = other_keys[0]
+        for keys in other_keys[1:]:
+            common_keys = common_keys & keys
+            if len(common_keys) == 0:
+                return []
+
+        return [name for name in names_list[0] if to_key(name) in common_keys]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+""" 処理時間とスループットの計測
+フェーズ(scan, plan, transfer)ごとの時間、転送したファイル数とバイト数、1ファイルあたりの転送時間の分布を集める.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+PHASES = ["scan", "plan", "transfer"]
+# 転送時間のヒストグラムの区切り[ms]. 最後の区切りより遅いものは "inf" に数える
+LATENCY_BOUNDS_MS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192]
+# 進捗表示の更新間隔[s]. ファイルごとに描画すると高速なディスクでは描画が律速になる
+PROGRESS_INTERVAL = 0.5
+
+
+class Metrics:
+    def __init__(self):
+        self.command: Optional[str] = None
+        self.phase2seconds: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.num_files: int = 0
+        self.num_bytes: int = 0
+        self.num_errors: int = 0
+        self.latency_counts: List[int] = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+        self.max_latency_ms: float = 0.0
+        self.io_calls: Dict[str, Dict[str, int]] = {} # フェーズ -> 呼び出し -> 回数 (--trace-io)
+        self._start: float = time.perf_counter()
+        self._phase: Optional[str] = None
+
+
+    @property
+    def current_phase(self) -> Optional[str]:
+        return self._phase
+
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ withの中の時間をnameのフェーズに加算する.
+        入れ子の場合は外側のフェーズだけに数える. メインスレッド以外からの呼び出しは数えない
+        """
+        assert name in PHASES, f"unknown phase '{name}'"
+        if self._phase is not None or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        self._phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase2seconds[name] += time.perf_counter() - start
+            self._phase = None
+
+
+    def record(self, seconds: float, num_bytes: int):
+        """ 1ファイルの転送を記録する. Engineの呼び出し側のスレッドから呼ぶ
+        """
+        self.num_files += 1
+        self.num_bytes += num_bytes
+        latency_ms = seconds * 1000
+        i = 0
+        while i < len(LATENCY_BOUNDS_MS) and latency_ms > LATENCY_BOUNDS_MS[i]:
+            i += 1
+        self.latency_counts[i] += 1
+        if latency_ms > self.max_latency_ms:
+            self.max_latency_ms = latency_ms
+
+
+    def record_many(self, num: int, seconds: float):
+        """ num個のファイルをまとめて処理した場合の記録. 1ファイルあたりの時間は平均とする
+        """
+        if num <= 0:
+            return
+        self.num_files += num
+        latency_ms = seconds * 1000 / num
+        i = 0
+        while i < len(LATENCY_BOUNDS_MS) and latency_ms > LATENCY_BOUNDS_MS[i]:
+            i += 1
+        self.latency_counts[i] += num
+        if latency_ms > self.max_latency_ms:
+            self.max_latency_ms = latency_ms
+
+
+    def record_error(self):
+        self.num_errors += 1
+
+
+    def latency_percentile_ms(self, q: float) -> float:
+        """ ヒストグラムから求めた q (0~1) 分位点の上限[ms]
+        """
+        total = sum(self.latency_counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        num = 0
+        for bound, count in zip(LATENCY_BOUNDS_MS, self.latency_counts):
+            num += count
+            if num >= rank:
+                return float(bound)
+        return self.max_latency_ms
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall = time.perf_counter() - self._start
+        transfer_seconds = self.phase2seconds["transfer"]
+        histogram = [{"le_ms": bound, "count": count}
+                     for bound, count in zip(LATENCY_BOUNDS_MS, self.latency_counts)]
+        histogram.append({"le_ms": "inf", "count": self.latency_counts[-1]})
+        d = {
+            "command": self.command,
+            "wall_s": wall,
+            "phases_s": dict(self.phase2seconds, other=max(wall - sum(self.phase2seconds.values()), 0.0)),
+            "files": self.num_files,
+            "bytes": self.num_bytes,
+            "errors": self.num_errors,
+            "files_per_s": self.num_files / transfer_seconds if transfer_seconds > 0 else 0.0,
+            "bytes_per_s": self.num_bytes / transfer_seconds if transfer_seconds > 0 else 0.0,
+            "latency_ms": {
+                "p50": self.latency_percentile_ms(0.5),
+                "p99": self.latency_percentile_ms(0.99),
+                "max": self.max_latency_ms,
+                "histogram": histogram,
+            },
+        }
+        if len(self.io_calls) > 0:
+            d["io_calls"] = self.io_calls
+        return d
+
+
+    def summary(self) -> str:
+        d = self.to_dict()
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in d["phases_s"].items())
+        text = f"{'-'*3} metrics {'-'*17}\n"
+        text += f"wall   : {d['wall_s']:.2f}s ({phases})\n"
+        text += (f"files  : {d['files']} ({d['files_per_s']:.0f} files/s, "
+                 f"{d['bytes_per_s'] / 1024 / 1024:.1f} MB/s, errors {d['errors']})\n")
+        text += (f"latency: p50 <= {d['latency_ms']['p50']:.0f}ms, p99 <= {d['latency_ms']['p99']:.0f}ms, "
+                 f"max {d['latency_ms']['max']:.0f}ms\n")
+        text += f"{'-'*29}"
+        return text
+
+
+_current = Metrics()
+
+
+def current() -> Metrics:
+    return _current
+
+
+def phase(name: str):
+    return _current.phase(name)
+
+
+@contextmanager
+def command(name: str, json_path: Optional[str] = None) -> Iterator[Metrics]:
+    """ サブコマンド1回分の計測. ファイルを転送した場合は終了時に要約を表示し、json_pathがあれば書き出す
+    """
+    global _current
+    _current = Metrics()
+    _current.command = name
+    try:
+        yield _current
+    finally:
+        if _current.num_files + _current.num_errors > 0:
+            print(_current.summary())
+        if json_path is not None:
+            write_json(_current, Path(json_path))
+
+
+def write_json(metrics: Metrics, path: Path):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("w") as f:
+        json.dump(metrics.to_dict(), f, indent=2)
+    os.replace(tmp_path, path)
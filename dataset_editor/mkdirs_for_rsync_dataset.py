@@ -2,7 +2,14 @@
 """
 from __future__ import annotations
 from argparse import ArgumentParser, RawTextHelpFormatter
+from collections import deque
+import json
+import os
 from pathlib import Path
+import re
+from typing import Deque, Dict, List, Tuple
+
+from dataset_editor import plan, scan, transfer
 
 
 keywords_for_file = [
@@ -18,9 +25,19 @@ keywords_for_dir = [
     "sample",
     "example"
 ]
+KEYWORD_PATTERN = re.compile("|".join(re.escape(kwd) for kwd in keywords_for_file + keywords_for_dir))
+MANIFEST_NAME = ".for_rsync_manifest.json"
+
+# 相対パス -> (サイズ, 更新日時[ns]). ディレクトリはサイズを-1とする
+MANIFEST = Dict[str, Tuple[int, int]]
+
 
 def add_arguments(parser:ArgumentParser) -> ArgumentParser:
     parser.add_argument("src_dir", type=str, help="dataset dir")
+    parser.add_argument("--sync", type=str, default=None, metavar="DEST",
+                        help="copy the found paths into 'DEST/src_dir_name' directly instead of making symlinks. "
+                        f"Only new or changed files are copied, compared with '{MANIFEST_NAME}' saved in the destination.")
+    transfer.add_arguments(parser)
     return parser
 
 
@@ -31,42 +48,131 @@ def main(*args, **kwargs):
     paths: list[Path] = find_paths(src_dir)
     assert len(paths) > 0, f"Invalid dir is Dataset"
 
+    if kwargs.get('sync') is not None:
+        sync(src_dir, paths, Path(kwargs['sync']), plan.Executor.from_kwargs(kwargs, op=transfer.copy2, desc="sync"))
+        print("# *** finish !! *** ")
+        return
+
     # symlink
     out_dir: Path = src_dir.joinpath(f"for_rsync/{src_dir.name}")
+    assert not out_dir.exists(), f"{out_dir}"
     print(f"# mkdir for save '{out_dir}'")
-    out_dir.mkdir(parents=True)
+    link_plan = plan.Plan().mkdir(out_dir)
     print(f"# symlink '{len(paths)}' paths to'{out_dir}'")
     for p in paths:
-        out_dir.joinpath(p.name).symlink_to(p)
+        link_plan.link(p, out_dir.joinpath(p.name))
+    plan.Executor.from_kwargs(kwargs).run(link_plan)
 
     print("# *** finish !! *** ")
 
 
 def find_paths(src_dir: Path) -> list[Path]:
-    # find kwd file and dirs
-    paths: list[Path] = []
-    kwds_list: list[list[str]] = [keywords_for_file, keywords_for_dir]
-    kwd2is_found: dict[str, bool] = {}
-    for kwds in kwds_list:
-        for kwd in kwds:
-            finded_paths = list(src_dir.glob(f"*{kwd}*"))
-            if len(finded_paths) == 0:
-                kwd2is_found[kwd] = False
-                continue
-            kwd2is_found[kwd] = True
-            paths += finded_paths
+    """ src_dir直下からキーワードを名前に含むファイルとディレクトリを1回の走査で探す
+    """
+    kwd2is_found: dict[str, bool] = {kwd: False for kwd in keywords_for_file + keywords_for_dir}
+    scanned = scan.scan(src_dir, hidden=True) # Path.glob("*kwd*")と同じく'.'から始まる名前も対象
+    names: list[str] = []
+    for name in scanned.files + scanned.dirs:
+        if KEYWORD_PATTERN.search(name) is None: # どのキーワードも含まない名前を1回で除く
+            continue
+        names.append(name)
+        # 'invalid'に含まれる'val'のように重なるキーワードもあるので、キーワードごとに調べる(globと同じ)
+        for kwd in kwd2is_found:
+            if kwd in name:
+                kwd2is_found[kwd] = True
     print("is_found: keywords")
     print("------------------")
     for kwd, is_found in kwd2is_found.items():
         print(f"{is_found:<7}: {kwd}")
     print("------------------")
 
-    # del equal
-    paths = list(set(paths))
+    paths = scanned.paths(sorted(names))
     print(f"# Num Found is {len(paths)}")
     return paths
 
 
+def sync(src_dir: Path, paths: List[Path], dest: Path, executor: plan.Executor):
+    """ pathsを dest/src_dir.name 以下にコピーする.
+    保存先のmanifestとサイズ・更新日時が一致するファイルは保存先を見ずに飛ばす.
+    symlinkはリンクのままコピーし、辿らない.
+    """
+    assert dest.is_dir(), f"{dest}"
+    out_dir = dest.joinpath(src_dir.name)
+    manifest_file = out_dir.joinpath(MANIFEST_NAME)
+    old_manifest = load_manifest(manifest_file)
+    new_manifest = make_manifest(src_dir, paths)
+
+    sync_plan = plan.Plan().mkdir(out_dir)
+    unlink_plan = plan.Plan() # unlinkは計画の最後に実行されるので、コピーより先に消すものは別の計画にする
+    num_changed = 0
+    for rel_path, (size, mtime_ns) in new_manifest.items():
+        if old_manifest.get(rel_path) == (size, mtime_ns):
+            continue
+        src = src_dir.joinpath(rel_path)
+        dst = out_dir.joinpath(rel_path)
+        if size < 0:
+            sync_plan.mkdir(dst)
+            continue
+        num_changed += 1
+        if src.is_symlink():
+            sync_plan.link(os.readlink(src), dst)
+        else:
+            # 保存先が(前回symlinkだったものを写した)symlinkなら、リンク先に書き込まないように先に消す
+            if os.path.islink(dst):
+                unlink_plan.unlink(dst)
+            sync_plan.copy(src, dst)
+    num_removed = sum(1 for rel_path in old_manifest if rel_path not in new_manifest)
+    print(f"# sync {num_changed} new or changed files to '{out_dir}' "
+          f"({len(new_manifest)} entries, {num_removed} entries only in destination are kept)")
+
+    if len(unlink_plan) > 0:
+        executor.run(unlink_plan)
+    executor.run(sync_plan)
+    if not executor.dry_run:
+        save_manifest(manifest_file, new_manifest)
+
+
+def make_manifest(src_dir: Path, paths: List[Path]) -> MANIFEST:
+    """ pathsとディレクトリの中身をlstatしてmanifestを作る(symlinkのディレクトリは辿らない)
+    """
+    manifest: MANIFEST = {}
+    queue: Deque[str] = deque()
+    for p in paths:
+        st = os.lstat(p)
+        rel_path = os.path.relpath(p, src_dir)
+        if p.is_dir() and not p.is_symlink():
+            manifest[rel_path] = (-1, 0)
+            queue.append(rel_path)
+        else:
+            manifest[rel_path] = (st.st_size, st.st_mtime_ns)
+
+    while len(queue) > 0:
+        rel_dir = queue.popleft()
+        with os.scandir(src_dir.joinpath(rel_dir)) as it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    manifest[rel_path] = (-1, 0)
+                    queue.append(rel_path)
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    manifest[rel_path] = (st.st_size, st.st_mtime_ns)
+    return manifest
+
+
+def load_manifest(manifest_file: Path) -> MANIFEST:
+    if not manifest_file.exists():
+        return {}
+    with manifest_file.open("r") as f:
+        return {rel_path: tuple(value) for rel_path, value in json.load(f).items()}
+
+
+def save_manifest(manifest_file: Path, manifest: MANIFEST):
+    tmp_file = manifest_file.with_name(f".{manifest_file.name}.tmp")
+    with tmp_file.open("w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, manifest_file)
+
 
 if __name__ == "__main__":
     parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
@@ -3,7 +3,8 @@
 from __future__ import annotations
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
-import shutil
+
+from dataset_editor import plan, scan
 
 
 def add_arguments(parser: ArgumentParser) -> ArgumentParser:
@@ -19,11 +20,13 @@ def main(*args, **kwargs):
 
     new_dir: Path = tgt_dir.joinpath(new_dir_name)
 
-    tgt_files: list[Path] = [p for p in tgt_dir.glob("*") ]
+    scanned = scan.scan(tgt_dir, hidden=True) # Path.glob("*")と同じく'.'から始まるものも移動する
+    tgt_files: list[Path] = scanned.paths([name for name in scanned.files + scanned.dirs if name != new_dir_name])
 
-    new_dir.mkdir(exist_ok=True)
+    move_plan = plan.Plan().mkdir(new_dir)
     for p in tgt_files:
-        shutil.move(str(p), new_dir)
+        move_plan.move(p, new_dir.joinpath(p.name))
+    plan.Executor.from_kwargs(kwargs).run(move_plan)
 
 
 if __name__ == "__main__":
@@ -9,19 +9,26 @@ EPILOG='''
 画像ファイルを５桁の番号の名前にリネームしながら、`numberings`ディレクトリにコピーする。
 （この際に`prefix`引数が設定してある場合は`[prefix]_xxxxxx.jpg`のように数字の前にテキストが挿入される。)
 また、リネーム情報を辞書に記録する。`dict={number:org}`のように
+リネーム情報は保存した順に`numbering2org.journal`へ１行ずつ追記される。
 全てのファイルがコピーされた後にリネーム情報を`numbering2org.json`として画像ディレクトリの親ディレクトリに保存する。
+途中で中断した場合は`--resume`を付けて再実行すると`numbering2org.journal`に記録済みのファイルを飛ばして続きから処理する。
 modeによってシンボリックリンクを作成するか、純粋にコピーするか選択する。
 '''
 
 import os
+import re
 from pathlib import Path
-import shutil
-import glob
 from argparse import ArgumentParser, RawTextHelpFormatter
 import random
 import json 
+from typing import Iterable, Iterator, List, Set, Tuple
 
-import tqdm
+from dataset_editor import metrics, plan, scan, sorting, transfer
+
+
+JSON_NAME = "numbering2org.json"
+JOURNAL_NAME = "numbering2org.journal"
+IMG_SUFFIXES = [".jpg", ".JPG", ".png", ".PNG"]
 
 
 def add_arguments(parser: ArgumentParser):
@@ -36,6 +43,10 @@ def add_arguments(parser: ArgumentParser):
     parser.add_argument("-s", "--shuffle", action="store_true", help="shuffle flag. default is False")
     parser.add_argument("-b", "--begin_num", type=int, default=1,
         help="begin number. Default is 0")
+    parser.add_argument("-r", "--resume", action="store_true",
+        help=f"resume from '{JOURNAL_NAME}' in out_dir. numbered files are skipped.")
+    transfer.add_arguments(parser)
+    sorting.add_arguments(parser)
 
     return parser
 
@@ -50,10 +61,7 @@ def main(*args, **kwargs):
     out_dir = Path(f"{kwargs['out_dir']}").absolute()
     if not out_dir.exists():
         assert out_dir.parent.exists()
-        out_dir.mkdir()
     out_imgs_dir = Path(f"{kwargs['out_dir']}/numberings").absolute()
-    if not out_imgs_dir.exists():
-        out_imgs_dir.mkdir()
 
     # mode
     mode = kwargs['mode']
@@ -65,54 +73,179 @@ def main(*args, **kwargs):
     else: # mode == "copy"
         save_func = copy_file
 
-    # get img paths
-    suffixes = [".jpg", ".JPG", ".png", ".PNG"]
-    img_paths = []
-    for suffix in suffixes:
-        img_paths += [ Path(f) for f in glob.glob(f"{src_dir}/*{suffix}")]
-    print(f"NumImages {len(img_paths)}")
-    img_paths.sort()
+    # resume
+    journal_file = Path(f"{out_dir}/{JOURNAL_NAME}")
+    used_numbers: Set[int] = set()
+    done_img_names: Set[str] = set()
+    if kwargs['resume'] and journal_file.exists():
+        for out_name, img_name in read_journal(journal_file):
+            used_numbers.add(parse_number(out_name))
+            done_img_names.add(img_name)
+        print(f"resume: skip {len(done_img_names)} numbered files")
 
-    # shuffle
-    if kwargs['shuffle']:
-        random.shuffle(img_paths)
+    # get img paths
+    # シャッフルしない場合は名前順に並べながら読む(メモリの上限を超えた分は一時ファイルで並べる)
+    names = (name for name in scan.iter_files(src_dir, hidden=False, suffixes=IMG_SUFFIXES)
+             if name not in done_img_names)
+    with metrics.phase("scan"):
+        if kwargs['shuffle']:
+            img_names = sorted(names)
+            random.shuffle(img_names)
+        else:
+            img_names = sorting.ExternalSort(memory_mb=kwargs.get('sort_memory_mb', sorting.DEFAULT_MEMORY_MB)).extend(names)
+    num_images = len(img_names)
+    print(f"NumImages {num_images + len(done_img_names)}")
+    del done_img_names
 
     # numbering
     begin_num: int = kwargs['begin_num']
     filename_prefix = f"{kwargs['prefix']}" if f"{kwargs['prefix']}" == "" else f"{kwargs['prefix']}_"
-    out_name2img_name = {}
-    for n, img_path in enumerate(tqdm.tqdm(img_paths)):
-        number = begin_num + n
-        out_name = f"{number:>05}{img_path.suffix}"
-        out_file = Path(f"{out_imgs_dir}/{filename_prefix}{out_name}")
-
-        save_func(img_path, out_file)
-
-        img_name = img_path.name
-        out_name2img_name[out_file.name] = img_name
-    txt = json.dumps(out_name2img_name, indent=2)
-    json_file = Path(f"{out_dir}/numbering2org.json")
-    with json_file.open("w") as f:
-        f.write(txt)
+    jobs = plan_numbering(img_names, src_dir, out_imgs_dir, filename_prefix, begin_num, used_numbers)
+
+    if kwargs.get('dry_run', False):
+        dry_plan = plan.Plan().mkdir(out_dir).mkdir(out_imgs_dir)
+        for job in jobs:
+            if mode == "copy":
+                dry_plan.copy(job.src, job.dst)
+            else:
+                dry_plan.link(job.src, job.dst)
+        plan.Executor(dry_run=True).run(dry_plan)
+        return
+
+    out_imgs_dir.mkdir(parents=True, exist_ok=True)
+
+    # 保存したファイルから順にjournalへ追記する(行バッファなので中断しても記録は残る)
+    with journal_file.open("a" if kwargs['resume'] else "w", buffering=1) as journal:
+        if journal.tell() > 0 and not ends_with_newline(journal_file):
+            journal.write("\n") # 中断で途中まで書かれた行を閉じる
+        def on_done(job: transfer.Job):
+            journal.write(json.dumps([job.dst.name, job.src.name]) + "\n")
+
+        engine = transfer.Engine.from_kwargs(kwargs, op=save_func, desc=mode)
+        engine.run(jobs, on_done=on_done, total=num_images).check()
+
+    json_file = Path(f"{out_dir}/{JSON_NAME}")
+    write_json_from_journal(journal_file, json_file, kwargs.get('sort_memory_mb', sorting.DEFAULT_MEMORY_MB))
+
+
+def plan_numbering(
+        img_names: Iterable[str],
+        src_dir: Path,
+        out_imgs_dir: Path,
+        filename_prefix: str,
+        begin_num: int,
+        used_numbers: Set[int],
+) -> Iterator[transfer.Job]:
+    """ 画像に番号を振ったJobを順に生成する. used_numbersの番号(resume時の処理済み)は飛ばす
+    """
+    number = begin_num
+    for img_name in img_names:
+        while number in used_numbers:
+            number += 1
+        suffix = os.path.splitext(img_name)[1]
+        out_file = out_imgs_dir.joinpath(f"{filename_prefix}{number:>05}{suffix}")
+        yield transfer.Job(src_dir.joinpath(img_name), out_file)
+        number += 1
+
+
+def parse_number(out_name: str) -> int:
+    """ '[prefix_]00001.jpg' -> 1
+    """
+    stem = os.path.splitext(out_name)[0]
+    return int(re.search(r"(\d+)$", stem).group(1))
+
+
+def read_journal(journal_file: Path) -> Iterator[List[str]]:
+    """ journalの各行 [out_name, img_name] を順に返す. 中断で途中までしか書かれていない行は無視する
+    """
+    with journal_file.open("r") as f:
+        for line in f:
+            try:
+                out_name, img_name = json.loads(line)
+            except ValueError:
+                continue
+            yield out_name, img_name
+
+
+def ends_with_newline(path: Path) -> bool:
+    with path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def write_json_from_journal(journal_file: Path, json_file: Path, sort_memory_mb: int = sorting.DEFAULT_MEMORY_MB):
+    """ journalを番号順に並べ直して json.dumps(indent=2) と同じ書式で書き出す.
+    journalは並列に保存し終わった順なので、(0埋めした番号 + 行) を外部ソートで並べる
+    """
+    lines = sorting.ExternalSort(memory_mb=sort_memory_mb)
+    for out_name, img_name in read_journal(journal_file):
+        lines.add(f"{parse_number(out_name):020}" + json.dumps([out_name, img_name]))
+    tmp_file = json_file.with_name(f".{json_file.name}.tmp")
+    with tmp_file.open("w") as f:
+        sep = "{\n"
+        for line in lines:
+            out_name, img_name = json.loads(line[20:])
+            f.write(f"{sep}  {json.dumps(out_name)}: {json.dumps(img_name)}")
+            sep = ",\n"
+        f.write("{}" if sep == "{\n" else "\n}")
+    os.replace(tmp_file, json_file)
+
+
+def append_json(json_file: Path, pairs: List[Tuple[str, str]]) -> bool:
+    """ write_json_from_journalで書いたjsonの末尾の '}' を書き換えて追記する(既存の内容は読まない).
+    ファイルが無いか書式が異なる場合は何もせずFalseを返す
+    """
+    if len(pairs) == 0:
+        return json_file.exists()
+    try:
+        f = json_file.open("r+b")
+    except FileNotFoundError:
+        return False
+    with f:
+        if f.seek(0, os.SEEK_END) < 2:
+            return False
+        f.seek(-2, os.SEEK_END)
+        tail = f.read(2)
+        if tail == b"{}":
+            sep = "{\n"
+        elif tail == b"\n}":
+            sep = ",\n"
+        else:
+            return False
+        text = ""
+        for out_name, img_name in pairs:
+            text += f"{sep}  {json.dumps(out_name)}: {json.dumps(img_name)}"
+            sep = ",\n"
+        f.seek(-2, os.SEEK_END)
+        f.write((text + "\n}").encode())
+    return True
 
 
 def link_as_absolute(src_file:Path, dst_file:Path):
     _src = src_file.resolve()
     _dst = dst_file.absolute()
-    os.symlink(_src, _dst)
+    _symlink(_src, _dst)
 
 
 def link_as_relative(src_file:Path, dst_file:Path):
     _src = src_file.absolute()
     _dst = dst_file.absolute()
     _src = os.path.relpath(_src, _dst.parent)
-    os.symlink(_src, _dst)
+    _symlink(_src, _dst)
+
+
+def _symlink(src, dst):
+    try:
+        os.symlink(src, dst)
+    except FileExistsError: # resume時に中断前のリンクが残っている場合
+        os.remove(dst)
+        os.symlink(src, dst)
 
 
 def copy_file(src_file:Path, dst_file:Path):
     _src = src_file.absolute()
     _dst = dst_file.absolute()
-    shutil.copy(_src, _dst)
+    transfer.copy(_src, _dst)
 
 
 if __name__ == "__main__":
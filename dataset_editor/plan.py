@@ -0,0 +1,500 @@
+""" ファイル操作の計画(Plan)と一括実行(Executor)
+各サブコマンドはファイルシステムを直接変更せずに操作をPlanに積み、Executorでまとめて実行する.
+"""
+from __future__ import annotations
+import errno
+import os
+from pathlib import Path
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+from dataset_editor import metrics, transfer
+
+
+# 実行順. mkdirを最初に、unlinkを最後に行う
+KINDS = ["mkdir", "copy", "link", "move", "unlink"]
+BATCH_SIZE = 100000
+NUM_SHOW_OPS = 5
+NUM_SHOW_DIRS = 10
+
+
+_LINK_AT_SUPPORTED = all(func in os.supports_dir_fd for func in [os.symlink, os.readlink, os.unlink]) \
+    and os.listdir in os.supports_fd
+
+
+class Op(NamedTuple):
+    """ ファイル操作.
+    mkdir: dstを作成. copy: srcをdstに実体化(--linkの方法で). link: dstにsrcを指すsymlinkを作成.
+    move: srcをdstに移動. unlink: dstを削除.
+    大量の操作を積む場合はメモリを節約するためにパスを文字列で持ってもよい(Plan.copy_names).
+    """
+    kind: str
+    dst: Union[Path, str]
+    src: Union[Path, str, None] = None
+
+
+class Plan:
+    def __init__(self):
+        self.ops: List[Op] = []
+
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+
+    def mkdir(self, dst: Path) -> Plan:
+        self.ops.append(Op("mkdir", dst))
+        return self
+
+
+    def copy(self, src: Path, dst: Path) -> Plan:
+        self.ops.append(Op("copy", dst, src))
+        return self
+
+
+    def link(self, src: Union[Path, str], dst: Path) -> Plan:
+        """ srcはsymlinkの中身(相対パスならdstのディレクトリからの相対)
+        """
+        self.ops.append(Op("link", dst, src))
+        return self
+
+
+    def move(self, src: Path, dst: Path) -> Plan:
+        self.ops.append(Op("move", dst, src))
+        return self
+
+
+    def unlink(self, dst: Path) -> Plan:
+        self.ops.append(Op("unlink", dst))
+        return self
+
+
+    def copy_into(self, paths: Iterable[Path], out_dir: Path) -> Plan:
+        """ out_dirを作成してpathsを同名でコピーする
+        """
+        self.mkdir(out_dir)
+        for p in paths:
+            self.copy(p, out_dir.joinpath(p.name))
+        return self
+
+
+    def copy_names(self, src_dir: Path, names: Iterable[str], out_dir: Path) -> Plan:
+        """ out_dirを作成してsrc_dir直下のnamesを同名でコピーする. Pathを作らず文字列で積む
+        """
+        self.mkdir(out_dir)
+        src_root = os.fspath(src_dir)
+        out_root = os.fspath(out_dir)
+        join = os.path.join
+        ops = self.ops
+        for name in names:
+            ops.append(Op("copy", join(out_root, name), join(src_root, name)))
+        return self
+
+
+    def deduped(self) -> Tuple[List[Op], int]:
+        """ 同じ(kind, dst)の操作は最後のものだけを残し、KINDSの順 -> dstのパス(文字列)順に並べる.
+        mkdirは浅い順に並べる. 除いた操作の数も返す.
+        """
+        # 数百万件でも一時オブジェクトを増やさないように、dstの文字列をそのままキーにする
+        kind2dst2op: Dict[str, Dict[str, Op]] = {kind: {} for kind in KINDS}
+        for op in self.ops:
+            kind2dst2op[op.kind][os.fspath(op.dst)] = op
+
+        ops: List[Op] = []
+        for kind in KINDS:
+            dst2op = kind2dst2op[kind]
+            if kind == "mkdir":
+                dsts = sorted(dst2op, key=lambda dst: (dst.count(os.sep), dst))
+            else:
+                dsts = sorted(dst2op)
+            ops += [dst2op[dst] for dst in dsts]
+        return ops, len(self.ops) - len(ops)
+
+
+    def summary(self) -> str:
+        ops, num_dup = self.deduped()
+        kind2num = {kind: 0 for kind in KINDS}
+        dir2num: Dict[str, int] = {}
+        for op in ops:
+            kind2num[op.kind] += 1
+            if op.kind != "mkdir":
+                d = os.path.dirname(os.fspath(op.dst))
+                dir2num[d] = dir2num.get(d, 0) + 1
+
+        text = f"{'-'*3} plan {'-'*20}\n"
+        for kind in KINDS:
+            text += f"{kind:<7}: {kind2num[kind]:>9}\n"
+        text += f"deduped: {num_dup:>8}\n"
+        text += f"target dirs: {len(dir2num)}\n"
+        for d, num in sorted(dir2num.items(), key=lambda item: item[1], reverse=True)[:NUM_SHOW_DIRS]:
+            text += f"{num:>9} | {d}\n"
+        if len(dir2num) > NUM_SHOW_DIRS:
+            text += f"      ... | and {len(dir2num) - NUM_SHOW_DIRS} more dirs\n"
+        text += "examples:\n"
+        for op in ops[:NUM_SHOW_OPS]:
+            text += f"  {op.kind:<6} {op.src if op.src is not None else ''} -> {op.dst}\n"
+        text += f"{'-'*29}"
+        return text
+
+
+def _link(src: Union[Path, str], dst: Path):
+    try:
+        os.symlink(src, dst)
+    except FileExistsError:
+        if os.path.islink(dst) and os.readlink(dst) == os.fspath(src):
+            return
+        os.remove(dst)
+        os.symlink(src, dst)
+
+
+def _move_across(src: Path, dst: Path):
+    """ 別デバイスへの移動. コピーしてから元を消す(symlinkはリンクのまま移す).
+    shutil.moveと同じく既存のdstは上書きしない
+    """
+    if os.path.lexists(dst):
+        raise _exists_error(dst)
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.copytree(src, dst, symlinks=True)
+        shutil.rmtree(src)
+    elif os.path.islink(src):
+        shutil.copy2(src, dst, follow_symlinks=False)
+        os.unlink(src)
+    else:
+        transfer.copy2(src, dst)
+        os.unlink(src)
+
+
+def _exists_error(dst: Union[Path, str]) -> FileExistsError:
+    return FileExistsError(errno.EEXIST, "Destination path already exists", os.fspath(dst))
+
+
+class _DirFds:
+    """ 直前に使ったディレクトリのfdを保持する. 操作はパス順に並んでいるので開き直しは少ない
+    """
+    def __init__(self):
+        self._dir2fd: Dict[str, int] = {}
+
+
+    def pair(self, src_dir: str, dst_dir: str) -> Tuple[int, int]:
+        """ 2つのディレクトリのfdを返す. それ以外に開いていたfdは閉じる
+        """
+        for d in [d for d in self._dir2fd if d != src_dir and d != dst_dir]:
+            os.close(self._dir2fd.pop(d))
+        for d in [src_dir, dst_dir]:
+            if d not in self._dir2fd:
+                self._dir2fd[d] = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+        return self._dir2fd[src_dir], self._dir2fd[dst_dir]
+
+
+    def close(self):
+        for fd in self._dir2fd.values():
+            os.close(fd)
+        self._dir2fd.clear()
+
+
+def _lexists_at(name: str, dir_fd: int) -> bool:
+    try:
+        os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _unlink(src: Optional[Path], dst: Path):
+    os.remove(dst)
+
+
+def _link_dir(d: str, entries: List[Tuple[str, str]]) -> Tuple[int, int, List[Tuple[transfer.Job, Exception]], float]:
+    """ ディレクトリdに (名前, symlinkの中身) のsymlinkをディレクトリfd基準で作る.
+    既存のエントリはディレクトリごとに1回だけ読み、中身が同じsymlinkはそのままにする.
+
+    Returns:
+        作成数, 変更不要だった数, 失敗, 処理時間[s]
+    """
+    start = time.perf_counter()
+    num_created = num_kept = 0
+    errors: List[Tuple[transfer.Job, Exception]] = []
+    try:
+        fd = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError as e:
+        errors += [(transfer.Job(target, os.path.join(d, name)), e) for name, target in entries]
+        return 0, 0, errors, time.perf_counter() - start
+    try:
+        existing = set(os.listdir(fd))
+        for name, target in entries:
+            try:
+                if name in existing:
+                    try:
+                        if os.readlink(name, dir_fd=fd) == target:
+                            num_kept += 1
+                            continue
+                    except OSError: # symlinkではない
+                        pass
+                    os.unlink(name, dir_fd=fd)
+                os.symlink(target, name, dir_fd=fd)
+            except OSError as e:
+                errors.append((transfer.Job(target, os.path.join(d, name)), e))
+                continue
+            num_created += 1
+    finally:
+        os.close(fd)
+    return num_created, num_kept, errors, time.perf_counter() - start
+
+
+class Executor:
+    """ Planを重複除去・ソートしてから実行する.
+    mkdirは浅い順に1回ずつ行い、それ以外はパス順に BATCH_SIZE 件ずつ transfer.Engine で並列に実行する.
+    linkはディレクトリごとに並列に作り、既に同じ中身のsymlinkはそのままにする.
+    moveは同じデバイス内ならrenameで一括して行う.
+
+    Args:
+        engine (transfer.Engine): copyに使うEngine. copyの実体化方法(--link)はEngineのop
+        dry_run (bool): Trueなら要約を表示するだけで何もしない
+        batch_size (int): 1回にEngineへ渡す操作数
+    """
+    def __init__(self, engine: Optional[transfer.Engine] = None, dry_run: bool = False, batch_size: int = BATCH_SIZE):
+        self.engine: transfer.Engine = engine if engine is not None else transfer.Engine()
+        self.dry_run: bool = dry_run
+        self.batch_size: int = batch_size
+
+
+    @classmethod
+    def from_kwargs(cls, kwargs: Dict[str, Any], **overrides) -> Executor:
+        return cls(transfer.Engine.from_kwargs(kwargs, **overrides), kwargs.get("dry_run", False))
+
+
+    def run(self, plan: Plan) -> transfer.Result:
+        if self.dry_run:
+            print("[dry-run]")
+            print(plan.summary())
+            return transfer.Result()
+
+        with metrics.phase("plan"):
+            ops, _ = plan.deduped()
+        result = transfer.Result()
+        with metrics.phase("transfer"):
+            self._execute(ops, result)
+        return result.check()
+
+
+    def run_stream(self, ops: Iterable[Op]) -> transfer.Result:
+        """ 走査しながら作るmkdirとcopyの操作を、全体を積まずに batch_size 件ずつ実行する.
+        mkdirは届いた時に行い(そのディレクトリへのcopyより先に届くこと)、copyは同じdstの最後のものだけを残して
+        バッチごとにEngineで並列に実行する. バッチは順に実行するので、Plan.dedupedと同じく後の操作が残る.
+        dry_runの場合はPlanに積んで要約を表示する
+        """
+        if self.dry_run:
+            stream_plan = Plan()
+            stream_plan.ops.extend(ops)
+            return self.run(stream_plan)
+
+        result = transfer.Result()
+        made: Set[str] = set()
+        batch: Dict[str, Op] = {}
+
+        def flush():
+            jobs = [transfer.Job(op.src, op.dst) for op in batch.values()]
+            batch.clear()
+            if len(jobs) > 0:
+                self._merge(result, self.engine.run(jobs))
+
+        for op in ops:
+            assert op.kind in ["mkdir", "copy"], f"run_stream supports mkdir and copy. got {op.kind}"
+            dst = os.fspath(op.dst)
+            if op.kind == "mkdir":
+                if dst not in made:
+                    made.add(dst)
+                    self._mkdirs([op.dst], result)
+                continue
+            batch[dst] = op
+            if len(batch) >= self.batch_size:
+                flush()
+        flush()
+        return result.check()
+
+
+    def copy_names(self, src_dir: Path, targets: Sequence[Tuple[Path, Iterable[str]]], total: Optional[int] = None) -> transfer.Result:
+        """ (出力ディレクトリ, src_dir直下の名前) ごとにディレクトリを作成して同名でコピーする.
+        Planに積まずに名前からJobを作りながらEngineに渡すので、数百万件でもOpと重複除去の表を持たない.
+        重複除去も並べ替えもしないので、出力先が重複しないこと. dry_runの場合はPlanに積んで要約を表示する
+
+        Args:
+            total (Optional[int]): 名前の総数(進捗表示用)
+        """
+        if self.dry_run:
+            copy_plan = Plan()
+            for out_dir, names in targets:
+                copy_plan.copy_names(src_dir, names, out_dir)
+            return self.run(copy_plan)
+
+        result = transfer.Result()
+        with metrics.phase("transfer"):
+            self._mkdirs([out_dir for out_dir, _ in targets], result)
+
+        def jobs() -> Iterator[transfer.Job]:
+            src_root = os.fspath(src_dir)
+            join = os.path.join
+            for out_dir, names in targets:
+                out_root = os.fspath(out_dir)
+                for name in names:
+                    yield transfer.Job(join(src_root, name), join(out_root, name))
+
+        self._merge(result, self.engine.run(jobs(), total=total))
+        return result.check()
+
+
+    def _execute(self, ops: List[Op], result: transfer.Result):
+        self._mkdirs([op.dst for op in ops if op.kind == "mkdir"], result)
+
+        kind2call: Dict[str, Tuple[Callable[[Any, Path], Any], bool]] = {
+            "copy": (self.engine.op, True),
+            "link": (_link, False),
+            "unlink": (_unlink, False),
+        }
+        moves = [op for op in ops if op.kind == "move"]
+        ops = [op for op in ops if op.kind not in ["mkdir", "move"]]
+        for start in range(0, len(ops), self.batch_size):
+            batch = ops[start:start + self.batch_size]
+            # バッチ内はソート済みなので同じkindは連続している
+            i = 0
+            while i < len(batch):
+                kind = batch[i].kind
+                j = i
+                while j < len(batch) and batch[j].kind == kind:
+                    j += 1
+                if kind == "link" and _LINK_AT_SUPPORTED:
+                    self._links(batch[i:j], result)
+                    i = j
+                    continue
+                op, sized = kind2call[kind]
+                jobs = [transfer.Job(o.src, o.dst) for o in batch[i:j]]
+                desc = kind if kind != "copy" else self.engine.desc
+                self._merge(result, self.engine.run(jobs, op=op, sized=sized, desc=desc))
+                i = j
+        self._moves(moves, result)
+
+
+    def _mkdirs(self, dirs: List[Path], result: transfer.Result):
+        for d in dirs:
+            try:
+                os.mkdir(d)
+            except FileExistsError:
+                pass
+            except FileNotFoundError:
+                os.makedirs(d, exist_ok=True)
+            except OSError as e:
+                result.errors.append((transfer.Job(None, d), e))
+                continue
+            result.num_done += 1
+
+
+    def _links(self, ops: List[Op], result: transfer.Result):
+        """ symlinkを作成先のディレクトリごとにまとめ、ディレクトリ単位でEngineのワーカー数だけ並列に作る.
+        既に同じ中身のsymlinkは作り直さないので、再実行時は追加分だけ書き込む
+        """
+        if len(ops) == 0:
+            return
+        import tqdm
+
+        dir2entries: Dict[str, List[Tuple[str, str]]] = {}
+        for op in ops:
+            d, name = os.path.split(os.fspath(op.dst))
+            entries = dir2entries.get(d or ".")
+            if entries is None:
+                entries = dir2entries[d or "."] = []
+            entries.append((name, os.fspath(op.src)))
+
+        recorder = metrics.current()
+        num_created = num_kept = 0
+        with ThreadPoolExecutor(max_workers=self.engine.workers) as executor, \
+                tqdm.tqdm(total=len(ops), desc="link", unit="file", mininterval=metrics.PROGRESS_INTERVAL) as pbar:
+            futures = [executor.submit(_link_dir, d, entries) for d, entries in dir2entries.items()]
+            for future in as_completed(futures):
+                created, kept, errors, seconds = future.result()
+                num_created += created
+                num_kept += kept
+                result.errors += errors
+                for _ in errors:
+                    recorder.record_error()
+                recorder.record_many(created, seconds)
+                pbar.update(created + kept + len(errors))
+        result.num_done += num_created + num_kept
+        print(f"link: created {num_created}, unchanged {num_kept} in {len(dir2entries)} dirs")
+
+
+    def _moves(self, ops: List[Op], result: transfer.Result):
+        """ 移動元と移動先のディレクトリが同じデバイスならディレクトリfd基準のos.renameで移動する.
+        デバイスの判定はディレクトリごとに1回だけ行い、別デバイスの場合(とEXDEVで失敗した場合)だけ
+        Engineで並列にコピーしてから元を消す. どちらも既存の移動先は上書きせずに失敗として数える.
+        """
+        if len(ops) == 0:
+            return
+        dir2dev: Dict[str, int] = {}
+
+        def device(d: str) -> int:
+            dev = dir2dev.get(d)
+            if dev is None:
+                dev = os.stat(d).st_dev
+                dir2dev[d] = dev
+            return dev
+
+        # 大量のPath操作は遅いので文字列で扱い、ディレクトリの組が変わった時だけ判定し直す
+        use_dir_fd = os.rename in os.supports_dir_fd and os.stat in os.supports_dir_fd
+        fds = _DirFds()
+        across: List[transfer.Job] = []
+        num_renamed = 0
+        recorder = metrics.current()
+        dir_pair: Optional[Tuple[str, str]] = None
+        is_same_device = False
+        src_fd = dst_fd = -1
+        try:
+            for op in ops:
+                src_dir, src_name = os.path.split(os.fspath(op.src))
+                dst_dir, dst_name = os.path.split(os.fspath(op.dst))
+                src_dir = src_dir or "."
+                dst_dir = dst_dir or "."
+                try:
+                    if dir_pair != (src_dir, dst_dir):
+                        dir_pair = None
+                        is_same_device = device(src_dir) == device(dst_dir)
+                        if is_same_device and use_dir_fd:
+                            src_fd, dst_fd = fds.pair(src_dir, dst_dir)
+                        dir_pair = (src_dir, dst_dir)
+                    if not is_same_device:
+                        across.append(transfer.Job(Path(op.src), op.dst))
+                        continue
+                    start = time.perf_counter()
+                    # os.renameは既存のファイルを黙って置き換えるので、shutil.moveと同じく既存の移動先は失敗にする
+                    if use_dir_fd:
+                        if _lexists_at(dst_name, dst_fd):
+                            raise _exists_error(op.dst)
+                        os.rename(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+                    else:
+                        if os.path.lexists(op.dst):
+                            raise _exists_error(op.dst)
+                        os.rename(op.src, op.dst)
+                except OSError as e:
+                    if e.errno == errno.EXDEV: # 移動元自体がマウントポイント等
+                        across.append(transfer.Job(Path(op.src), op.dst))
+                    else:
+                        result.errors.append((transfer.Job(Path(op.src), op.dst), e))
+                        recorder.record_error()
+                    continue
+                recorder.record(time.perf_counter() - start, 0)
+                num_renamed += 1
+        finally:
+            fds.close()
+        result.num_done += num_renamed
+        print(f"move: renamed {num_renamed} files, {len(across)} files across devices")
+
+        for start in range(0, len(across), self.batch_size):
+            jobs = across[start:start + self.batch_size]
+            self._merge(result, self.engine.run(jobs, op=_move_across, sized=False, desc="move"))
+
+
+    def _merge(self, result: transfer.Result, other: transfer.Result):
+        result.num_done += other.num_done
+        result.num_bytes += other.num_bytes
+        result.errors += other.errors
@@ -0,0 +1,181 @@
+""" サブコマンドのプロファイリング
+--profile cpu は cProfile の pstats、--profile mem は tracemalloc のスナップショットを書き出し、上位を表示する.
+cProfileはメインスレッドだけを計測するので、Engineのワーカー内の処理は --trace-io と metrics の転送時間で見る.
+--trace-io はファイルシステム関係の呼び出し回数をフェーズごとに数える. import(遅延importを含む)による呼び出しは数えない.
+"""
+from __future__ import annotations
+from contextlib import contextmanager
+import os
+import pathlib
+import sys
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from dataset_editor import metrics
+
+
+PROFILES = ["cpu", "mem"]
+NUM_SHOW = 20
+TRACEMALLOC_FRAMES = 25
+# 数える呼び出し -> sys.addaudithook のイベント名. statはauditイベントが無いのでos.stat/os.lstatを差し替えて数える
+IO_EVENTS: Dict[str, str] = {
+    "open": "open",
+    "mkdir": "os.mkdir",
+    "symlink": "os.symlink",
+    "link": "os.link",
+    "rename": "os.rename",
+    "remove": "os.remove",
+    "scandir": "os.scandir",
+    "listdir": "os.listdir",
+}
+IO_CALLS = ["stat", "lstat"] + list(IO_EVENTS.keys())
+IMPORTLIB_FILENAME = "<frozen importlib" # importlib._bootstrap(_external)のフレームのファイル名
+
+
+def default_out_path(kind: str, command: str) -> str:
+    return f"{command}.{'pstats' if kind == 'cpu' else 'tracemalloc'}"
+
+
+def run(kind: Optional[str], func: Callable[[], Any], out_path: str) -> Any:
+    """ kindがNoneならそのまま実行する. 失敗した場合もそこまでの結果を書き出す
+    """
+    if kind is None:
+        return func()
+    assert kind in PROFILES, f"unknown profile '{kind}'"
+    if kind == "cpu":
+        return _run_cpu(func, out_path)
+    return _run_mem(func, out_path)
+
+
+def _run_cpu(func: Callable[[], Any], out_path: str) -> Any:
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(out_path)
+        print(f"{'-'*3} profile cpu: {out_path} {'-'*10}")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(NUM_SHOW)
+
+
+def _run_mem(func: Callable[[], Any], out_path: str) -> Any:
+    import tracemalloc
+
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        return func()
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot.dump(out_path)
+        print(f"{'-'*3} profile mem: {out_path} {'-'*10}")
+        print(f"peak: {peak / 1024 / 1024:.1f} MB")
+        for stat in snapshot.statistics("lineno")[:NUM_SHOW]:
+            print(stat)
+
+
+class IOTracer:
+    """ ファイルシステム関係の呼び出しを、呼び出した時点のフェーズ(metrics.PHASES と other)ごとに数える.
+    ワーカースレッドからの呼び出しはメインスレッドが実行中のフェーズに数える.
+    """
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.enabled: bool = False
+        self._lock = threading.Lock()
+        self._event2call: Dict[str, str] = {event: call for call, event in IO_EVENTS.items()}
+        self._is_hooked: bool = False
+
+
+    def count(self, call: str):
+        phase = metrics.current().current_phase or "other"
+        with self._lock:
+            phase2num = self.counts.setdefault(phase, {})
+            phase2num[call] = phase2num.get(call, 0) + 1
+
+
+    def _audit(self, event: str, args: Any):
+        if not self.enabled:
+            return
+        call = self._event2call.get(event)
+        if call is not None and not _in_import():
+            self.count(call)
+
+
+    def start(self):
+        # auditフックは外せないのでenabledで切り替える
+        if not self._is_hooked:
+            sys.addaudithook(self._audit)
+            self._is_hooked = True
+        self.enabled = True
+
+
+    def stop(self):
+        self.enabled = False
+
+
+    def summary(self) -> str:
+        phases = [phase for phase in metrics.PHASES + ["other"] if phase in self.counts]
+        text = f"{'-'*3} trace io {'-'*16}\n"
+        text += f"{'':<8}" + "".join(f"{phase:>10}" for phase in phases) + "\n"
+        for call in IO_CALLS:
+            nums = [self.counts[phase].get(call, 0) for phase in phases]
+            if sum(nums) == 0:
+                continue
+            text += f"{call:<8}" + "".join(f"{num:>10}" for num in nums) + "\n"
+        text += f"{'-'*29}"
+        return text
+
+
+_tracer = IOTracer()
+
+
+def _in_import() -> bool:
+    """ import中(モジュールの検索、読み込み、実行)の呼び出しか. 呼び出し元にimportlibのフレームがあるかで判定する.
+    フェーズの途中の遅延import(tqdm等)を転送などのI/Oに数えないため
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(IMPORTLIB_FILENAME):
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _counted(call: str, func: Callable) -> Callable:
+    def wrapper(*args, **kwargs):
+        if _tracer.enabled and not _in_import():
+            _tracer.count(call)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def trace_io(enabled: bool) -> Iterator[Optional[IOTracer]]:
+    """ enabledなら呼び出し回数を数え、終了時に表示して metrics にも記録する
+    """
+    if not enabled:
+        yield None
+        return
+    org_stat, org_lstat = os.stat, os.lstat
+    os.stat = _counted("stat", org_stat)
+    os.lstat = _counted("lstat", org_lstat)
+    # Python 3.10以前のpathlibはimport時にos.stat/os.lstatを_NormalAccessorに持つので、そちらも差し替える
+    accessor = getattr(pathlib, "_normal_accessor", None)
+    if accessor is not None:
+        accessor.stat, accessor.lstat = os.stat, os.lstat
+    _tracer.counts = {}
+    _tracer.start()
+    try:
+        yield _tracer
+    finally:
+        _tracer.stop()
+        os.stat, os.lstat = org_stat, org_lstat
+        if accessor is not None: # インスタンスの属性を消してクラスの属性(元の関数)に戻す
+            del accessor.stat, accessor.lstat
+        metrics.current().io_calls = _tracer.counts
+        print(_tracer.summary())
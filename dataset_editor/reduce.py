@@ -3,14 +3,46 @@
 抽出されたデータセットは対象ディレクトリ_reducedという名称のディレクトリに保存される
 """
 from __future__ import annotations
+DESCRIPTION=__doc__
+EPILOG='''
+<詳細>-------------------------------------
+--by stride (default)
+    ファイル名順に skip_num 個ごとに1つ抽出する。
+--by similarity
+    画像を小さいグレースケール画像に縮小し、最後に抽出したフレームとの平均画素差(0~1)が
+    threshold を超えたフレームだけを抽出する。先頭のフレームは必ず抽出される。
+    numpy と Pillow が必要 (pip install -e .[similarity])。
+    ・画像(.jpg, .jpeg, .png)だけを対象にする。stride と異なり、アノテーション等の画像以外のファイルは抽出されない。
+    ・読めない画像(壊れたファイル等)は警告を表示して抽出し、比較には使わない。
+'''
 from pathlib import Path
-import shutil
 from argparse import ArgumentParser, RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from dataset_editor import catalog, metrics, plan, scan, sorting, transfer
+
+
+THUMBNAIL_SIZE = (32, 32)
+BATCH_SIZE = 4096
+WINDOW_SIZE = 64
 
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("data_dir", type=str)
+    parser.add_argument("--by", type=str, choices=["stride", "similarity"], default="stride",
+                        help="reduce mode. default is stride")
     parser.add_argument("--skip_num", type=int, default=2)
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="similarity mode only. mean abs diff (0~1) to keep a frame. default is 0.05")
+    parser.add_argument("--decode_workers", type=int, default=None,
+                        help="similarity mode only. num processes for decoding. default is cpu count")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
+    catalog.add_arguments(parser)
+    sorting.add_arguments(parser)
 
     return parser
 
@@ -19,29 +51,152 @@ def main(*args, **kwargs):
     # 対象データディレクトリの存在確認
     data_dir = Path(kwargs["data_dir"]).absolute()
     assert data_dir.absolute()
-    # 飛ばし数の確認
-    skip_num = int(kwargs["skip_num"])
-    assert skip_num > 1
+    by = kwargs.get("by", "stride")
+    if by == "stride":
+        # 飛ばし数の確認
+        skip_num = int(kwargs["skip_num"])
+        assert skip_num > 1
+    else:
+        threshold = float(kwargs["threshold"])
+        assert 0.0 <= threshold <= 1.0
+        check_similarity_requirements() # 走査する前に確かめる
 
-    # データの読み込み
-    data_paths = [ data for data in data_dir.glob("*") if data.is_file() ]
-    assert len(data_paths) > 0
-    data_paths.sort()
-    num_data = len(data_paths)
-
-    # 保存用ディレクトリの作成
     save_dir = Path(f"{data_dir}_reduced")
-    save_dir.mkdir(exist_ok=True)
 
-    # 保存用ディレクトリにコピー
-    print("copying...")
-    for id, data_path in enumerate(data_paths[::skip_num], start=1):
-        shutil.copy(data_path, save_dir)
-        print(f"\r{id:>5}/{num_data:>5}, {data_path}->{save_dir}", end="")
-    print("\ndone")
+    if by == "stride":
+        # 名前順に並べながら読み(メモリの上限を超えた分は一時ファイルで並べる)、skip_num個ごとに抽出する
+        with metrics.phase("scan"):
+            if kwargs.get("catalog") is None:
+                names = scan.iter_files(data_dir)
+            else:
+                names = catalog.scan(data_dir, kwargs["catalog"]).files
+            data_names = sorting.ExternalSort(memory_mb=kwargs.get("sort_memory_mb", sorting.DEFAULT_MEMORY_MB)).extend(names)
+            del names
+        num_data = len(data_names)
+        assert num_data > 0
+        reduced_paths = [data_dir.joinpath(name) for name in itertools.islice(data_names, 0, None, skip_num)]
+    else:
+        # データの読み込み
+        scanned = catalog.scan(data_dir, kwargs.get("catalog"))
+        data_names = scanned.select(scan.IMG_SUFFIXES)
+        assert len(data_names) > 0
+        data_names.sort()
+        data_paths = [data_dir.joinpath(name) for name in data_names]
+        num_data = len(data_paths)
+
+        # 抽出
+        print(f"comparing... threshold={threshold}")
+        reduced_paths = [data_paths[i] for i in select_by_similarity(data_paths, threshold, kwargs.get("decode_workers"))]
+
+    # 保存用ディレクトリを作成してコピー
+    print(f"copying... {data_dir}->{save_dir}")
+    plan.Executor.from_kwargs(kwargs).run(plan.Plan().copy_into(reduced_paths, save_dir))
+    print(f"{len(reduced_paths):>5}/{num_data:>5}")
+    print("done")
+
+
+def check_similarity_requirements():
+    try:
+        import numpy
+        import PIL
+    except ImportError as e:
+        raise ImportError(f"'--by similarity' requires numpy and Pillow ({e.name} is missing). pip install -e .[similarity]") from e
+
+
+def load_thumbnail(path: Path):
+    """ 画像を THUMBNAIL_SIZE のグレースケール(uint8, 1次元)にする. JPEGは縮小デコードする
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("L", (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        img = img.convert("L").resize(THUMBNAIL_SIZE, Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8).reshape(-1)
+
+
+def _try_load_thumbnail(path: Path):
+    """ load_thumbnail. 読めない場合は (None, エラー) を返す(1枚の失敗で全体を止めない)
+    """
+    try:
+        return load_thumbnail(path), None
+    except Exception as e: # 壊れた画像、画像でないファイル、大きすぎる画像(DecompressionBombError)など
+        return None, repr(e)
+
+
+def select_by_similarity(paths: List[Path], threshold: float, workers: Optional[int] = None) -> List[int]:
+    """ 最後に抽出したフレームとの差が threshold を超えるフレームのindexを返す.
+    デコードはプロセスプールで行い、差分はBATCH_SIZE枚ずつnumpyでまとめて計算する.
+    読めない画像は警告を表示して抽出し、比較には使わない(最後に抽出したフレームは変えない).
+    """
+    check_similarity_requirements()
+    import numpy as np
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunksize = max(1, min(256, len(paths) // (4 * workers)))
+    kept: List[int] = []
+    last = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_try_load_thumbnail, paths, chunksize=chunksize)
+        for offset, batch in _batches(results, BATCH_SIZE):
+            idxes: List[int] = [] # batchのうち読めた画像のindex
+            for i, (thumbnail, error) in enumerate(batch):
+                if thumbnail is None:
+                    print(f"[Warning] cannot decode {paths[offset + i]}: {error}. keep it")
+                    kept.append(offset + i)
+                else:
+                    idxes.append(i)
+            if len(idxes) == 0:
+                continue
+            frames = np.stack([batch[i][0] for i in idxes]).astype(np.float32) / 255.0
+            selected, last = _select_batch(frames, last, threshold)
+            kept += [offset + idxes[j] for j in selected]
+    kept.sort()
+    return kept
+
+
+def _batches(items: Iterable, size: int) -> Iterable[Tuple[int, list]]:
+    batch = []
+    offset = 0
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield offset, batch
+            offset += size
+            batch = []
+    if len(batch) > 0:
+        yield offset, batch
+
+
+def _select_batch(frames, last, threshold: float):
+    """ frames (N, H*W) の中から抽出するindexと、最後に抽出したフレームを返す.
+    最後に抽出したフレームとの差を WINDOW_SIZE 枚ずつまとめて計算し、最初に閾値を超えたものを抽出する.
+    """
+    import numpy as np
+
+    idxes: List[int] = []
+    i = 0
+    if last is None:
+        idxes.append(0)
+        last = frames[0]
+        i = 1
+    num_frames = len(frames)
+    while i < num_frames:
+        window = frames[i:i + WINDOW_SIZE]
+        diffs = np.abs(window - last).mean(axis=1)
+        over = np.flatnonzero(diffs > threshold)
+        if len(over) == 0:
+            i += len(window)
+            continue
+        j = i + int(over[0])
+        idxes.append(j)
+        last = frames[j]
+        i = j + 1
+    return idxes, last
 
 
 if __name__ == "__main__":
-    parser = ArgumentParser(description=__doc__, formatter_class=RawTextHelpFormatter)
+    parser = ArgumentParser(description=DESCRIPTION, epilog=EPILOG, formatter_class=RawTextHelpFormatter)
     parser = add_arguments(parser)
     main(**vars(parser.parse_args()))
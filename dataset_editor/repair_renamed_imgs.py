@@ -8,23 +8,24 @@ EPILOG='''
 画像ディレクトリの親ディレクトリ上に保存用ディレクトリを作成する。
 画像ファイルをコピーして、リネーム情報を使って数字ネームから元ネームに変換して保存用ディレクトリに保存する。
 画像ディレクトリ内にリネーム情報のファイルが見つからない場合は無視される。
+--catalog を指定した場合、json を省略すると画像ディレクトリの親ディレクトリの numbering2org.json をカタログから読む。
 '''
 
 import json
 from pathlib import Path
 from argparse import ArgumentParser, RawTextHelpFormatter
-import shutil
-import glob
-from typing import List, Dict
+from typing import List, Dict, Optional
 import sys
 from xml.dom import NotFoundErr
 
-import tqdm
+from dataset_editor import catalog, plan
 
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("imgdir", type=str, help="img dir")
-    parser.add_argument("json", type=str, help="renamed2org.json")
+    parser.add_argument("json", type=str, nargs="?", default=None,
+                        help="renamed2org.json. can be omitted with --catalog")
+    catalog.add_arguments(parser)
 
     return parser
 
@@ -32,17 +33,25 @@ def add_arguments(parser: ArgumentParser):
 def main(*args , **kwargs):
     imgdir = Path(kwargs['imgdir']).absolute()
     check_input_path(imgdir)
-    rename_info_file = Path(kwargs['json']).absolute()
-    check_input_path(rename_info_file)
+    catalog_path: Optional[str] = kwargs.get('catalog')
+    if kwargs['json'] is None:
+        assert catalog_path is not None, "json or --catalog is required"
+        renamed2org = catalog.numbering2org(imgdir.parent, catalog_path)
+        assert renamed2org is not None, f"Not Found rename info of {imgdir.parent} in {catalog_path}"
+    else:
+        rename_info_file = Path(kwargs['json']).absolute()
+        check_input_path(rename_info_file)
+        renamed2org = None
     
     save_dir = imgdir.parent / Path("org_imgs")
     assert not save_dir.exists(), save_dir
-    save_dir.mkdir()
 
     try:
-        renamed2org = load_renamed2org_json(rename_info_file)
+        if renamed2org is None:
+            renamed2org = load_renamed2org_json(rename_info_file)
 
-        copy_as_orgname(renamed2org, imgdir, save_dir)
+        copy_plan = plan_as_orgname(renamed2org, imgdir, save_dir, catalog_path)
+        plan.Executor.from_kwargs(kwargs).run(copy_plan)
     except Exception as e:
         print(e)
         print(f"[Warning] remove {save_dir}")
@@ -68,32 +77,34 @@ def load_json(path:Path):
 
 
 
-def copy_as_orgname(renamed2org:Dict[str, str], imgdir:Path, save_dir:Path):
-    """ # copy as orgname
-    ファイル名が変更された情報(renamed2org)に基づいて、対象画像ファイルをオリジナルの名前として保存する.  
+def plan_as_orgname(renamed2org:Dict[str, str], imgdir:Path, save_dir:Path, catalog_path:Optional[str]=None) -> plan.Plan:
+    """ # plan as orgname
+    ファイル名が変更された情報(renamed2org)に基づいて、対象画像ファイルをオリジナルの名前として保存する計画を作る.  
     コレはアノテーション作業用に元のファイルの名前をナンバリングした名前に変更する処理を行った際に行われた処理を巻き戻す処理である。
 
     Args:
         renamed2org (Dict[str, str]): 変更された名前からオリジナルの名前への辞書. renamed2org.jsonファイルから読み込んだデータ。
         imgdir (Path): 対象元ディレクトリ
         save_dir (Path): 保存先ディレクトリ
+        catalog_path (Optional[str]): 対象元ディレクトリのファイル一覧を読むカタログ
     """
     # 名前変更済みファイルのパス群を取得
     suffixes = set([Path(key).suffix for key in renamed2org.keys()])
-    img_paths:List[Path] = [] 
-    for suffix in suffixes:
-        img_paths += [Path(p) for p in glob.glob(f"{imgdir}/*{suffix}")]
+    scanned = catalog.scan(imgdir, catalog_path, hidden=False)
+    img_paths:List[Path] = scanned.paths(scanned.select(suffixes))
     if len(img_paths) == 0:
         raise FileNotFoundError(f"{imgdir}/*{suffixes}")
     
     # オリジナルの名前としてコピーする
-    for img_path in tqdm.tqdm(img_paths):
+    copy_plan = plan.Plan().mkdir(save_dir)
+    for img_path in img_paths:
         if img_path.name not in renamed2org.keys():
             print(f"[Info] not Found {img_path} in renamed2org")
             continue
         org_name = renamed2org[img_path.name]
         save_path = Path(f"{save_dir}/{org_name}")
-        shutil.copy(img_path, save_path)
+        copy_plan.copy(img_path, save_path)
+    return copy_plan
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+""" os.scandirによる1パスのディレクトリ走査
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from dataset_editor import metrics
+
+
+IMG_SUFFIXES = [".jpg", ".png", ".jpeg"]
+IMG_SUFFIXES += [suffix.upper() for suffix in IMG_SUFFIXES]
+ANN_SUFFIXES = [".xml"]
+
+
+class ScanResult:
+    """ ディレクトリ直下のエントリをファイル/ディレクトリ/接尾辞ごとに分類した結果.
+    Pathオブジェクトは作らず名前(str)のみ保持する. 必要な時にpaths()でPathにする.
+
+    ファイルかどうかはd_typeで判定するので、stat呼び出しはシンボリックリンクと
+    d_typeを返さないファイルシステムのエントリに限られる.
+    """
+    def __init__(self, root: Path):
+        self.root: Path = root
+        self.files: List[str] = []
+        self.dirs: List[str] = []
+        self.by_suffix: Dict[str, List[str]] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+
+    def select(self, suffixes: Iterable[str]) -> List[str]:
+        """ 指定の接尾辞(大文字小文字を区別する)を持つファイル名を返す
+        """
+        names: List[str] = []
+        for suffix in dict.fromkeys(suffixes):
+            names += self.by_suffix.get(suffix, [])
+        return names
+
+
+    def paths(self, names: Iterable[str] = None) -> List[Path]:
+        """ 名前をrootからのPathにする. namesを省略した場合は全ファイル
+        """
+        if names is None:
+            names = self.files
+        root = self.root
+        return [root.joinpath(name) for name in names]
+
+
+def scan(path: Union[str, Path], hidden: bool = True) -> ScanResult:
+    """ pathの直下を1回だけ読み、ファイルとディレクトリを分類する.
+
+    Args:
+        path (Union[str, Path]): 対象ディレクトリ
+        hidden (bool): '.'から始まるエントリを含めるか. glob.globと同じ挙動にする場合はFalse
+    """
+    with metrics.phase("scan"):
+        return _scan(path, hidden)
+
+
+def iter_files(path: Union[str, Path], hidden: bool = True, suffixes: Optional[Iterable[str]] = None) -> Iterator[str]:
+    """ pathの直下のファイル名を読んだ順に返す. scanと異なり一覧を保持しないので、巨大なディレクトリを並べ替えながら読む場合に使う
+
+    Args:
+        suffixes (Optional[Iterable[str]]): 指定した場合はその接尾辞(大文字小文字を区別する)のファイルのみ
+    時間は呼び出し側でmetrics.phase("scan")に数える(ジェネレータの中で計ると途中で止まった場合に閉じられないため)
+    """
+    suffixes = None if suffixes is None else set(suffixes)
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if not hidden and name.startswith("."):
+                continue
+            if suffixes is not None and os.path.splitext(name)[1] not in suffixes:
+                continue
+            try:
+                if entry.is_file():
+                    yield name
+            except OSError: # 壊れたリンク等
+                continue
+
+
+def _scan(path: Union[str, Path], hidden: bool) -> ScanResult:
+    result = ScanResult(Path(path))
+    files = result.files
+    dirs = result.dirs
+    by_suffix = result.by_suffix
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if not hidden and name.startswith("."):
+                continue
+            try:
+                is_file = entry.is_file()
+            except OSError: # 壊れたリンク等
+                continue
+            if is_file:
+                files.append(name)
+                suffix = os.path.splitext(name)[1]
+                if suffix not in by_suffix:
+                    by_suffix[suffix] = []
+                by_suffix[suffix].append(name)
+            elif entry.is_dir():
+                dirs.append(name)
+    return result
@@ -0,0 +1,165 @@
+""" データのファイル名 '*_yyyymmdd_hhmmss_NNNNN.suffix' の解析
+ファイル名の一覧をコンパイル済みの正規表現で1回ずつ走査し、日付、時刻、フレーム番号、接頭辞を型付きの配列で返す.
+不正なファイル名はファイルごとに例外を出さずに理由ごとに集計する.
+"""
+from __future__ import annotations
+from array import array
+import datetime
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# 接尾辞を除いた名前(stem)に対して使う. 'prefix_yyyymmdd_hhmmss_' の部分が無くてもフレーム番号だけは取り出す.
+# 'prefix_' は省略できる('yyyymmdd_hhmmss_NNNNN')
+STEM_PATTERN = re.compile(
+    r"(?:(?:(?P<prefix>.*)_)?(?P<date>[0-9]{8})_(?P<time>[0-9]{6})_|(?P<head>.*)_)?(?P<frame>\d+)",
+    re.DOTALL,
+)
+NO_FRAME = -1
+NUM_EXAMPLES = 5
+# 不正の理由
+FORMAT = "format" # '*_yyyymmdd_hhmmss_NNNNN' の形でない
+DATE = "date"     # 存在しない日付
+TIME = "time"     # 存在しない時刻
+REASONS = [FORMAT, DATE, TIME]
+
+
+class SchemaReport:
+    """ 不正なファイル名の理由ごとの件数と例
+    """
+    def __init__(self):
+        self.reason2count: Dict[str, int] = {reason: 0 for reason in REASONS}
+        self.reason2examples: Dict[str, List[str]] = {reason: [] for reason in REASONS}
+
+
+    def __len__(self) -> int:
+        return sum(self.reason2count.values())
+
+
+    def add(self, reason: str, name: str):
+        self.reason2count[reason] += 1
+        examples = self.reason2examples[reason]
+        if len(examples) < NUM_EXAMPLES:
+            examples.append(name)
+
+
+    def __str__(self) -> str:
+        text = f"invalid names: {len(self)}"
+        for reason in REASONS:
+            count = self.reason2count[reason]
+            if count == 0:
+                continue
+            text += f"\n  {reason}: {count} (e.g. {', '.join(self.reason2examples[reason])})"
+        return text
+
+
+class ParsedNames:
+    """ ファイルごとの解析結果. i番目の要素は入力のi番目のファイル名に対応する.
+
+    - dates, times: yyyymmdd, hhmmss を整数にしたもの. valid[i]が0の場合は0 (不正な日付や時刻も0にする)
+    - frames: フレーム番号. 名前が数字で終わらない場合は NO_FRAME
+    - prefix_ids: 接頭辞の表 prefixes のindex
+    """
+    def __init__(self):
+        self.valid = array("B")
+        self.dates = array("I")
+        self.times = array("I")
+        self.frames = array("q")
+        self.prefix_ids = array("I")
+        self.reason_ids = array("B")       # 0: 有効, 1~: REASONS[reason_id-1]
+        self.prefixes: List[str] = []
+        self.report = SchemaReport()
+        self._prefix2id: Dict[str, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+
+    def append(self, name: str, reason: Optional[str], date: int, time: int, frame: int, prefix: str):
+        """ 1ファイル分の結果を追加する. reasonがNoneなら有効
+        """
+        prefix_id = self._prefix2id.get(prefix)
+        if prefix_id is None:
+            prefix_id = self._prefix2id[prefix] = len(self.prefixes)
+            self.prefixes.append(prefix)
+        self.prefix_ids.append(prefix_id)
+        self.frames.append(frame)
+        if reason is None:
+            self.reason_ids.append(0)
+            self.valid.append(1)
+            self.dates.append(date)
+            self.times.append(time)
+        else:
+            self.valid.append(0)
+            self.dates.append(0)
+            self.times.append(0)
+            self.reason_ids.append(REASONS.index(reason) + 1)
+            self.report.add(reason, name)
+
+
+    def reason(self, i: int) -> Optional[str]:
+        reason_id = self.reason_ids[i]
+        return None if reason_id == 0 else REASONS[reason_id - 1]
+
+
+    def date_time(self, i: int) -> str:
+        """ 'yyyymmdd_hhmmss'
+        """
+        return f"{self.dates[i]:08d}_{self.times[i]:06d}"
+
+
+    def date_times(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.date_time(i)
+
+
+def parse(names: Iterable[str]) -> ParsedNames:
+    """ ファイル名(またはパス)の一覧を解析する. 日付と時刻の妥当性は値ごとに1回だけ判定する
+    """
+    parsed = ParsedNames()
+    append = parsed.append
+    date2ok: Dict[str, bool] = {}
+    time2ok: Dict[str, bool] = {}
+    match = STEM_PATTERN.fullmatch
+    splitext = os.path.splitext
+    basename = os.path.basename
+
+    for name in names:
+        name = basename(name)
+        m = match(splitext(name)[0])
+        if m is None:
+            append(name, FORMAT, 0, 0, NO_FRAME, "")
+            continue
+        frame = int(m.group("frame"))
+        date, time = m.group("date", "time")
+        if date is None:
+            append(name, FORMAT, 0, 0, frame, m.group("head") or "")
+            continue
+        date_ok = date2ok.get(date)
+        if date_ok is None:
+            date_ok = date2ok[date] = _is_valid_date(date)
+        time_ok = time2ok.get(time)
+        if time_ok is None:
+            time_ok = time2ok[time] = _is_valid_time(time)
+        reason = None if date_ok and time_ok else DATE if not date_ok else TIME
+        append(name, reason, int(date), int(time), frame, m.group("prefix") or "")
+
+    return parsed
+
+
+def _is_valid_date(word: str) -> bool:
+    try:
+        datetime.date(year=int(word[:4]), month=int(word[4:6]), day=int(word[6:]))
+    except ValueError:
+        return False
+    return True
+
+
+def _is_valid_time(word: str) -> bool:
+    try:
+        datetime.time(hour=int(word[:2]), minute=int(word[2:4]), second=int(word[4:]))
+    except ValueError:
+        return False
+    return True
@@ -12,14 +12,14 @@ EPILOG='''
 （このディレクトリのxxxxxはグループの最小のナンバーでXXXXXは最大のナンバーである。）
 続けて`dataset_xxxxx_XXXXX`ディレクトリ下に`imgs_xxxxx_XXXXX`というディレクトリを作成する。
 そして`imgs_xxxxx_XXXXX`下にグループ内の画像ファイルのシンボリックリンクを作成する(参照リンクで)
+既に正しいリンクがある場合は作り直さないので、ファイルを追加してから再実行すると追加分のリンクとグループだけが作られる。
 '''
 
 import os
 from argparse import ArgumentParser, RawTextHelpFormatter
 from pathlib import Path
-import glob
 
-from natsort import natsorted
+from dataset_editor import plan, scan, sorting, transfer
 
 
 CURR_DIR = Path(os.path.abspath(os.path.curdir))
@@ -31,6 +31,7 @@ def add_arguments(parser: ArgumentParser):
                         help="devided number for dataset. default is 500")
     parser.add_argument("-o", "--output", type=str, default=f"{CURR_DIR}",
                         help=f"output root dir. default {CURR_DIR}")
+    transfer.add_arguments(parser)
 
     return parser
 
@@ -46,15 +47,20 @@ def main(*args , **kwargs):
 
     # get file names and sort
     files = get_file_names(file_dir)
+    print(f"{len(files)} files")
 
     # devide file with number into group
     file_groups, file_infos = devide_files(files, kwargs['devide_number'])
 
+    link_plan = plan.Plan()
+
     # mkdir group
-    mkdir_groups(file_infos, out_dir)
+    mkdir_groups(file_infos, out_dir, link_plan)
 
     # make simbolic link
-    link_files(file_groups, file_infos)
+    link_files(file_groups, file_infos, link_plan, file_dir)
+
+    plan.Executor.from_kwargs(kwargs).run(link_plan)
 
 
 def check_path(path:Path):
@@ -66,14 +72,12 @@ def check_nn(num:int):
 
 
 def get_file_names(dir:Path, order='asc'):
-    files = [ Path(p).absolute() for p in glob.glob(f"{dir}/*") ]
+    """ dir直下のファイル名('.'から始まるものは除く)を自然順(natsortと同じ順)に並べる
+    """
+    files = scan.scan(dir, hidden=False).files
 
     assert order in ['asc', 'desc']
-    if order=='asc':
-        files = natsorted(files)
-    else:
-        files = natsorted(files, reverse=True)
-    return files
+    return sorting.natural_sorted(files, reverse=(order == 'desc'))
 
 
 def devide_files(files:list, devided_num:int):
@@ -81,7 +85,7 @@ def devide_files(files:list, devided_num:int):
     file_infos = []
 
     num_files = len(files)
-    iter_num = (num_files // devided_num) + 1
+    iter_num = (num_files + devided_num - 1) // devided_num # 割り切れる場合に空のグループを作らない
     for i in range(iter_num):
         sidx = devided_num * (i)
         eidx = devided_num * (i+1)
@@ -97,42 +101,43 @@ def devide_files(files:list, devided_num:int):
     return file_groups, file_infos
 
 
-def mkdir_groups(file_infos:list, out_dir:Path):
-    mkdir_text = "make dir {}"
+def group_info_of(number:int, devided_num:int) -> dict:
+    """ 番号number(1始まり)のファイルが入るグループの情報. devide_filesと同じく devided_num 個ごとに区切る
+    """
+    i = (number - 1) // devided_num
+    return {'min':f"{devided_num * i + 1:05}", 'max':f"{devided_num * (i + 1):05}"}
+
+
+def mkdir_groups(file_infos:list, out_dir:Path, link_plan:plan.Plan):
     out_dir = Path(f"{out_dir}/datasets")
-    if not out_dir.exists():
-        out_dir.mkdir()
-        print(mkdir_text.format(out_dir))
+    link_plan.mkdir(out_dir)
 
     for info in file_infos:
         # make dataset dir
         dataset_dir_name = "dataset_{}_{}".format(info['min'], info['max'])
         dataset_dir = out_dir / Path(dataset_dir_name)
-        if not dataset_dir.exists():
-            dataset_dir.mkdir()
-            print(mkdir_text.format(dataset_dir))
+        link_plan.mkdir(dataset_dir)
         info['dataset_dir'] = dataset_dir
 
         # make imgs dir
         imgs_dir_name = "imgs_{}_{}".format(info['min'], info['max'])
         imgs_dir = dataset_dir / Path(imgs_dir_name)
-        if not imgs_dir.exists():
-            imgs_dir.mkdir()
-            print(mkdir_text.format(imgs_dir))
+        link_plan.mkdir(imgs_dir)
         info['imgs_dir'] = imgs_dir
 
     return
 
 
-def link_files(file_groups:list, file_infos:list):
+def link_files(file_groups:list, file_infos:list, link_plan:plan.Plan, file_dir:Path):
+    """ file_dir直下のファイル名のグループを、グループのimgsディレクトリからの相対パスのsymlinkにする.
+    相対パスの接頭辞はグループごとに1回だけ求める. 既存のリンクは中身が異なる場合だけ置き換える(Executor)
+    """
+    join = os.path.join
     for g, info in zip(file_groups, file_infos):
-        imgs_dir = info['imgs_dir']
-        for f in g:
-            src_path = Path(os.path.relpath(f, imgs_dir)) # 参照パスの作成
-            out_path = Path(f"{imgs_dir}/{Path(src_path.name)}")
-            if out_path.exists():
-                os.remove(out_path)
-            os.symlink(src_path, out_path)
+        imgs_dir = os.fspath(info['imgs_dir'])
+        rel_dir = os.path.relpath(file_dir, imgs_dir) # 参照パスの作成
+        for name in g:
+            link_plan.link(join(rel_dir, name), join(imgs_dir, name))
 
 
 if __name__ == "__main__":
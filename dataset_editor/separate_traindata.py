@@ -2,15 +2,21 @@
 """
 from __future__ import annotations
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
-import datetime
+from array import array
+import bisect
 import logging
+import math
+import os
 from pathlib import Path
 import random
-from typing import Any, Dict, List, Tuple, Union, Optional
-import shutil
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple, Union, Optional
 
+from dataset_editor import catalog, metrics, plan, scan, schema, shard, sorting, transfer
 
-DATETIME2PATHS = Dict[str, List[Path]]
+
+SPLITS = ["trains", "tests", "vals"]
+DEFAULT_TOLERANCE = 0.01
+MAX_SWAPS = 64
 
 def add_arguments(parser: ArgumentParser):
     parser.add_argument("dataset_dir", type=str, help="dataset dir path")
@@ -18,7 +24,15 @@ def add_arguments(parser: ArgumentParser):
     parser.add_argument("--ratio", type=float, default=0.4, help="test ratio. train:test = (1-ratio):ratio.")
     parser.add_argument("--not_val", action="store_true")
     parser.add_argument("--random", action="store_true", help="ランダムフラグ. このフラグがONの時はデータに関係なくランダムに分割する")
+    parser.add_argument("--seed", type=int, default=None, help="random seed. 同じseedなら同じ分割結果になる")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"許容する分割比率の誤差(全データ数に対する割合). default is {DEFAULT_TOLERANCE}")
     parser.add_argument("--log_level", type=str, choices=["info", "debug"], default="info", help="log level")
+    transfer.add_arguments(parser)
+    transfer.add_link_arguments(parser)
+    catalog.add_arguments(parser)
+    shard.add_arguments(parser)
+    sorting.add_arguments(parser)
 
     return parser
 
@@ -31,22 +45,45 @@ def main(*args, **kwargs):
     check_path(kwargs["dataset_dir"])
     check_path(Path(kwargs["output_dir"]).parent)
     check_ratio(kwargs["ratio"])
+    shard_spec = shard.parse_spec(kwargs["shard_by"]) if kwargs.get("shard_by") else None
 
-    # データ群のパスの検索
-    dataset_paths = find_dataset(kwargs['dataset_dir'])
+    # データ群の検索
+    index = find_dataset(kwargs['dataset_dir'], kwargs.get('catalog'), kwargs.get('sort_memory_mb', sorting.DEFAULT_MEMORY_MB))
 
     if kwargs['random']:
-        train_paths, test_paths, val_paths = separate_random(dataset_paths, kwargs["not_val"], kwargs["ratio"])
+        train_ids, test_ids, val_ids = separate_random(index, kwargs["not_val"], kwargs["ratio"], kwargs["seed"])
     else:
         # 有効なデータ群か調査する
-        check_valid_dataset(dataset_paths)
+        parsed = check_valid_dataset(index, kwargs.get('catalog'))
         # データ群を学習用、テスト用、検証用に分割する
-        train_paths, test_paths, val_paths = separate_dataset(dataset_paths, kwargs['not_val'], kwargs["ratio"])
+        train_ids, test_ids, val_ids = separate_dataset(
+            index, kwargs['not_val'], kwargs["ratio"], kwargs["seed"], kwargs["tolerance"], parsed)
+
+    # 撮影日時グループで分ける場合、ランダム分割ではまだグループを作っていないので作る
+    if shard_spec is not None and shard_spec.kind == "group" and len(index.group_keys) == 0:
+        index.group_by(catalog.parse(index.root, index.names(), kwargs.get('catalog')).date_times())
 
     # 分割されたデータ群をそれぞれコピーして保存する。
-    copy_paths(train_paths, kwargs['output_dir'], "trains")
-    copy_paths(test_paths, kwargs['output_dir'], "tests")
-    if val_paths is not None: copy_paths(val_paths, kwargs['output_dir'], "vals")
+    split2ids = {"trains": train_ids, "tests": test_ids, "vals": val_ids}
+    targets: List[Tuple[Path, Iterable[str]]] = []
+    split2shards: Dict[str, Dict[str, List[str]]] = {}
+    for split, ids in split2ids.items():
+        if ids is None:
+            continue
+        split_targets, split2shards[split] = copy_paths(index, ids, kwargs['output_dir'], split, shard_spec)
+        targets += split_targets
+    executor = plan.Executor.from_kwargs(kwargs)
+    executor.copy_names(index.root, targets, sum(len(ids) for ids in split2ids.values() if ids is not None))
+
+    # 元の名前から保存先への対応を書き出す
+    if shard_spec is not None and not executor.dry_run:
+        manifest_file = shard.write_manifest(Path(kwargs['output_dir']), split2shards, shard_spec)
+        logging.info(f"write {manifest_file}")
+
+    # 分割結果をカタログに記録する
+    if not executor.dry_run:
+        catalog.save_splits(index.root, {split: index.names(ids) for split, ids in split2ids.items() if ids is not None},
+                            kwargs.get('catalog'))
 
 
 def show_cli_args(cli_args:Dict[str, Any]):
@@ -89,198 +126,358 @@ def check_ratio(ratio:float):
     assert 0.0 < ratio < 1.0
 
 
+class DatasetIndex:
+    """ データ群のファイル名と撮影日時グループの表.
+    数百万ファイルでもPathやファイルごとのlistを作らないように、ファイル名は1つのバッファに、
+    グループはファイルごとの整数idとグループ表(キーとデータ数)で持つ. 分割はファイル/グループの整数indexで行う.
+
+    ファイルは名前順に並べる(同じseedなら走査順によらず同じ分割結果になる). namesは名前順で渡すこと.
+    """
+    def __init__(self, root: Path, names: Iterable[str]):
+        self.root: Path = root
+        buffer = bytearray()
+        self._offsets = array("Q", [0])
+        for name in names:
+            buffer += os.fsencode(name) # UTF-8でない名前(surrogateescape)もそのまま戻せるように
+            self._offsets.append(len(buffer))
+        self._names: bytes = bytes(buffer)
+        del buffer
+        self.group_ids = array("I")        # ファイル -> グループid
+        self.group_keys: List[str] = []    # グループid -> 撮影日時(yyyymmdd_hhmmss)
+        self.group_sizes = array("Q")      # グループid -> データ数
+
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+    def name(self, i: int) -> str:
+        return os.fsdecode(self._names[self._offsets[i]:self._offsets[i + 1]])
+
+
+    def names(self, ids: Optional[Sequence[int]] = None) -> Iterator[str]:
+        if ids is None:
+            ids = range(len(self))
+        for i in ids:
+            yield self.name(i)
+
+
+    def group_by(self, keys: Iterable[str]):
+        """ ファイルごとのグループのキー(ファイルと同じ順)で撮影日時グループを作る
+        """
+        key2id: Dict[str, int] = {}
+        group_ids = array("I")
+        for key in keys:
+            gid = key2id.get(key)
+            if gid is None:
+                gid = len(self.group_keys)
+                key2id[key] = gid
+                self.group_keys.append(key)
+                self.group_sizes.append(0)
+            group_ids.append(gid)
+            self.group_sizes[gid] += 1
+        self.group_ids = group_ids
+
+
+    def file_ids(self, group_labels: Sequence[int], labels: int) -> Tuple[array, ...]:
+        """ グループごとのラベル(0~labels-1)から、ラベルごとのファイルのindexを返す
+        """
+        ids = tuple(array("I") for _ in range(labels))
+        for i, gid in enumerate(self.group_ids):
+            ids[group_labels[gid]].append(i)
+        return ids
+
+
 @add_log_function_start_end_with_debug
-def find_dataset(path:Union[str, Path]) -> List[Path]:
+def find_dataset(path:Union[str, Path], catalog_path:Optional[str]=None, sort_memory_mb:int=sorting.DEFAULT_MEMORY_MB) -> DatasetIndex:
     # データ群のパスの検索
+    ## 一覧のリストを作らずに、画像とアノテーションに振り分けながら名前順に並べる
     _path = Path(path)
+    img_suffixes = set(scan.IMG_SUFFIXES)
+    img_names = sorting.ExternalSort(memory_mb=sort_memory_mb)
+    ann_names = sorting.ExternalSort(memory_mb=sort_memory_mb)
+    with metrics.phase("scan"):
+        for name in catalog.iter_files(_path, catalog_path, suffixes=scan.IMG_SUFFIXES + scan.ANN_SUFFIXES):
+            if os.path.splitext(name)[1] in img_suffixes:
+                img_names.add(name)
+            else:
+                ann_names.add(name)
+    logging.debug(f"num img paths is {len(img_names)}")
+    logging.debug(f"num ann paths is {len(ann_names)}")
 
-    img_fmts = [".jpg", ".png", ".jpeg"]
-    img_fmts += list(map(lambda fmt:fmt.upper(), img_fmts))
-    img_paths = [Path(p) for fmt in img_fmts for p in _path.glob(f"*{fmt}")]
-    dataset_paths = img_paths
-    logging.debug(f"num img paths is {len(img_paths)}")
+    dataset_names, unused = img_names, ann_names
+    if len(img_names) < len(ann_names):
+        dataset_names, unused = ann_names, img_names
+    unused.close()
 
-    ann_fmts = [".xml"]
-    ann_paths = [Path(p) for fmt in ann_fmts for p in _path.glob(f"*{fmt}")]
-    if len(dataset_paths) < len(ann_paths):
-        dataset_paths = ann_paths
-    logging.debug(f"num ann paths is {len(ann_paths)}")
+    assert len(dataset_names) > 0, f"Not Found file in {_path}"
 
-    assert len(dataset_paths) > 0, f"Not Found file in {_path}"
-
-    return dataset_paths
+    return DatasetIndex(_path, dataset_names)
 
 
 @add_log_function_start_end_with_debug
-def separate_random(paths:List[Path], is_not_use_val:bool, test_ratio:float=0.4) -> Tuple[List[Path], List[Path], Optional[List[Path]]]:
-    random.shuffle(paths)
-    num_all_paths:int = len(paths)
+def separate_random(index:DatasetIndex, is_not_use_val:bool, test_ratio:float=0.4, seed:Optional[int]=None) -> Tuple[array, array, Optional[array]]:
+    ids = list(range(len(index)))
+    random.Random(seed).shuffle(ids)
+    num_all_paths:int = len(ids)
     separate_idx:int = int(round(num_all_paths * (1-test_ratio)))
 
-    train_paths:List[Path] = paths[:separate_idx]
-    test_paths:List[Path] = paths[separate_idx:]
-    val_paths:Optional[List[Path]] = None
+    train_ids = array("I", ids[:separate_idx])
+    test_ids = array("I", ids[separate_idx:])
+    val_ids:Optional[array] = None
+    del ids
 
     if not is_not_use_val:
-        num_test_paths:int = len(test_paths)
+        num_test_paths:int = len(test_ids)
         separate_idx:int = int(round(num_test_paths) * 0.5)
-        val_paths = test_paths[:separate_idx]
-        test_paths = test_paths[separate_idx:]
+        val_ids = test_ids[:separate_idx]
+        test_ids = test_ids[separate_idx:]
 
-    return train_paths, test_paths, val_paths
+    return train_ids, test_ids, val_ids
 
 
 @add_log_function_start_end_with_debug
-def check_valid_dataset(dataset_paths:List[Path]):
+def check_valid_dataset(index:DatasetIndex, catalog_path:Optional[str]=None) -> schema.ParsedNames:
     # 有効なデータ群か調査する
-    ## データ群のstem名が'*yyyymmdd_*_hhmmss*'等の形になっていれば有効
-    for p in dataset_paths:
-        is_cond1 = False
-        is_cond2 = False
-        words = p.stem.split("_")
-        # check date
-        word = words[-3]
-        try:
-            datetime.datetime(year=int(word[:4]), month=int(word[4:6]), day=int(word[6:]))
-            is_cond1 = True
-            continue
-        except Exception as e:
-            pass
-        # check time
-        word = words[-2]
-        try:
-            datetime.time(hour=int(word[:2]), minute=int(word[2:4]), second=int(word[4:]))
-            is_cond2 = True
-        except Exception as e:
-            pass
-
-        assert (is_cond1 and is_cond2), f"Invald data conntained. Example:{p.stem}"
+    ## データ群のファイル名が'*_yyyymmdd_hhmmss_XXXXXX.suffix'の形で、日付と時刻が存在するものなら有効
+    parsed = catalog.parse(index.root, index.names(), catalog_path)
+    assert len(parsed.report) == 0, f"Invald data conntained. {parsed.report}"
+    return parsed
 
 
 @add_log_function_start_end_with_debug
-def separate_dataset(dataset_paths:List[Path], is_not_use_val:bool, test_ratio:float=0.4)-> Tuple[List[Path], List[Path], Optional[List[Path]]]:
+def separate_dataset(
+        index:DatasetIndex,
+        is_not_use_val:bool,
+        test_ratio:float=0.4,
+        seed:Optional[int]=None,
+        tolerance:float=DEFAULT_TOLERANCE,
+        parsed:Optional[schema.ParsedNames]=None,
+)-> Tuple[array, array, Optional[array]]:
     # データ群を学習用、テスト用、検証用に分割する
     ## まずはデータ群を撮影日時の共通点でグループ化する
     ## 撮影日時グループを撮影日時に関して昇順ソートする
     ## 撮影日時グループの最も古いデータと新しいデータを抽出して学習用グループに配属させる
         ## （古いデータと新しいデータはアノテーション依頼の際に分割されるから）
     ## 撮影日時グループを画像枚数に関して昇順ソートする
-    ## 撮影日時グループを３分割する。これによりデータ数が多、中間、少のグループに分けられる。
-    ## 中間グループからランダムにデータ群を抽出してテスト用グループに配属させる。
-    ### この作業はテスト用グループが一定のデータ数(全データが3~4割程度？)になると終わるようにする
+    ## 撮影日時グループを5分割して、データ数が多いグループと少ないグループを学習用グループに配属させる。
+    ## 残りの中間グループの中からデータ数の合計が全データの ratio に最も近くなる組み合わせを
+    ## solve_group_subset で求めてテスト用グループに配属させる
     ## 学習用、テスト用に配属されなかったデータ群は学習用グループに配属させる
-    ## 検証用データへの分割が必要な場合はテスト用データを半分に分割して検証用データとする。
+    ## 検証用データへの分割が必要な場合はテスト用データを同じ方法で半分に分割して検証用データとする。
+    ## グループはグループid(整数)で扱い、最後にグループごとのラベルからファイルのindexを作る
 
     # 想定されるデータセット対象
     # *_yyyymmdd_hhmmss_XXXXXX.suffix
+    rng = random.Random(seed)
 
     # 撮影日時グループ(yyyymmdd_hhmmss)の作成
-    date_time2paths:Dict[str, List[Path]] = {}
-    for p in dataset_paths:
-        words = p.stem.split("_")
-        _date = words[-3] # yyyymmdd
-        _time = words[-2] # hhmmss
-        date_time = f"{_date}_{_time}" # yyyymmdd_hhmmss
-        if date_time not in date_time2paths.keys():
-            date_time2paths[date_time] = []
-        date_time2paths[date_time].append(p)
-    show_datasets(date_time2paths, "all")
-
-    date_time_list = list(date_time2paths.keys())
-    assert len(date_time_list) > 2, "3 > num data group that 'yyyymmdd_hhmmss' "
-
-    train_date_time_list:List[str] = []
-    logging.debug(f"num all date_time list {len(date_time_list)}")
+    if parsed is None:
+        parsed = schema.parse(index.names())
+    index.group_by(parsed.date_times())
+    keys = index.group_keys
+    sizes_of = index.group_sizes
+    group_list = list(range(len(keys)))
+    show_datasets(index, group_list, "all")
+
+    assert len(group_list) > 2, "3 > num data group that 'yyyymmdd_hhmmss' "
+    logging.debug(f"num all date_time list {len(group_list)}")
 
     # 撮影日時グループから端っこを学習用に配属
-    date_time_list.sort() # sort date_time
-    train_date_time_list.append(date_time_list.pop(0))
-    train_date_time_list.append(date_time_list.pop(-1))
+    group_list.sort(key=lambda g:keys[g]) # sort date_time
+    train_group_list:List[int] = [group_list[0], group_list[-1]]
+    group_list = group_list[1:-1]
 
     # データ数に関してソートした後、5分割して、端のデータを学習用に分類、残りをテスト候補に
-    date_time_list = sorted(date_time_list, key=lambda k:len(date_time2paths[k])) # sort num data
-    sep_num = len(date_time_list) // 5
-    train_date_time_list += date_time_list[:sep_num]
-    if sep_num > 1 :train_date_time_list += date_time_list[-sep_num:]
-    date_time_list = list(set(date_time_list) - set(train_date_time_list))
-    logging.debug(f"num middle date_time list {len(date_time_list)}")
-
-    # 指定数のテストデータをテスト候補からランダムに抽出
-    num_datasets = len(dataset_paths)
+    group_list = sorted(group_list, key=lambda g:sizes_of[g]) # sort num data
+    sep_num = len(group_list) // 5
+    train_group_list += group_list[:sep_num]
+    if sep_num > 1:
+        train_group_list += group_list[-sep_num:]
+        group_list = group_list[sep_num:-sep_num]
+    else:
+        group_list = group_list[sep_num:]
+    logging.debug(f"num middle date_time list {len(group_list)}")
+
+    # 指定数のテストデータをテスト候補から選択
+    num_datasets = len(index)
     num_required_test_datasets = int(round(num_datasets * test_ratio))
-    logging.debug(f"num datasets is {len(dataset_paths)}, and num required test datasets is {num_required_test_datasets}")
-    idxes = list(range(len(date_time_list)))
-    random.shuffle(idxes)
-    num_test_datasets = 0
-    test_date_time_list:List[str] = []
-    for idx in idxes:
-        date_time = date_time_list[idx]
-        pre_num_test_datasets = num_test_datasets
-        num_test_datasets += len(date_time2paths[date_time])
-        if num_test_datasets > num_required_test_datasets:
-            num_test_datasets = pre_num_test_datasets
-            continue
-        test_date_time_list.append(date_time)
-    logging.debug(f"num test date time list {len(test_date_time_list)}")
+    logging.debug(f"num datasets is {num_datasets}, and num required test datasets is {num_required_test_datasets}")
+    sizes = [sizes_of[g] for g in group_list]
+    is_test = solve_group_subset(sizes, num_required_test_datasets, rng)
+    test_group_list = [g for g, flag in zip(group_list, is_test) if flag]
+    check_achieved(sum(s for s, flag in zip(sizes, is_test) if flag), num_required_test_datasets, num_datasets, tolerance, "test")
+    logging.debug(f"num test date time list {len(test_group_list)}")
 
     # 余りを学習用に配属
-    date_time_list = list(set(date_time_list) - set(test_date_time_list))
-    train_date_time_list += date_time_list
-    train_date_time2paths = {k:date_time2paths[k] for k in train_date_time_list}
-    test_date_time2paths = {k:date_time2paths[k] for k in test_date_time_list}
+    train_group_list += [g for g, flag in zip(group_list, is_test) if not flag]
+    show_datasets(index, train_group_list, "trains")
 
-    show_datasets(train_date_time2paths, "trains")
-    train_paths = [ p for paths in train_date_time2paths.values() for p in paths ]
+    # グループid -> 0:学習用, 1:テスト用, 2:検証用
+    group_labels = array("B", [0] * len(keys))
+    for g in test_group_list:
+        group_labels[g] = 1
 
     if is_not_use_val:
-        show_datasets(test_date_time2paths, "tests")
-        test_paths = [ p for paths in test_date_time2paths.values() for p in paths ]
-        return train_paths, test_paths, None
-
-    test_date_time_list = list(test_date_time2paths.keys())
-    if len(test_date_time_list) < 2:
-        show_datasets(test_date_time2paths, "tests")
-        test_paths = [ p for paths in test_date_time2paths.values() for p in paths ]
+        show_datasets(index, test_group_list, "tests")
+        train_ids, test_ids = index.file_ids(group_labels, 2)
+        return train_ids, test_ids, None
+
+    if len(test_group_list) < 2:
+        show_datasets(index, test_group_list, "tests")
+        train_ids, test_ids = index.file_ids(group_labels, 2)
         print("Don't Separate for val datasets, Because test data datetime is 1")
-        return train_paths, test_paths, None
+        return train_ids, test_ids, None
 
     # val用の確保(テスト用を二分割する)
-    test_date_time_list = sorted(test_date_time_list, key=lambda k:len(test_date_time2paths[k])) # sort num data
-    idxes = list(range(len(test_date_time_list)))
-    random.shuffle(idxes)
-    num_test_datasets = sum(map(lambda v:len(v), test_date_time2paths.values()))
+    sizes = [sizes_of[g] for g in test_group_list]
+    num_test_datasets = sum(sizes)
     num_required_val_datasets = int(round(num_test_datasets * 0.5))
-    num_val_datasets = 0
-    val_date_time_list:List[str] = []
-    for idx in idxes:
-        date_time = test_date_time_list[idx]
-        pre_num_val_datasets = num_val_datasets
-        num_val_datasets += len(test_date_time2paths[date_time])
-        if num_val_datasets > num_required_val_datasets: # valデータの数がtestデータの数より少なくなるようにする。
-            num_val_datasets = pre_num_val_datasets
-            continue
-        val_date_time_list.append(date_time)
-    val_date_time2paths = {k:test_date_time2paths.pop(k) for k in val_date_time_list}
+    is_val = solve_group_subset(sizes, num_required_val_datasets, rng)
+    val_group_list = [g for g, flag in zip(test_group_list, is_val) if flag]
+    check_achieved(sum(s for s, flag in zip(sizes, is_val) if flag), num_required_val_datasets, num_datasets, tolerance, "val")
+    test_group_list = [g for g, flag in zip(test_group_list, is_val) if not flag]
+    for g in val_group_list:
+        group_labels[g] = 2
+
+    show_datasets(index, test_group_list, "tests")
+    show_datasets(index, val_group_list, "vals")
 
-    show_datasets(test_date_time2paths, "tests")
-    show_datasets(val_date_time2paths, "vals")
+    return index.file_ids(group_labels, 3)
 
-    test_paths = [ p for paths in test_date_time2paths.values() for p in paths ]
-    val_paths = [ p for paths in val_date_time2paths.values() for p in paths ]
 
-    return train_paths, test_paths, val_paths
+def solve_group_subset(sizes:List[int], target:int, rng:random.Random, max_swaps:int=MAX_SWAPS) -> List[bool]:
+    """ 合計がtargetを超えない範囲でtargetに最も近くなるグループの組み合わせを求める(subset-sum).
+
+    1. シャッフルした順に入るグループを全て入れる (first-fit. この時点で残りのどのグループも入らない)
+    2. 選択済みのグループaと未選択のグループbの交換で合計が増えるものがあれば交換する.
+       未選択グループのサイズをソートしておき二分探索で最良のbを探すので1回あたりO(n log n)
+    3. それでもtargetに届かない場合は solve_sizes_exact で最適な組み合わせを求め直す
+
+    Args:
+        sizes (List[int]): 各グループのデータ数
+        target (int): 目標のデータ数
+        rng (random.Random): 乱数生成器. seedを固定すれば結果は決定的
+        max_swaps (int): 交換回数の上限
+
+    Returns:
+        List[bool]: 各グループを選択したか
+    """
+    num_groups = len(sizes)
+    order = list(range(num_groups))
+    rng.shuffle(order)
+
+    chosen = [False] * num_groups
+    remain = target
+    for i in order:
+        if sizes[i] <= remain:
+            chosen[i] = True
+            remain -= sizes[i]
+
+    for _ in range(max_swaps):
+        if remain == 0:
+            break
+        unchosen = sorted((sizes[i], i) for i in range(num_groups) if not chosen[i])
+        unchosen_sizes = [s for s, _ in unchosen]
+        best_gain, best_pair = 0, None
+        for i in order:
+            if not chosen[i]:
+                continue
+            # sizes[i] < sizes[j] <= sizes[i] + remain の最大のjを探す
+            k = bisect.bisect_right(unchosen_sizes, sizes[i] + remain) - 1
+            if k < 0 or unchosen_sizes[k] <= sizes[i]:
+                continue
+            gain = unchosen_sizes[k] - sizes[i]
+            if gain > best_gain:
+                best_gain, best_pair = gain, (i, unchosen[k][1])
+                if gain == remain:
+                    break
+        if best_pair is None:
+            break
+        i, j = best_pair
+        chosen[i], chosen[j] = False, True
+        remain -= best_gain
+
+    if remain == 0:
+        return chosen
+
+    # 交換で届かない場合: グループのサイズごとに選ぶ数を厳密に求め、同じサイズの中からはシャッフルした順に選ぶ
+    size2num = solve_sizes_exact(sizes, target)
+    chosen = [False] * num_groups
+    for i in order:
+        if size2num.get(sizes[i], 0) > 0:
+            chosen[i] = True
+            size2num[sizes[i]] -= 1
+    return chosen
+
+
+def solve_sizes_exact(sizes:Sequence[int], target:int) -> Dict[int, int]:
+    """ 合計がtarget以下で最大になる組み合わせを、サイズ -> 選ぶ数 で返す(厳密解).
+
+    グループのサイズの種類は少ない(種類数は sqrt(2*全データ数) 以下)ので、サイズごとの個数を
+    1, 2, 4, ... 個のまとまりに分けた有界ナップサックとして解く. 到達できる合計をint(ビット集合)で持ち、
+    まとまりごとに shift と or で更新する. 復元用のビット集合は sqrt(まとまり数) 個おきにだけ保持し、
+    復元時に区間ごとに計算し直す(メモリを抑えるため).
+    """
+    size2count: Dict[int, int] = {}
+    for size in sizes:
+        size2count[size] = size2count.get(size, 0) + 1
+    items: List[Tuple[int, int]] = [] # (サイズ, 個数)
+    for size, count in sorted(size2count.items()):
+        part = 1
+        while count > 0:
+            n = min(part, count)
+            items.append((size, n))
+            count -= n
+            part *= 2
+
+    mask = (1 << (target + 1)) - 1
+    step = max(1, math.isqrt(len(items)))
+    checkpoints: List[int] = []
+    reachable = 1
+    for k, (size, n) in enumerate(items):
+        if k % step == 0:
+            checkpoints.append(reachable)
+        reachable = (reachable | (reachable << (size * n))) & mask
+
+    # 後ろのまとまりから、それを使わずに合計remainに到達できなければ使う
+    size2num: Dict[int, int] = {}
+    remain = reachable.bit_length() - 1
+    for c in reversed(range(len(checkpoints))):
+        start = c * step
+        end = min(start + step, len(items))
+        befores = [checkpoints[c]]
+        for size, n in items[start:end - 1]:
+            befores.append((befores[-1] | (befores[-1] << (size * n))) & mask)
+        for k in reversed(range(start, end)):
+            if (befores[k - start] >> remain) & 1:
+                continue
+            size, n = items[k]
+            size2num[size] = size2num.get(size, 0) + n
+            remain -= size * n
+    assert remain == 0
+    return size2num
+
+
+def check_achieved(num:int, num_required:int, num_all:int, tolerance:float, _type:str):
+    error = abs(num - num_required) / num_all
+    logging.info(f"{_type}: required {num_required}, achieved {num} (error {error:.2%})")
+    if error > tolerance:
+        logging.warning(f"{_type}: error {error:.2%} exceeds tolerance {tolerance:.2%}. group sizes are too coarse for the ratio.")
 
 
 @add_log_function_start_end_with_debug
-def show_datasets(date_time2paths:Dict[str, List[Path]], _type:str):
+def show_datasets(index:DatasetIndex, group_list:List[int], _type:str):
     """ show detail datasets
 
     Parameters
     ----------
-    date_time2paths : Dict[str, List[Path]]
-        _description_
+    index : DatasetIndex
+        データ群の表
+    group_list : List[int]
+        表示する撮影日時グループのid
     _type : str
-        _description_
+        表示名
 
     Visualize:
     >>> --- tests --------------------
@@ -296,31 +493,47 @@ def show_datasets(date_time2paths:Dict[str, List[Path]], _type:str):
     >>> num data is 500
     >>> ------------------------------
     """
-    date_times = [k for k in date_time2paths.keys()]
-    date_times = sorted(date_times, key=lambda k:len(date_time2paths[k]), reverse=True) # desc order
+    sizes = index.group_sizes
+    group_list = sorted(group_list, key=lambda g:sizes[g], reverse=True) # desc order
 
     print(f"{'-'*3} {_type} {'-'*20}")
     print(f"{'nums':5} | date_time")
     num_all_paths = 0
-    for date_time in date_times:
-        num_paths = len(date_time2paths[date_time])
-        print(f"{num_paths:>5} | {date_time}")
+    for g in group_list:
+        num_paths = sizes[g]
+        print(f"{num_paths:>5} | {index.group_keys[g]}")
         num_all_paths += num_paths
     print(f"num data is {num_all_paths}")
     print(f"{'-'*30}")
 
 
-def copy_paths(paths:List[Path], out_dir:str, _type:str):
-    assert _type in ["trains", "tests", "vals"]
+def copy_paths(
+        index:DatasetIndex,
+        ids:Sequence[int],
+        out_dir:str,
+        _type:str,
+        shard_spec:Optional[shard.Spec]=None,
+) -> Tuple[List[Tuple[Path, Iterable[str]]], Optional[Dict[str, List[str]]]]:
+    """ out_dir/_type へのコピー先 (出力ディレクトリ, ファイル名) のリストを返す(plan.Executor.copy_namesに渡す).
+    shard_specを指定しない場合、ファイル名はidsから順に作るジェネレータ.
+    shard_specを指定した場合は out_dir/_type/サブディレクトリ に分け、サブディレクトリ名 -> ファイル名のリスト も返す
+    """
+    assert _type in SPLITS
 
     _out_dir = Path(out_dir).joinpath(_type)
-    _out_dir.mkdir(exist_ok=True)
-    logging.info(f"mkdir {_out_dir}")
+    if shard_spec is None:
+        logging.info(f"plan {len(ids)} files -> {_out_dir}")
+        return [(_out_dir, index.names(ids))], None
+
+    group_keys = None
+    if shard_spec.kind == "group":
+        group_keys = (index.group_keys[index.group_ids[i]] for i in ids)
+    shard2names = shard.shard_names(shard_spec, index.names(ids), group_keys)
+    logging.info(f"plan {len(ids)} files -> {_out_dir}/ ({len(shard2names)} shards)")
+    targets: List[Tuple[Path, Iterable[str]]] = [(_out_dir, [])]
+    targets += [(_out_dir.joinpath(shard_name), shard2names[shard_name]) for shard_name in sorted(shard2names)]
+    return targets, shard2names
 
-    for pi, path in enumerate(paths, start=1):
-        print(f"\r{pi:>4}:{path.name} -> {_out_dir}", end="")
-        shutil.copy(path, _out_dir)
-    print("")
 
 if __name__ == "__main__":
     parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
@@ -0,0 +1,115 @@
+""" 分割結果(trains/tests/vals)の出力先をサブディレクトリに分ける(シャーディング)
+1つのディレクトリに数十万ファイルを置くとNFS等で検索やlsが遅くなるので、決まった規則のサブディレクトリに振り分け、
+元のファイル名から出力先への対応(manifest)を書き出す. 読む側はディレクトリを一覧せずにmanifestから場所を引ける.
+
+- hash    : 拡張子を除いた名前のcrc32で HASH_FANOUT 個('00'~'ff')に分ける. 同じstemの画像とアノテーションは同じ場所になる
+- group   : 撮影日時グループ(yyyymmdd_hhmmss)ごとに分ける. 名前が '*_yyyymmdd_hhmmss_NNNNN' でないものは '00000000_000000'
+- count:N : 名前順にN個ずつ '00000', '00001', ... に分ける
+"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import zlib
+
+
+KINDS = ["hash", "group", "count"]
+HASH_FANOUT = 256
+MANIFEST_NAME = "shard_manifest.json"
+
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("--shard_by", type=str, default=None, metavar="{hash,group,count:N}",
+                        help=f"分割結果を各ディレクトリの下のサブディレクトリに分けて保存し、{MANIFEST_NAME} に元の名前から保存先への対応を書き出す. "
+                        f"hash: 名前のハッシュで{HASH_FANOUT}個に分ける, group: 撮影日時グループごと, count:N: 名前順にN個ずつ. "
+                        "default is None(分けない)")
+
+
+class Spec(NamedTuple):
+    kind: str
+    count: int = 0
+
+
+def parse_spec(text: str) -> Spec:
+    """ 'hash', 'group', 'count:N'
+    """
+    kind, _, count = text.partition(":")
+    assert kind in KINDS, f"--shard_by must be one of hash, group, count:N. got '{text}'"
+    if kind != "count":
+        assert count == "", f"--shard_by {kind} takes no number. got '{text}'"
+        return Spec(kind)
+    assert count.isdigit() and int(count) > 0, f"--shard_by count:N needs a positive N. got '{text}'"
+    return Spec(kind, int(count))
+
+
+def hash_shard(name: str) -> str:
+    stem = os.path.splitext(name)[0]
+    return f"{zlib.crc32(stem.encode('utf-8', 'surrogateescape')) % HASH_FANOUT:02x}"
+
+
+def shard_names(spec: Spec, names: Iterable[str], group_keys: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """ 名前をサブディレクトリ名ごとにまとめる. 各サブディレクトリの名前はnamesの順
+
+    Args:
+        spec (Spec): 分け方
+        names (Iterable[str]): ファイル名
+        group_keys (Optional[Iterable[str]]): namesと同じ順の撮影日時グループ. spec.kind == 'group' の場合に必要
+    """
+    shard2names: Dict[str, List[str]] = {}
+    if spec.kind == "hash":
+        for name in names:
+            shard = hash_shard(name)
+            if shard not in shard2names:
+                shard2names[shard] = []
+            shard2names[shard].append(name)
+    elif spec.kind == "group":
+        assert group_keys is not None, "group keys are required for --shard_by group"
+        for name, key in zip(names, group_keys):
+            if key not in shard2names:
+                shard2names[key] = []
+            shard2names[key].append(name)
+    else: # spec.kind == "count"
+        for i, name in enumerate(sorted(names)): # ランダム分割ではnamesが名前順でないので並べ直す
+            shard = f"{i // spec.count:05}"
+            if shard not in shard2names:
+                shard2names[shard] = []
+            shard2names[shard].append(name)
+    return shard2names
+
+
+def manifest_items(split2shards: Dict[str, Dict[str, List[str]]]) -> Iterator[Tuple[str, str]]:
+    """ (元のファイル名, 出力ディレクトリからの相対パス) を分割、サブディレクトリ、名前の順に返す
+    """
+    for split, shard2names in split2shards.items():
+        for shard in sorted(shard2names):
+            prefix = f"{split}/{shard}/"
+            for name in shard2names[shard]:
+                yield name, prefix + name
+
+
+def write_manifest(out_dir: Path, split2shards: Dict[str, Dict[str, List[str]]], spec: Spec) -> Path:
+    """ out_dir/MANIFEST_NAME に {"shard_by": ..., "files": {元の名前: 'trains/xx/元の名前', ...}} を書き出す.
+    ファイル数が多くてもdictを作らないように1行ずつ書く(json.dumps(indent=2)と同じ書式)
+    """
+    manifest_file = out_dir.joinpath(MANIFEST_NAME)
+    tmp_file = manifest_file.with_name(f".{manifest_file.name}.tmp")
+    shard_by = spec.kind if spec.kind != "count" else f"count:{spec.count}"
+    with tmp_file.open("w") as f:
+        f.write(f'{{\n  "shard_by": {json.dumps(shard_by)},\n  "files": ')
+        sep = "{\n"
+        for name, rel_path in manifest_items(split2shards):
+            f.write(f"{sep}    {json.dumps(name)}: {json.dumps(rel_path)}")
+            sep = ",\n"
+        f.write("{}" if sep == "{\n" else "\n  }")
+        f.write("\n}")
+    os.replace(tmp_file, manifest_file)
+    return manifest_file
+
+
+def load_manifest(out_dir: Path) -> Dict[str, str]:
+    """ 元のファイル名 -> 出力ディレクトリからの相対パス
+    """
+    with out_dir.joinpath(MANIFEST_NAME).open("r") as f:
+        return json.load(f)["files"]
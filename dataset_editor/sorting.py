@@ -0,0 +1,163 @@
+""" ファイル名の並べ替え
+'00001.jpg' や 'prefix_00001.jpg' のように数字の並びが1つだけのASCIIの名前は、自然順のキーを正規表現1回で作る
+(natsortと同じキー). それ以外の名前だけnatsortのキーを使う(natsortはASCII以外をNFDに正規化してから比べるため).
+並べる名前がメモリの上限を超える場合は、上限ごとに並べた塊を一時ファイルに書き出してから併合する(外部マージソート).
+"""
+from __future__ import annotations
+from argparse import ArgumentParser
+import heapq
+import os
+import re
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+
+DEFAULT_MEMORY_MB = 512
+# 1件あたりのメモリの見積もり[byte]. 名前の長さに加える (str, リストの要素, 自然順のキー)
+ENTRY_OVERHEAD = 200
+READ_SIZE = 1024 * 1024
+SEP = b"\0" # ファイル名に含まれない区切り
+
+# 数字の並びが1つだけ(またはない)名前. ASCIIの名前に限って使う
+REGULAR_PATTERN = re.compile(r"([^0-9]*)([0-9]+)([^0-9]*)|[^0-9]*")
+# 改行で繋いだ名前のうち数字の並びが1つだけの行
+SERIAL_PATTERN = re.compile(r"^([^0-9\n]*)([0-9]+)([^0-9\n]*)$", re.MULTILINE)
+
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("--sort_memory_mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help=f"並べ替えに使うメモリの上限[MB]. 超えた分は一時ファイル(TMPDIR)で並べる. default is {DEFAULT_MEMORY_MB}")
+
+
+_natsort_key: Optional[Callable[[str], Any]] = None
+
+
+def natural_key(name: str) -> tuple:
+    """ natsort.natsort_keygen()(name) と同じキー
+    """
+    m = REGULAR_PATTERN.fullmatch(name) if name.isascii() else None
+    if m is None:
+        return _irregular_key(name)
+    prefix, num, suffix = m.groups()
+    if num is None:
+        return (name,) if name != "" else ()
+    return (prefix, int(num), suffix) if suffix != "" else (prefix, int(num))
+
+
+def _irregular_key(name: str) -> tuple:
+    global _natsort_key
+    if _natsort_key is None:
+        from natsort import natsort_keygen
+        _natsort_key = natsort_keygen()
+    return _natsort_key(name)
+
+
+def natural_sorted(names: List[str], reverse: bool = False) -> List[str]:
+    """ natsort.natsorted(names) と同じ結果.
+    全ての名前が同じ接頭辞と接尾辞の連番の場合は、改行で繋いだ名前から1回の正規表現で番号を取り出し整数だけで並べる
+    """
+    if len(names) > 0:
+        joined = "\n".join(names)
+        if joined.isascii() and joined.count("\n") == len(names) - 1: # 名前に改行を含まない
+            found = SERIAL_PATTERN.findall(joined)
+            if len(found) == len(names) and len({(prefix, suffix) for prefix, _, suffix in found}) == 1:
+                nums = [int(num) for _, num, _ in found]
+                order = sorted(range(len(names)), key=nums.__getitem__, reverse=reverse)
+                return [names[i] for i in order]
+    return sorted(names, key=natural_key, reverse=reverse)
+
+
+class ExternalSort:
+    """ 名前を追加していき、並べた順に取り出す. 見積もりがmemory_mbを超えるたびに並べた塊を一時ファイルに書き出し、
+    取り出す時に塊を併合する. メモリに載る場合は一時ファイルを作らない.
+
+    Args:
+        natural (bool): 自然順にするか. Falseなら文字列順(list.sortと同じ)
+        memory_mb (int): メモリの上限[MB]
+        tmp_dir (Optional[str]): 一時ファイルの場所. default is tempfileの既定(TMPDIR)
+    """
+    def __init__(self, natural: bool = False, memory_mb: int = DEFAULT_MEMORY_MB, tmp_dir: Optional[str] = None):
+        assert memory_mb > 0, f"memory_mb must be positive. got {memory_mb}"
+        self._key: Optional[Callable[[str], Any]] = natural_key if natural else None
+        self._limit: int = memory_mb * 1024 * 1024
+        self._tmp_dir: Optional[str] = tmp_dir
+        self._tmp = None # tempfile.TemporaryDirectory. 書き出すまで作らない
+        self._chunk: List[str] = []
+        self._chunk_bytes: int = 0
+        self._runs: List[str] = []
+        self._num: int = 0
+
+
+    def __len__(self) -> int:
+        return self._num
+
+
+    def add(self, name: str):
+        self._chunk.append(name)
+        self._chunk_bytes += len(name) + ENTRY_OVERHEAD
+        self._num += 1
+        if self._chunk_bytes >= self._limit:
+            self._spill()
+
+
+    def extend(self, names: Iterable[str]) -> ExternalSort:
+        for name in names:
+            self.add(name)
+        return self
+
+
+    def _sort_chunk(self):
+        if self._key is natural_key:
+            self._chunk = natural_sorted(self._chunk)
+        else:
+            self._chunk.sort(key=self._key)
+
+
+    def _spill(self):
+        if self._tmp is None:
+            import tempfile # 書き出す場合だけ読み込む(起動時間)
+            self._tmp = tempfile.TemporaryDirectory(prefix="dataset_editor_sort_", dir=self._tmp_dir)
+        self._sort_chunk()
+        path = os.path.join(self._tmp.name, f"run_{len(self._runs):05}")
+        with open(path, "wb") as f:
+            for name in self._chunk:
+                f.write(os.fsencode(name) + SEP)
+        self._runs.append(path)
+        self._chunk = []
+        self._chunk_bytes = 0
+
+
+    def __iter__(self) -> Iterator[str]:
+        """ 並べた順に返す. 1回だけ取り出せる. 最後まで取り出すか途中で閉じると一時ファイルを消す
+        """
+        try:
+            if len(self._runs) == 0:
+                self._sort_chunk()
+                chunk, self._chunk = self._chunk, []
+                yield from chunk
+                return
+            if len(self._chunk) > 0:
+                self._spill()
+            yield from heapq.merge(*[_read_run(path) for path in self._runs], key=self._key)
+        finally:
+            self.close()
+
+
+    def close(self):
+        self._chunk = []
+        self._runs = []
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+
+def _read_run(path: str) -> Iterator[str]:
+    with open(path, "rb") as f:
+        rest = b""
+        while True:
+            buf = f.read(READ_SIZE)
+            if len(buf) == 0:
+                break
+            items = (rest + buf).split(SEP)
+            rest = items.pop()
+            for item in items:
+                yield os.fsdecode(item)
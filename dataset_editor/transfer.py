@@ -0,0 +1,370 @@
+""" 各サブコマンドで共有するファイル転送エンジン
+"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import errno
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from dataset_editor import metrics
+
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_INFLIGHT_MB = 256
+NUM_SHOW_ERRORS = 10
+LINK_MODES = ["copy", "hardlink", "reflink", "symlink", "auto"]
+FICLONE = 0x40049409 # linux/fs.h
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def add_arguments(parser: ArgumentParser) -> ArgumentParser:
+    group = parser.add_argument_group("transfer")
+    group.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                       help=f"並列転送のワーカー数. default is {DEFAULT_WORKERS}")
+    group.add_argument("--max_inflight_mb", type=int, default=DEFAULT_MAX_INFLIGHT_MB,
+                       help=f"同時に転送中とするデータ量の上限[MB]. default is {DEFAULT_MAX_INFLIGHT_MB}")
+    return parser
+
+
+def add_link_arguments(parser: ArgumentParser) -> ArgumentParser:
+    parser.add_argument("--link", type=str, choices=LINK_MODES, default="copy",
+                        help="materialization mode. default is 'copy'. "
+                        "'auto' tries reflink, then hardlink on the same device, then copy.")
+    return parser
+
+
+class Job(NamedTuple):
+    """ 転送単位. dstはディレクトリではなく保存先のファイルパス
+    """
+    src: Path
+    dst: Path
+
+
+class TransferError(Exception):
+    pass
+
+
+class Result:
+    def __init__(self):
+        self.num_done: int = 0
+        self.num_bytes: int = 0
+        self.errors: List[Tuple[Job, BaseException]] = []
+
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+
+    def check(self) -> Result:
+        """ 失敗したファイルがあれば一覧を表示してTransferErrorを送出する
+        """
+        if self.ok:
+            return self
+        print(f"[Error] failed {len(self.errors)} files")
+        for job, e in self.errors[:NUM_SHOW_ERRORS]:
+            print(f"\t{job.src} -> {job.dst} : {e!r}")
+        if len(self.errors) > NUM_SHOW_ERRORS:
+            print(f"\t... and {len(self.errors) - NUM_SHOW_ERRORS} more")
+        raise TransferError(f"failed {len(self.errors)} / {self.num_done + len(self.errors)} files")
+
+
+# カーネル内コピー(copy_file_range -> sendfile)が使えない場合のerrno. この場合はユーザ空間でコピーする
+_ZERO_COPY_UNSUPPORTED = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP)
+
+
+def copy(src: Path, dst: Path):
+    """ データだけをコピーする(パーミッション等はコピーしない).
+    カーネル内でコピーし(copy_file_range, 無ければsendfile)、使えない場合はユーザ空間でコピーする.
+    コピー先は事前にposix_fallocateで確保し、コピー元にはposix_fadviseで順次読み込みを伝える.
+    dstと同じディレクトリの一時ファイルに書いてからos.replaceで置き換えるので、既存のdstがコピー元へのsymlinkや
+    hardlinkでもコピー元を切り詰めない(置き換わるのはdstのエントリだけ)
+    """
+    dst_dir, dst_name = os.path.split(os.fspath(dst))
+    tmp = os.path.join(dst_dir, f".{dst_name}.tmp")
+    try:
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            infd = fsrc.fileno()
+            outfd = fdst.fileno()
+            size = os.fstat(infd).st_size
+            _advise(infd)
+            _preallocate(outfd, size)
+            num_copied = _zero_copy(infd, outfd, size)
+            if num_copied is None:
+                fdst.seek(0)
+                shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+                num_copied = fdst.tell()
+            if num_copied < size: # コピー中にコピー元が縮んだ場合は確保した分を切り詰める
+                fdst.truncate(num_copied)
+        os.replace(tmp, dst)
+    except BaseException:
+        _remove_if_exists(tmp)
+        raise
+
+
+def copy2(src: Path, dst: Path):
+    """ copyに加えて更新日時等もコピーする(shutil.copy2相当)
+    """
+    copy(src, dst)
+    shutil.copystat(src, dst)
+
+
+def _advise(fd: int):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+
+
+def _preallocate(fd: int, size: int):
+    if size == 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError: # 非対応のファイルシステム等. 確保しなくてもコピーはできる
+        pass
+
+
+def _zero_copy(infd: int, outfd: int, size: int) -> Optional[int]:
+    """ コピーしたバイト数を返す. 1バイトもコピーしないうちに非対応と分かった場合はNone
+    """
+    for name in ["copy_file_range", "sendfile"]:
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        num_copied = 0
+        try:
+            while num_copied < size:
+                if name == "copy_file_range":
+                    n = func(infd, outfd, COPY_CHUNK_SIZE)
+                else:
+                    n = func(outfd, infd, num_copied, COPY_CHUNK_SIZE)
+                if n == 0:
+                    break
+                num_copied += n
+        except OSError as e:
+            if num_copied > 0 or e.errno not in _ZERO_COPY_UNSUPPORTED:
+                raise
+            continue
+        return num_copied
+    return None
+
+
+def _remove_if_exists(dst: Path):
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+
+
+def hardlink(src: Path, dst: Path):
+    _remove_if_exists(dst)
+    os.link(src, dst)
+
+
+def symlink(src: Path, dst: Path):
+    _remove_if_exists(dst)
+    os.symlink(os.path.abspath(src), dst)
+
+
+def reflink(src: Path, dst: Path):
+    """ FICLONEでデータブロックを共有したコピーを作る(btrfs, xfs等). 非対応ならOSError.
+    既存のdstは先に消す(前回のhardlink等をopen(dst, "wb")で開くとコピー元ごと切り詰めてしまうため)
+    """
+    import fcntl
+
+    _remove_if_exists(dst)
+    with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            _remove_if_exists(dst)
+            raise
+    shutil.copymode(src, dst)
+
+
+_REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS)
+
+
+class AutoLink:
+    """ reflink -> (同一デバイスなら)hardlink -> copy の順に試す.
+    デバイスの組み合わせごとに成功した方法を覚えておき、以降は失敗する方法を試さない.
+    """
+    def __init__(self):
+        self._dev2op: Dict[Tuple[int, int], Callable[[Path, Path], Any]] = {}
+        self._lock = threading.Lock()
+
+
+    def __call__(self, src: Path, dst: Path):
+        src_dev = os.stat(src).st_dev
+        dst_dev = os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+        key = (src_dev, dst_dev)
+        op = self._dev2op.get(key)
+        if op is not None:
+            return op(src, dst)
+
+        candidates: List[Callable[[Path, Path], Any]] = [reflink]
+        if src_dev == dst_dev:
+            candidates.append(hardlink)
+        for candidate in candidates:
+            try:
+                candidate(src, dst)
+            except OSError as e:
+                if e.errno not in _REFLINK_UNSUPPORTED + (errno.EPERM, errno.EMLINK):
+                    raise
+                continue
+            with self._lock:
+                self._dev2op[key] = candidate
+            return
+        with self._lock:
+            self._dev2op[key] = copy
+        copy(src, dst)
+
+
+def link_op(link: str) -> Callable[[Path, Path], Any]:
+    assert link in LINK_MODES, f"unknown link mode '{link}'"
+    if link == "auto":
+        return AutoLink()
+    return {"copy": copy, "hardlink": hardlink, "reflink": reflink, "symlink": symlink}[link]
+
+
+class _ByteBudget:
+    """ 転送中のバイト数を上限以下に抑える.
+    転送中が0の場合は上限を超えるファイルでも通す(巨大ファイルで止まらないように)
+    """
+    def __init__(self, limit: int):
+        self._limit: int = limit
+        self._inflight: int = 0
+        self._cond = threading.Condition()
+
+
+    def acquire(self, num_bytes: int):
+        with self._cond:
+            while self._inflight > 0 and self._inflight + num_bytes > self._limit:
+                self._cond.wait()
+            self._inflight += num_bytes
+
+
+    def release(self, num_bytes: int):
+        with self._cond:
+            self._inflight -= num_bytes
+            self._cond.notify_all()
+
+
+class Engine:
+    """ ワーカープールでJobを並列に処理する.
+
+    Args:
+        workers (int): ワーカー数
+        max_inflight_mb (int): 同時に転送中とするデータ量の上限[MB]
+        op (Callable[[Path, Path], Any]): 1ファイルの転送処理. default is copy
+        desc (str): 進捗表示のラベル
+    """
+    def __init__(
+            self,
+            workers: int = DEFAULT_WORKERS,
+            max_inflight_mb: int = DEFAULT_MAX_INFLIGHT_MB,
+            op: Callable[[Path, Path], Any] = copy,
+            desc: str = "copy",
+    ):
+        assert workers > 0, f"workers must be positive. got {workers}"
+        assert max_inflight_mb > 0, f"max_inflight_mb must be positive. got {max_inflight_mb}"
+        self.workers: int = workers
+        self.op: Callable[[Path, Path], Any] = op
+        self.desc: str = desc
+        self._budget = _ByteBudget(max_inflight_mb * 1024 * 1024)
+
+
+    @classmethod
+    def from_kwargs(cls, kwargs: Dict[str, Any], **overrides) -> Engine:
+        link = kwargs.get("link", "copy")
+        options = {
+            "workers": kwargs.get("workers", DEFAULT_WORKERS),
+            "max_inflight_mb": kwargs.get("max_inflight_mb", DEFAULT_MAX_INFLIGHT_MB),
+            "op": link_op(link),
+            "desc": link,
+        }
+        options.update(overrides)
+        return cls(**options)
+
+
+    def run(
+            self,
+            jobs: Iterable[Job],
+            on_done: Optional[Callable[[Job], Any]] = None,
+            total: Optional[int] = None,
+            op: Optional[Callable[[Path, Path], Any]] = None,
+            sized: bool = True,
+            desc: Optional[str] = None,
+    ) -> Result:
+        """ Jobを全て処理して結果を返す. 個々の失敗は例外にせずResult.errorsに集める.
+        on_doneは成功したJobごとに呼び出し側のスレッドで呼ばれる.
+        jobsにはジェネレータも渡せる(その場合の進捗の総数はtotal).
+        op, descを指定するとこの呼び出しに限りEngineの設定を上書きする.
+        sized=Falseの場合はsrcをstatしない(srcがsymlinkのリンク先文字列の場合やmove等).
+        """
+        import tqdm
+
+        result = Result()
+        recorder = metrics.current()
+        if total is None and hasattr(jobs, "__len__"):
+            total = len(jobs)
+        max_pending = self.workers * 4
+        if op is None:
+            op = self.op
+        if desc is None:
+            desc = self.desc
+
+        with metrics.phase("transfer"), ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                tqdm.tqdm(total=total, desc=desc, unit="file", mininterval=metrics.PROGRESS_INTERVAL) as pbar:
+            pending: Dict[Future, Job] = {}
+
+            def collect(done: Set[Future]):
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        num_bytes, seconds = future.result()
+                    except Exception as e:
+                        result.errors.append((job, e))
+                        recorder.record_error()
+                    else:
+                        result.num_bytes += num_bytes
+                        recorder.record(seconds, num_bytes)
+                        result.num_done += 1
+                        if on_done is not None:
+                            on_done(job)
+                    pbar.update(1)
+
+            for job in jobs:
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending[executor.submit(self._transfer, job, op, sized)] = job
+            while len(pending) > 0:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        return result
+
+
+    def _transfer(self, job: Job, op: Callable[[Path, Path], Any], sized: bool) -> Tuple[int, float]:
+        """ 転送したバイト数と転送にかかった時間[s]を返す
+        """
+        num_bytes = os.stat(job.src).st_size if sized else 0
+        self._budget.acquire(num_bytes)
+        try:
+            start = time.perf_counter()
+            op(job.src, job.dst)
+            seconds = time.perf_counter() - start
+        finally:
+            self._budget.release(num_bytes)
+        return num_bytes, seconds
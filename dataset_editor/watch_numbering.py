@@ -0,0 +1,369 @@
+""" 画像が書き込まれ続けるディレクトリを監視し、新しく届いた画像だけをナンバリングしてデータセットのグループにリンクする
+"""
+from __future__ import annotations
+DESCRIPTION=__doc__
+EPILOG='''
+<詳細>-------------------------------------
+numbering と mkdir を新しく届いたファイルについてだけ行う。
+起動時に out_dir の numbering2org.journal (無ければ numbering2org.json) を読み、処理済みのファイルと最後の番号を求める。
+まだ番号の無いファイルを名前順に処理した後、img_dir を監視して届いたファイルを処理する。
+・番号は最後の番号の続きから振り、journal と numbering2org.json に追記する。
+・番号を振ったファイルは mkdir と同じく '[output]/datasets/dataset_xxxxx_XXXXX/imgs_xxxxx_XXXXX' にリンクする。
+  (番号1から devide_number 個ごとのグループ)
+Linux では inotify で書き込みの完了(close_write, moved_to)を待つ。使えない場合か --poll の場合は
+--interval 秒ごとにディレクトリの更新日時を調べ、変わっていれば走査する。
+  --poll では書き込みの完了が分からないので、大きさと更新日時が --interval 秒の間変わらなかったファイルを
+  書き終わったとみなす。書き込みが --interval 秒以上止まる場合は、一時的な名前('.'始まりか画像以外の拡張子)で
+  書いてから名前を変えること。
+Ctrl+C (または SIGTERM) で終了する。
+'''
+
+import ctypes
+import json
+import os
+from argparse import ArgumentParser, RawTextHelpFormatter
+from pathlib import Path
+import select
+import signal
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from dataset_editor import numbering_filename as numbering
+from dataset_editor import plan, scan, transfer
+from dataset_editor import separate_dataset_and_mkdir as mkdir
+
+
+DEFAULT_DEVIDE_NUMBER = 500
+DEFAULT_INTERVAL = 2.0
+DEFAULT_SETTLE = 1.0
+# linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+MAX_BATCH = 10000 # 1回にまとめて処理する最大のファイル数
+
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("img_dir", type=str, help="監視するディレクトリ")
+    parser.add_argument("out_dir", type=str, help="numbering の out_dir")
+    parser.add_argument("-m", "--mode", choices=["absolute", "relative", "copy"], default="copy",
+                        help="numbering の --mode. default is 'copy'")
+    parser.add_argument("-p", "--prefix", type=str, default="",
+                        help="numbering の --prefix. default is ''")
+    parser.add_argument("-b", "--begin_num", type=int, default=1,
+                        help="journal が無い場合の最初の番号. default is 1")
+    parser.add_argument("-n", "--devide_number", type=int, default=DEFAULT_DEVIDE_NUMBER,
+                        help=f"mkdir の --devide_number. default is {DEFAULT_DEVIDE_NUMBER}")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="mkdir の --output. default is out_dir")
+    parser.add_argument("--poll", action="store_true", help="inotify を使わずに定期的に走査する")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"走査の間隔[s] (--poll の場合). default is {DEFAULT_INTERVAL}")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help=f"最初のファイルが届いてからまとめて処理するまで待つ時間[s] (inotify の場合). "
+                        f"書き込みが続いていてもこの時間か{MAX_BATCH}個ごとに処理する. default is {DEFAULT_SETTLE}")
+    parser.add_argument("--once", action="store_true", help="未処理のファイルを処理したら監視せずに終了する")
+    transfer.add_arguments(parser)
+
+    return parser
+
+
+def main(*args, **kwargs):
+    src_dir = Path(kwargs['img_dir']).absolute()
+    assert src_dir.is_dir(), src_dir
+    out_dir = Path(kwargs['out_dir']).absolute()
+    if not out_dir.exists():
+        assert out_dir.parent.exists(), out_dir.parent
+    assert kwargs['devide_number'] > 0
+    datasets_root = Path(kwargs['output']).absolute() if kwargs['output'] is not None else out_dir
+
+    state = State(out_dir, kwargs['begin_num'])
+    print(f"numbered {len(state.done)} files. next number is {state.next_number}")
+    updater = Updater(src_dir, out_dir, datasets_root, state, kwargs)
+
+    # 起動前に届いていたファイル
+    updater.update(scan.scan(src_dir, hidden=False).files)
+    if kwargs['once'] or updater.dry_run:
+        return
+
+    watcher = open_watcher(src_dir, kwargs['poll'], kwargs['interval'], state.done)
+    signal.signal(signal.SIGTERM, _interrupt)
+    print(f"watching {src_dir} ({type(watcher).__name__}). Ctrl+C to stop")
+    try:
+        while True:
+            names = watcher.wait(kwargs['settle'])
+            if names is None: # 取りこぼした可能性がある場合は走査する
+                names = scan.scan(src_dir, hidden=False).files
+            updater.update(names)
+    except KeyboardInterrupt:
+        print("\nstop watching")
+    finally:
+        watcher.close()
+
+
+def _interrupt(signum, frame):
+    # SIGTERM(サービスとして動かした場合の停止)もCtrl+Cと同じく終了する
+    raise KeyboardInterrupt
+
+
+class State:
+    """ 処理済みのファイル名と次の番号. journal (無ければ json) から復元する
+    """
+    def __init__(self, out_dir: Path, begin_num: int):
+        self.journal_file = out_dir.joinpath(numbering.JOURNAL_NAME)
+        self.json_file = out_dir.joinpath(numbering.JSON_NAME)
+        self.done: Set[str] = set()
+        last_number = begin_num - 1
+        if self.journal_file.exists():
+            pairs = numbering.read_journal(self.journal_file)
+        elif self.json_file.exists():
+            with self.json_file.open("r") as f:
+                pairs = list(json.load(f).items())
+            self._write_journal(pairs)
+        else:
+            pairs = []
+        for out_name, img_name in pairs:
+            self.done.add(img_name)
+            last_number = max(last_number, numbering.parse_number(out_name))
+        self.next_number: int = last_number + 1
+
+
+    def _write_journal(self, pairs: List[Tuple[str, str]]):
+        # json しか無い場合(journal導入前の出力)は追記できるようにjournalを作る
+        with self.journal_file.open("w") as f:
+            for out_name, img_name in pairs:
+                f.write(json.dumps([out_name, img_name]) + "\n")
+
+
+class Updater:
+    """ 新しいファイルにだけ番号を振り、グループにリンクする. 1回の処理は届いたファイル数に比例する
+    """
+    def __init__(self, src_dir: Path, out_dir: Path, datasets_root: Path, state: State, kwargs: Dict):
+        self.src_dir = src_dir
+        self.out_dir = out_dir
+        self.out_imgs_dir = out_dir.joinpath("numberings")
+        self.datasets_root = datasets_root
+        self.state = state
+        self.kwargs = kwargs
+        self.dry_run: bool = kwargs.get('dry_run', False)
+        self.devide_number: int = kwargs['devide_number']
+        self.mode: str = kwargs['mode']
+        self.save_func: Callable[[Path, Path], None] = {
+            "absolute": numbering.link_as_absolute,
+            "relative": numbering.link_as_relative,
+            "copy": numbering.copy_file,
+        }[self.mode]
+        prefix = kwargs['prefix']
+        self.filename_prefix = "" if prefix == "" else f"{prefix}_"
+
+
+    def update(self, names: List[str]):
+        done = self.state.done
+        new_names = sorted({name for name in names if name not in done and is_target(name)})
+        if len(new_names) == 0:
+            return
+        jobs = list(numbering.plan_numbering(
+            new_names, self.src_dir, self.out_imgs_dir, self.filename_prefix, self.state.next_number, set()))
+
+        if self.dry_run:
+            dry_plan = plan.Plan().mkdir(self.out_dir).mkdir(self.out_imgs_dir)
+            for job in jobs:
+                if self.mode == "copy":
+                    dry_plan.copy(job.src, job.dst)
+                else:
+                    dry_plan.link(job.src, job.dst)
+            self._plan_links([job.dst.name for job in jobs], dry_plan)
+            plan.Executor(dry_run=True).run(dry_plan)
+            return
+
+        numbered = self._number(jobs)
+        self.state.next_number += len(jobs)
+        if len(numbered) == 0:
+            return
+        self._append_json(numbered)
+        link_plan = self._plan_links([job.dst.name for job in numbered], plan.Plan())
+        plan.Executor.from_kwargs(self.kwargs).run(link_plan)
+        print(f"numbered {len(numbered)} files ({numbered[0].dst.name} ~ {numbered[-1].dst.name})")
+
+
+    def _number(self, jobs: List[transfer.Job]) -> List[transfer.Job]:
+        """ 保存できたJobを番号順に返す. 失敗したファイルは未処理のまま(番号は欠番)にして監視を続ける
+        """
+        self.out_imgs_dir.mkdir(parents=True, exist_ok=True)
+        numbered: List[transfer.Job] = []
+        journal_file = self.state.journal_file
+        needs_newline = journal_file.exists() and journal_file.stat().st_size > 0 \
+            and not numbering.ends_with_newline(journal_file)
+        with journal_file.open("a", buffering=1) as journal:
+            if needs_newline:
+                journal.write("\n") # 中断で途中まで書かれた行を閉じる
+            def on_done(job: transfer.Job):
+                journal.write(json.dumps([job.dst.name, job.src.name]) + "\n")
+                self.state.done.add(job.src.name)
+                numbered.append(job)
+
+            engine = transfer.Engine.from_kwargs(self.kwargs, op=self.save_func, desc=self.mode)
+            result = engine.run(jobs, on_done=on_done)
+        try:
+            result.check()
+        except transfer.TransferError as e:
+            print(f"[Warning] {e}")
+        numbered.sort(key=lambda job: numbering.parse_number(job.dst.name))
+        return numbered
+
+
+    def _append_json(self, numbered: List[transfer.Job]):
+        pairs = [(job.dst.name, job.src.name) for job in numbered]
+        if not numbering.append_json(self.state.json_file, pairs):
+            numbering.write_json_from_journal(self.state.journal_file, self.state.json_file)
+
+
+    def _plan_links(self, numbered_names: List[str], link_plan: plan.Plan) -> plan.Plan:
+        key2group: Dict[str, Tuple[dict, List[str]]] = {}
+        for name in numbered_names:
+            info = mkdir.group_info_of(numbering.parse_number(name), self.devide_number)
+            info, group = key2group.setdefault(info['min'], (info, []))
+            group.append(name)
+        infos = [info for info, _ in key2group.values()]
+        mkdir.mkdir_groups(infos, self.datasets_root, link_plan)
+        mkdir.link_files([group for _, group in key2group.values()], infos, link_plan, self.out_imgs_dir)
+        return link_plan
+
+
+def is_target(name: str) -> bool:
+    """ ナンバリングする名前か (隠しファイルと画像以外は除く)
+    """
+    return not name.startswith(".") and os.path.splitext(name)[1] in numbering.IMG_SUFFIXES
+
+
+def open_watcher(path: Path, poll: bool, interval: float, done: Set[str]):
+    if not poll:
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            print(f"[Info] inotify is not available ({e}). poll every {interval}s")
+    return PollWatcher(path, interval, done)
+
+
+class InotifyWatcher:
+    """ 書き込みが完了したファイル(IN_CLOSE_WRITE)と移動されてきたファイル(IN_MOVED_TO)の名前を返す
+    """
+    def __init__(self, path: Path):
+        libc = ctypes.CDLL(None, use_errno=True) # 実行中のプロセスにリンクされたlibc
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported")
+        self._fd: int = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), str(path))
+
+
+    def wait(self, settle: float, max_batch: int = MAX_BATCH) -> Optional[List[str]]:
+        """ ファイルが届くまで待ち、最初のイベントからsettle秒経つか、max_batch個集まるまで集める.
+        (書き込みが続いていても最初のファイルからsettle秒以内に返す)
+        イベントの取りこぼし(キューの溢れ)があった場合はNone
+        """
+        names: List[str] = []
+        overflow = False
+        deadline: Optional[float] = None # 最初のイベントまでは無期限に待つ
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if len(readable) > 0:
+                overflow |= self._read(names)
+                if deadline is None and (len(names) > 0 or overflow):
+                    deadline = time.monotonic() + settle
+            if deadline is not None and (time.monotonic() >= deadline or len(names) >= max_batch or overflow):
+                break
+        return None if overflow else names
+
+
+    def _read(self, names: List[str]) -> bool:
+        try:
+            buf = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return False
+        overflow = False
+        offset = 0
+        while offset < len(buf):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif length > 0:
+                names.append(os.fsdecode(buf[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return overflow
+
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollWatcher:
+    """ interval秒ごとにディレクトリの更新日時を調べ、変わっていれば走査して未処理のファイルを候補にする.
+    候補のうち大きさと更新日時がinterval秒の間変わらなかったファイルの名前を返す
+    (ディレクトリの更新日時は名前の追加でしか変わらず、書き込み途中かは分からないため)
+
+    Args:
+        done (Set[str]): 処理済みの名前. Updaterが追加していくものをそのまま参照する
+    """
+    def __init__(self, path: Path, interval: float, done: Set[str]):
+        self._path = path
+        self._interval = interval
+        self._done = done
+        self._mtime_ns: Optional[int] = None # 最初は必ず走査する(起動時の処理の後に届いたファイル)
+        self._pending: Dict[str, Optional[Tuple[int, int]]] = {} # 候補 -> 前回の(大きさ, 更新日時)
+
+
+    def wait(self, settle: float) -> Optional[List[str]]:
+        """ 書き終わったファイルが見つかるまで待つ. 候補はinterval秒ごとに調べて返すのでsettleは使わない
+        """
+        while True:
+            time.sleep(self._interval)
+            mtime_ns = os.stat(self._path).st_mtime_ns
+            if mtime_ns != self._mtime_ns:
+                self._mtime_ns = mtime_ns
+                for name in scan.iter_files(self._path, hidden=False):
+                    if name not in self._done and name not in self._pending and is_target(name):
+                        self._pending[name] = None
+            names = self._stable_names()
+            if len(names) > 0:
+                return names
+
+
+    def _stable_names(self) -> List[str]:
+        names = []
+        for name, last in list(self._pending.items()):
+            try:
+                st = os.stat(self._path.joinpath(name))
+            except FileNotFoundError: # 一時ファイルが消された場合など
+                del self._pending[name]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current == last:
+                del self._pending[name]
+                names.append(name)
+            else:
+                self._pending[name] = current
+        return names
+
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESCRIPTION, epilog=EPILOG, formatter_class=RawTextHelpFormatter)
+    parser = add_arguments(parser)
+    main(**vars(parser.parse_args()))